@@ -21,7 +21,7 @@
 
 __all__ = ['Document']
 
-import codecs, json, logging, os, pickle, re
+import codecs, json, logging, os, pickle, re, tracing
 from sys import exit
 from urllib import parse, request
 from collections import OrderedDict
@@ -86,7 +86,8 @@ class Document(object):
                     raise APIError()
             for page in self.page_list:
                 query = self.api_attribute.format(page)
-                response = json.loads(request.urlopen(query).read().decode('utf-8'))
+                with tracing.span('attribute', page=page):
+                    response = json.loads(request.urlopen(query).read().decode('utf-8'))
                 rev_id = list(response["query"]["pages"].keys())[0]
                 user_list = response["query"]["pages"][rev_id]["revisions"]
                 for entry in user_list:
@@ -145,7 +146,8 @@ class Document(object):
             for call in calls:
                 filename = self.directory + '/raw/' + str(pages_count) + "/" + str(call_count) + ".json"
                 with codecs.open(filename, 'w', 'utf-8') as file:
-                    text = request.urlopen(call).read().decode('utf-8')
+                    with tracing.span('download', folder=pages_count, call=call_count):
+                        text = request.urlopen(call).read().decode('utf-8')
                     file.write(text)
                 call_count += 1
             pages_count += 1
@@ -180,23 +182,35 @@ class Document(object):
                                       "page list: {}".format(e.strerror))
         return api_calls
     
-    def json_to_text(self):
-        os.mkdir(os.curdir + '/text')
+    def batches(self):
+        '''Return a (folder, file) pair for each JSON batch in /raw, in order.'''
+        batches = list()
         folders = sorted(os.listdir(path=(os.curdir + '/raw')), key=int)
         for folder in folders:
-            os.mkdir(os.curdir + '/text/' + folder)
-            files = sorted(os.listdir(path=(os.curdir + '/raw/' + folder)), key=lambda x: int(x[0]))
-            for file in files:
-                with open(os.curdir + '/raw/' + folder + '/' + file, 'r') as f:
-                    data = f.read()
-                    json_data = json.loads(data)
-                    pagedict = dict()
-                    for key in json_data["query"]["pages"].keys():
-                        pagedict[json_data["query"]["pages"][key]["title"]] = key
-                    pagelist = sorted(pagedict.keys())
-                    with codecs.open(os.curdir + '/text/' + folder + '/' + file[0] +'.txt', 'w', 'utf-8') as textfile:
-                        for pagename in pagelist:
-                            textfile.write(json_data["query"]["pages"][pagedict[pagename]]['revisions'][0]["*"])
+            files = sorted(os.listdir(path=(os.curdir + '/raw/' + folder)),
+                           key=lambda x: int(os.path.splitext(x)[0]))
+            batches.extend((folder, file) for file in files)
+        return batches
+    
+    def json_to_text(self):
+        for folder, file in self.batches():
+            with tracing.span('json_to_text', folder=folder, file=file):
+                self.batch_to_text(folder, file)
+            
+    def batch_to_text(self, folder, file):
+        '''Write the pages of one JSON batch in /raw to the matching text file in /text.'''
+        if not os.path.exists(os.curdir + '/text/' + folder):
+            os.makedirs(os.curdir + '/text/' + folder)
+        with open(os.curdir + '/raw/' + folder + '/' + file, 'r') as f:
+            data = f.read()
+            json_data = json.loads(data)
+            pagedict = dict()
+            for key in json_data["query"]["pages"].keys():
+                pagedict[json_data["query"]["pages"][key]["title"]] = key
+            pagelist = sorted(pagedict.keys())
+            with codecs.open(os.curdir + '/text/' + folder + '/' + os.path.splitext(file)[0] + '.txt', 'w', 'utf-8') as textfile:
+                for pagename in pagelist:
+                    textfile.write(json_data["query"]["pages"][pagedict[pagename]]['revisions'][0]["*"])
                             
         
     def organize(self):
@@ -217,7 +231,8 @@ class Document(object):
                 current_url = self.api_txt.format(current_url)
 
                 # Get the text of the request
-                current_page = request.urlopen(current_url).read().decode('utf-8')
+                with tracing.span('organize_request', url=current_url):
+                    current_page = request.urlopen(current_url).read().decode('utf-8')
                 
                 # Search for the link to the next page in the document
                 next_r = re.search("\|\snext\s*=\s?[[]{2}(.*?)[]]{2}", current_page)
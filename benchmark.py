@@ -0,0 +1,973 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Microbenchmarks for the converter. Run "python benchmark.py" to time everything, or pass the
+names of individual benchmarks (e.g. "python benchmark.py output"). The suite ("python
+benchmark.py suite") times each stage of the converter on synthetic text and compares the rates
+with those in benchmark-baseline.json, which "--save-baseline" records on this machine.'''
+
+import argparse, codecs, escape, io, json, logging, os, random, re, reparse, sys, tempfile
+import synthetic, timeit, tracemalloc, wikitable
+from time import time
+from output import OutputBuffer
+from exceptions import TOCError
+from reparse import Reparser
+from toc import TOC
+from tokenizer import Tokenizer
+from tokenparser import Parser, ParseContext
+from util import findall, ProgressChecker
+from wikitable import Cell, Table
+from collections import OrderedDict
+
+def report(name, chars, seconds):
+    '''Print the throughput of a single timed run in MB/s.'''
+    rate = chars / seconds / 2**20 if seconds else float('inf')
+    print("{0:<40} {1:>10.2f} MB/s".format(name, rate))
+    return rate
+
+#===================================================================================================
+# OUTPUT
+#===================================================================================================
+def output_workload(repeat=20000):
+    '''The write pattern the parser produces: short words, punctuation and a check on the previous
+    character at every newline.'''
+    return ["Text", " ", "with", " ", "some", " ", "words", ".", "\n"] * repeat
+
+def seek_output(path, workload):
+    with codecs.open(path, 'w+', 'utf-8') as outputfile:
+        for text in workload:
+            if text == "\n":
+                outputfile.seek(-1, 1)
+                outputfile.read(1)
+            outputfile.write(text)
+
+def buffered_output(path, workload):
+    with codecs.open(path, 'w', 'utf-8') as outputfile:
+        with OutputBuffer(outputfile) as output:
+            for text in workload:
+                if text == "\n":
+                    output.last
+                output.write(text)
+
+def bench_output():
+    '''Compare writing straight to the output file (seeking back to find the previous character)
+    with writing through an OutputBuffer.'''
+    workload = output_workload()
+    chars = sum(len(text) for text in workload)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'out.tex')
+        for name, function in (('output: seek/read on file', seek_output),
+                               ('output: OutputBuffer', buffered_output)):
+            start_time = time()
+            function(path, workload)
+            report(name, chars, time() - start_time)
+
+#===================================================================================================
+# TEMPLATE SUBSTITUTION
+#===================================================================================================
+def legacy_careful_sub(text, traverse=False):
+    '''Reparser.careful_sub as it was before the rules were compiled into a single pass, kept as
+    the reference the rewrite engine is checked against.'''
+    text = re.sub(r'\{{2}hi\|\dem\|(?P<text>.*?)\}{2}', r'\g<text>', text)
+    text = re.sub(r'\{{2}u\|(?P<text>.*?)\}{2}', r'\\uline{\g<text>}', text)
+    text = re.sub(r'\{{2}larger\|(?P<text>.*?)\}{2}',
+                  r'\\begin{large}\g<text>\\end{large}', text)
+    text = re.sub(r'\{{2}x\-smaller\|(?P<text>.*?)\}{2}',
+                  r'\\begin{footnotesize}\g<text>\\end{footnotesize}', text)
+    text = re.sub(r'\{{2}x\-larger\|(?P<text>.*?)\}{2}',
+                  r'\\begin{Large}\g<text>\\end{Large}', text)
+    text = re.sub(r"'{3}(?P<text>.*?)'{3}", r'\\textbf{\g<text>}', text)
+    text = re.sub(r'[[]{2}(?:(?:.*?)\|)?(?P<link>.*?)[]]{2}', r'\g<link>',
+                  text)
+    text = re.sub(r'<br\s?/?>', r'\\\\\n', text)
+    text = re.sub(r'[{]{2}popup\snote\|(.*?)\|(?P<text>.*?)[}]{2}', r'\g<text>', text)
+    text = re.sub(r'\{{2}(?:block\s)?right\|(?P<text>.*?)\}{2}',
+                  r'\\begin{flushright}\g<text>\\end{flushright}', text)
+    text = text.replace('<u>', '\\uline{').replace('</u>', '}').replace('✓', '{\\checked}')
+    text = text.replace("–", "--").replace("—", "---")
+    text = text.replace("□", "\\Square~").replace("|", "{\\textbar}")
+    if traverse:
+        text = text.replace("{", "`").replace("}", "@@")
+        text = text.replace("\n", "~")
+    return text
+
+# Pieces of wikitext that random test strings are made of: every delimiter the rules look for,
+# characters that could join up into one, and plain text
+TEMPLATE_PIECES = ['{{hi|1em|', '{{u|', '{{larger|', '{{x-smaller|', '{{x-larger|', '{{popup note|',
+                   '{{right|', '{{block right|', '}}', '{{', '{', '}', "'''", "''", "'", '[[', ']]',
+                   '[', ']', '|', '<br>', '<br/>', '<br />', '<b', 'r>', '<', '<u>', '</u>', '\n',
+                   ' ', '✓', '–', '—', '□', 'text', 'more words', 'X-12']
+
+def random_text(rng, pieces, length=12):
+    return ''.join(rng.choice(pieces) for i in range(rng.randint(0, length)))
+
+def template_workload(repeat=2000):
+    '''Token values of the kind careful_sub sees: mostly plain text and single templates.'''
+    values = ["{{u|Top Secret}} - Sensitive", "'''DECLASSIFIED''' Authority NND 011",
+              "{{larger|IV. B. Evolution of the War}}", "text with a [[w:Saigon|link]] in it",
+              "first line<br />second line", "{{x-smaller|(Continued)}}", "Plain words – here",
+              "{{right|'''A-12'''}}", "{{popup note|DOD|Department of Defense}} report"]
+    return values * repeat
+
+def bench_careful_sub():
+    '''Compare the legacy careful_sub with the single-pass one.'''
+    workload = template_workload()
+    chars = sum(len(text) for text in workload)
+    reparser = Reparser()
+    for name, function in (('careful_sub: sequential re.sub', legacy_careful_sub),
+                           ('careful_sub: single pass', reparser.careful_sub)):
+        start_time = time()
+        for text in workload:
+            function(text)
+        report(name, chars, time() - start_time)
+
+#===================================================================================================
+# NESTED TEMPLATES
+#===================================================================================================
+def legacy_traverse(reparser, text):
+    '''Reparser.traverse as it was before the stack-based walk: rewrite the innermost template,
+    hide its braces and newlines behind sentinel characters, and start again.'''
+    while True:
+        l = findall(text, "{{")
+        r = findall(text, "}}")
+        if len(l) < len(r):
+            text = text[:-2]
+            r.pop()
+        elif len(l) == 0:
+            break
+        else:
+            temp = legacy_careful_sub(text[l[-1]:r[0]+2], True)
+            text = text.replace(text[l[-1]:r[0]+2], temp)
+    text = text.replace("~", "\n")
+    text = legacy_final_sub(text)
+    text = text.replace("`", "{").replace("@@", "}")
+    return text
+
+# Template content for the cross-check. The legacy version treats `, @@ and ~ as its own sentinels
+# (and so mangles them), so they are left out, as is the □ whose LaTeX ends in a ~. It also lets a
+# ''' left over in a nested template pair up with one around it, so bold text is kept whole, and
+# single braces, which can join up into templates side by side.
+NESTED_PIECES = ["'''bold'''", '|', '<br>', '<u>', '</u>', '\n', ' ', '✓', '–', '#', '&', '%',
+                 'text', 'A-12']
+
+def nested_text(rng, depth=4):
+    '''A chain of nested templates (the legacy version never finishes on templates side by side).'''
+    opens = [rng.choice(['{{u|', '{{larger|', '{{right|', '{{block right|', '{{hi|1em|'])
+             for i in range(rng.randint(1, depth))]
+    middle = [random_text(rng, NESTED_PIECES, 3) for i in range(len(opens) + 1)]
+    text = ''.join(middle[i] + opens[i] for i in range(len(opens))) + middle[-1]
+    for i in range(len(opens)):
+        text += random_text(rng, NESTED_PIECES, 2) + '}}'
+    return text + '}}' * rng.randint(0, 1)
+
+def bench_traverse():
+    '''Compare the legacy traverse with the stack-based one on deeply nested {{block right|}}.'''
+    reparser = Reparser()
+    size = reparse.memo_size
+    reparse.set_memo_size(0) # Otherwise the repeats would only find the result remembered
+    try:
+        for depth in (10, 100, 1000):
+            text = ("{{block right|'''Top''' " * depth + "{{u|SECRET}} – Sensitive"
+                    + " continued}}" * depth)
+            repeat = max(1, 1000 // depth)
+            for name, function in (('traverse: legacy',
+                                    lambda text: legacy_traverse(reparser, text)),
+                                   ('traverse: stack', reparser.traverse)):
+                start_time = time()
+                for i in range(repeat):
+                    function(text)
+                report(name + ", depth " + str(depth), len(text) * repeat, time() - start_time)
+    finally:
+        reparse.set_memo_size(4096 if size is None else size)
+
+#===================================================================================================
+# ESCAPING
+#===================================================================================================
+def legacy_final_sub(text):
+    '''Reparser.final_sub as it was before the escaping tables.'''
+    text = text.replace("#", "\\#").replace("$", "\\$").replace("%", "\\%")
+    text = text.replace("_", "\\_").replace("^", "\\^").replace("~", "\\~")
+    text = text.replace("&", "\\&")
+    return text
+
+def legacy_cell_escape(cell):
+    '''The character replacements at the end of Cell.parse before the escaping tables.'''
+    cell = cell.replace("#", "\\#").replace("$", "\\$").replace("%", "\\%")
+    cell = cell.replace("_", "\\_").replace("^", "\\^").replace("~", "\\~")
+    cell = cell.replace("&", "\\&").replace("□", "\\Square~")
+    cell = cell.replace("▣", "\\CheckedBox~").replace("|", "{\\textbar}")
+    cell = cell.replace("–", "--").replace("—", "---").replace("✓", "{\\checked}")
+    return cell
+
+def legacy_punct(value):
+    '''Parser.punct before the escaping tables.'''
+    if value in ["#", "$", "%", "&", "_", "\\"]:
+        value = "\\" + value
+    elif value == "°":
+        value = "{\\degree}"
+    elif value == "–":
+        value = "--"
+    elif value == "—":
+        value = "---"
+    elif value == "|":
+        value = "{\\textbar}"
+    elif value in ("}", "{"):
+        value = ""
+    elif value == "✓":
+        value = "{\\checked}"
+    return value
+
+def legacy_sub(text):
+    '''Reparser.sub before the escaping tables.'''
+    return legacy_final_sub(legacy_careful_sub(text))
+
+def legacy_toc_sub(text):
+    '''The substitutions toc.py applied to a line before the escaping tables.'''
+    return legacy_sub(text).replace("{\\textbar}", " ")
+
+# Every character any of the tables maps, and some they don't
+ESCAPE_CHARS = '#$%_^~&□▣|–—✓°{}\\<>/u\' aZ9\n'
+
+def bench_escape(repeat=20000):
+    '''Compare the legacy replacement chains with the escaping tables.'''
+    rng = random.Random(0)
+    # Mostly prose, with a character to escape every 30 or so
+    text = ''.join(rng.choice(ESCAPE_CHARS) if rng.random() < 0.03 else rng.choice('abcdefghij ')
+                   for i in range(100))
+    workload = [text[i:] + text[:i] for i in range(100)] * (repeat // 100)
+    chars = sum(len(text) for text in workload)
+    reparser = Reparser()
+    for name, function in (('final_sub: str.replace chain', legacy_final_sub),
+                           ('final_sub: table', reparser.final_sub),
+                           ('cell: str.replace chain', legacy_cell_escape),
+                           ('cell: table', escape.CELL.sub)):
+        start_time = time()
+        for text in workload:
+            function(text)
+        report(name, chars, time() - start_time)
+    values = [rng.choice(ESCAPE_CHARS) for i in range(repeat * 10)]
+    for name, function in (('punct: if/elif chain', legacy_punct),
+                           ('punct: table', escape.PUNCT.sub)):
+        start_time = time()
+        for value in values:
+            function(value)
+        report(name, len(values), time() - start_time)
+
+#===================================================================================================
+# TABLES OF CONTENTS
+#===================================================================================================
+class LegacyTOC(object):
+    '''toc.TOC as it was before it was built in one pass, appending to strings a character at a
+    time (with its page number substitution fixed).'''
+    def __init__(self):
+        self.reparser = Reparser()
+        self.logger = logging.getLogger("W2L")
+        
+        self.text = ''          # Raw wikitext
+        self.lines = []
+        self.levels = dict()
+        self.props = ''
+        self.latex = ''
+        self.is_newpage = False
+        self.is_page_list = False
+        self.declassified = ("\\begin{spacing}{0.7}\n\\begin{center}\n\\begin{scriptsize}\\textbf" 
+        "{Declassified} per Executive Order 13526, Section 3.3\\\\NND Project Number: NND 63316." 
+        "By: NWD Date: 2011\n\\vspace{2em}\n\\end{scriptsize}\n\\end{center}\n\\end{spacing}\n")
+        
+    def append(self, text):
+        self.text += text
+        
+    def begin(self):
+        ind = self.text.find("|")
+        self.text = self.text[ind:]
+        self.lines = self.text.replace('\n','').split("|-")
+        if len(self.lines[0]) == 0:
+            self.lines.pop(0)
+        self.parse()
+        self.make_props()
+        return self.end()
+    
+    def end(self):
+        latex = ('\\begin{small}\n\\begin{easylist}\n' + self.props + self.latex + 
+                 '\\end{easylist}\n\\end{small}')
+        return latex
+        
+    def make_props(self):
+        if self.is_page_list:
+            page_key = sorted(list(self.levels.keys()))[-1]
+            del self.levels[str(page_key)]
+        self.props += '\\ListProperties(Space=-2.3mm,Space*=-2.3mm,Hang=true,Progressive*=2em,'
+        num_levels = len(self.levels)
+        for level in range(1,num_levels+1):
+            try:
+                val = self.levels[str(level)]
+            except:
+                pass
+                self.logger.exception("Improperly-formatted table.")
+            else:
+                if re.match(r'[I]', val):
+                    self.props += 'Numbers' + str(level) + '=R,'
+                    if level > 1:
+                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
+                elif re.match(r'[A]', val):
+                    self.props += 'Numbers' + str(level) + '=L,'
+                    if level > 1:
+                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
+                elif re.match(r'[1]+', val):
+                    if level > 1:
+                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
+                elif re.match(r'[a]', val):
+                    self.props += 'Numbers' + str(level) + '=l,'
+                    if level > 1:
+                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
+                else:
+                    if level > 1:
+                        self.props += 'Hide' + str(level) + '=' + str(level) + ','
+        self.props = self.props[:-1] + ')\n'
+        
+    def newpage(self, line):
+        self.is_newpage = True
+        ind = line.find("---NEWPAGE---")
+        list_text = line[:ind]
+        return list_text
+        
+    def parse(self):
+        if "Page" in self.lines[0]:
+            self.is_page_list = True
+        for line in self.lines:
+            if len(line) > 0:
+                if "---NEWPAGE---" in line:
+                    line = self.newpage(line)
+                level = 0
+                ind = 0
+                while line[ind] == "|":
+                    level += 1
+                    ind += 1
+                if str(level) not in self.levels:
+                    self.levels[str(level)] = line[ind]
+                line = line[ind:]
+                r = re.match(r'([A-Za-z0-9]{1,4}\.\s?\|)?(?:colspan="\d"\|)?(?P<text>.*)', line, flags=re.MULTILINE)
+                if r != None:
+                    line = r.group('text')
+                else:
+                    raise TOCError
+                line = self.reparser.sub(line, escape.TOC)
+                if self.is_page_list:
+                    if r'\uline{Page}' in line:
+                        self.latex += "\\hfill " + line + "\n"
+                    else:
+                        line = re.sub(r'(?P<num>[A-Z]-\d{1,3})', r'\\hfill \g<num>', line)
+                        self.latex += "@"*level + " " + line + "\n"
+                        if self.is_newpage:
+                            self.latex += "\\newpage\n"
+                            self.latex += self.declassified
+                            self.is_newpage = False
+                else:
+                    self.latex += "@"*level + " " + line + "\n"
+                    if self.is_newpage:
+                        self.latex += "\\newpage\n"
+                        self.latex += self.declassified
+                        self.is_newpage = False
+
+def outline(rng, entries=2000, page_list=False):
+    '''The wikitext of a table of contents (or a page list) with the given number of entries, in
+    the one-character pieces the lexer hands to TOC.append.'''
+    numbers = ['I', 'A', '1', 'a']
+    lines = [list('|{{u|Page}}\n')] if page_list else []
+    level = 0
+    for i in range(entries):
+        level = rng.randint(1, min(level + 1, 4))
+        text = random_text(rng, ['Summary', ' ', 'of the', '{{u|Task Force}}', '&', '–', '%',
+                                 'Vietnam', "'''U.S.'''"], 4)
+        page = ' ' + rng.choice('ABCD') + '-' + str(rng.randint(1, 999)) if page_list else ''
+        lines.append(list('|' * level + numbers[level - 1] + '. ' + text + page + '\n'))
+        if rng.random() < 0.01:
+            # The table is continued on the next page
+            lines[-1].append('---NEWPAGE---')
+    pieces = list()
+    for line in lines:
+        pieces.extend(list('|-\n') + line)
+    return pieces
+
+def build_toc(cls, pieces):
+    contents = cls()
+    for piece in pieces:
+        contents.append(piece)
+    return contents.begin()
+
+def bench_toc():
+    '''Compare the legacy TOC with the one-pass one on a 2,000-entry outline and page list.'''
+    rng = random.Random(0)
+    size = reparse.memo_size
+    reparse.set_memo_size(0) # Otherwise the second one would find its headings remembered
+    try:
+        for page_list in (False, True):
+            pieces = outline(rng, 2000, page_list)
+            chars = sum(len(piece) for piece in pieces)
+            for name, cls in (('legacy', LegacyTOC), ('one pass', TOC)):
+                start_time = time()
+                build_toc(cls, pieces)
+                report("toc: " + name + (", page list" if page_list else ", outline"), chars,
+                       time() - start_time)
+    finally:
+        reparse.set_memo_size(4096 if size is None else size)
+
+#===================================================================================================
+# TABLES
+#===================================================================================================
+def table_tokens(rng, rows=20, columns=4):
+    '''The tokens of a random wikitable, with some cells spanning several columns, some rows
+    short and a border on some tables.'''
+    tokens = [('WIKITABLE', ('{|', None)),
+              ('FORMAT', (rng.choice([None, '80']), None, rng.choice([None, '1']), None, None))]
+    for i in range(rows):
+        tokens.append(('NEWROW', '|-\n'))
+        width = 0
+        while width < rng.randint(1, columns):
+            tokens.append(('TCELL', '|'))
+            if rng.random() < 0.1:
+                tokens.append(('WT_COLSPAN', str(rng.randint(2, 3))))
+                width += 1
+            tokens.extend(('CELL_CONTENTS', char)
+                          for char in random_text(rng, TEMPLATE_PIECES[:4] + ['text', ' '], 3))
+            tokens.append(('E_TCELL', 'endcell'))
+            width += 1
+    tokens.append(('E_WIKITABLE', '|}'))
+    return tokens
+
+def convert_tokens(parser, tokens, progress=None):
+    output = OutputBuffer(io.StringIO())
+    parser.dispatch(tokens, ParseContext(output, progress))
+    output.flush()
+    return output.stream.getvalue()
+
+def bench_tables():
+    '''Compare tables built whole with streamed ones, on a 1,000-row table.'''
+    tokens = table_tokens(random.Random(0), 1000, 8)
+    chars = sum(len(token[1]) for token in tokens if token[0] == 'CELL_CONTENTS')
+    for name, parser in (('tables: whole', Parser()),
+                         ('tables: streamed', Parser(stream_tables=True))):
+        start_time = time()
+        convert_tokens(parser, tokens)
+        report(name, chars, time() - start_time)
+
+class LegacyTable(object):
+    '''wikitable.Table as it was before the slotted model, keeping its format in dicts and
+    finding the number of columns by scanning all rows at the end.'''
+    def __init__(self):
+        # Text containing the full table that will be returned
+        self.table = ''
+        
+        # Storage for various parts of the table. These are all strings that will later be
+        # concatenated in order.
+        self.t = OrderedDict()
+        self.t['begin'] = '\\begin{small}\n\\begin{spacing}{0.8}\n\\begin{tabularx}' # Begin table environment
+        self.t['width'] = '{\\textwidth}'       # Width of the full table
+        self.t['table_spec'] = ''               # Table column specifications
+        self.t['hline'] = ''                    # A beginning /hline in case the table is bordered
+        self.t['table_text'] = ''               # self.rows in its final text form
+        self.t['end'] = '\\end{tabularx}\\\\\n\\end{spacing}\n\\end{small}\n' # End table environment
+        
+        # Storage that is useful in creating the tables, but don't contain the final strings.
+        self.rows = []                          # List containing each row of the table
+        self.row_entries = []                   # List containing each entry in the row
+        
+        # Table format settings, initialized with the default values
+        self.format = dict()
+        self.format['twidth'] = 1               # Width of entire table as coefficient of /textwidth
+        self.format['border'] = False           # Entire table is bordered
+        self.format['multicol'] = False         # True if table contains ANY multicolumns
+        self.format['colnum'] = None            # Number of columns in the table
+        self.format['colwidth'] = None          # Width of each col in multicolumn table as coefficient of /textwidth
+        self.format['alignment'] = 'left'       # Text alignment of ALL the cells
+        self.format['contents'] = False         # Is the table a contents table?
+
+    def append_cell(self, cell):
+        '''Add a fully-formatted cell to the table.'''
+        self.row_entries.append(cell)
+        
+    def append_row(self):
+        if len(self.row_entries) > 0:
+            self.rows.append(self.row_entries)
+        self.row_entries = []
+        
+    def end(self):
+        '''Perform the final formatting and concatenation, return the LaTeX table to write to
+        the file.'''
+        # Append last row if necessary
+        if len(self.row_entries) > 0:
+            self.rows.append(self.row_entries)
+        # Determine column length
+        if not self.format['multicol']:
+            self.set_columns()
+            for row in self.rows:
+                while len(row) < self.format['colnum']:
+                    row.append(' ')
+        # Adjust table if it contains multicolumns
+        if self.format['multicol']:
+            self.multicolumn()
+        # Add table_spec
+        if not self.format['contents']:
+            if self.format['border']:
+                    self.t['table_spec'] = '{|*{' + str(self.format['colnum']) + '}{X|}}\n'
+            else:
+                    self.t['table_spec'] = '{*{' + str(self.format['colnum']) + '}{X}}\n'
+        else:
+            self.t['table_spec'] = '{*{' + str(self.format['colnum']) + '}{X}}\n'
+        # Combine self.rows into string
+        for row in self.rows:
+            if self.format['border']:
+                self.t['table_text'] += ' & '.join(row) + ' \\\\ \\hline \n'
+            else:
+                self.t['table_text'] += ' & '.join(row) + ' \\\\\n'
+        for value in self.t:
+            self.table += self.t[value]
+        return self.table
+    
+    def multicolumn(self):
+        # Find number of columns in the table
+        for row in self.rows:
+            cols = int()
+            for member in row:
+                if type(member) is list:
+                    cols += int(member[0])
+                else:
+                    cols += 1
+            if not self.format['colnum'] or cols > self.format['colnum']:
+                self.format['colnum'] = cols
+        # Add multicolumn formatting
+        for i in range(len(self.rows)):
+            new_row = []
+            for ind, member in enumerate(self.rows[i]):
+                arw = '2' if ind==0 else ''
+                if type(member) is list:
+                    if self.format['border']:
+                        new_row.append('\\multicolumn{' + member[0] + '}{|p{\\dimexpr' +
+                                       str(int(member[0])/self.format['colnum']) +
+                                       '\\linewidth-2\\tabcolsep-' + arw + '\\arrayrulewidth}|}{'
+                                       + member[1] + '}')
+                    else:
+                        new_row.append('\\multicolumn{' + member[0] + '}{p{\\dimexpr' +
+                                       str(int(member[0])/self.format['colnum']) +
+                                       '\\linewidth-2\\tabcolsep-' + arw + '\\arrayrulewidth}}{'
+                                       + member[1] + '}')
+                else:
+                    new_row.append(member)
+            self.rows[i] = new_row
+        
+    def set_alignment(self, a):
+        if a == 'center':
+            self.format['alignment'] = 'center'
+    
+    def set_columns(self):
+        '''Set columns only for tables without multicolumns.'''
+        for row in self.rows:
+            if self.format['colnum'] == None or len(row) > self.format['colnum']:
+                self.format['colnum'] = len(row)
+    
+    def set_width(self, w):
+        w = round(float(w)/100, 2)
+        if w == 1:
+            self.format['twidth'] = 1
+        elif w < .7:
+            self.format['twidth'] = 0.7
+            self.t['width'] = '{0.7\\textwidth}'
+        else:
+            self.format['twidth'] = w
+            self.t['width'] = '{' + str(w) + '\\textwidth}'
+        
+class LegacyCell(object):
+    '''wikitable.Cell as it was before the slotted model.'''
+    def __init__(self, table):
+        # TODO: Though "center" is being stored, it is not being implemented in any way.
+        self.table = table                      # The table this cell will be a part of
+        self.cell = ''                          # The cell string
+        
+        # Row format settings, initialized with the default values
+        self.r_format = dict()
+        self.r_format['center'] = False
+        
+        # Cell format settings, initialized with the default values
+        self.c_format = dict()
+        self.c_format['colspan'] = None         # Number of columns to span
+        self.c_format['border'] = None          # Border around just this cell?
+        self.c_format['center'] = False         # Center just this cell?
+    
+    
+    def append(self, text):
+        self.cell += text
+        
+    def cell_style(self, style, row_center=False):
+        # TODO: Allow border-left/right: 0px, if possible.
+        if 'border: 1px solid' in style:
+            self.c_format['border'] = True
+        if 'text-align: center' in style or row_center:
+            self.c_format['center'] = True
+        
+    def end(self):
+        '''Format and concatenate the cell, return it so it can be appended to the table.'''
+        self.parse()
+        if len(self.table.rows) == 0 and len(self.table.row_entries) == 0:
+            if self.cell == "I.":
+                self.table.format['contents'] = True
+        return self.cell
+    
+    def parse(self):
+        '''Parses out any formatting from the cell's content.'''
+        if ' |' in self.cell[0:2]:
+            self.cell = self.cell[2:]
+        elif '  |' in self.cell [0:3]:
+            self.cell = self.cell[3:]
+        self.cell = re.sub(r'\[{2}(?:(.*?)\|)?(?P<text>.*?)\]{2}', r'\g<text>', self.cell)
+        self.cell = re.sub(r'\{{2}popup\snote\|(.*?)\|(?P<text>.*?)\}{2}', r'\g<text>', self.cell)
+        self.cell = re.sub(r'&nbsp;', ' ', self.cell)
+        self.cell = re.sub(r'\{{2}larger\|(?P<text>.*?)\}{2}',
+                              r'\\begin{large}\g<text>\\end{large}', self.cell)
+        self.cell = re.sub(r'{{2}x-smaller(?:\sblock)?\|(?P<text>.*?)\}{2}',
+                              r'\\begin{footnotesize}\g<text>\\end{footnotesize}', self.cell)
+        self.cell = re.sub(r'<s>(?P<text>.*?)</s>', r'\\sout{\g<text>}', self.cell)
+        self.cell = re.sub(r"\s?'''(?P<text>.*?)'''", r'\\textbf{\g<text>}', self.cell)
+        self.cell = re.sub(r"('')(?P<text>.*?)('')", r'\\textit{\g<text>}',
+                           self.cell)
+        self.cell = re.sub(r'(\{{2}u\||<u>)(?P<text>.*?)(\}{2}|</u>)', r'\\uline{\g<text>}',
+                           self.cell)
+        self.cell = re.sub(r'<br\s?/?>', r' \\newline ', self.cell)
+        self.cell = escape.CELL.sub(self.cell)
+        if self.c_format['border']:
+            self.cell = '\\fbox{' + self.cell + '}'
+        if self.c_format['colspan']:
+            self.cell = [self.c_format['colspan'], self.cell]
+    
+    def reset(self):
+        '''Resets only the cell details; retains row information.'''
+        self.cell = ['', '', '']
+        self.c_format['colspan'] = None
+
+def random_table(rng, rows=20, columns=4):
+    '''A random table as (width, border, rows), each row a list of (wikitext, colspan) cells.'''
+    table = []
+    for i in range(rows):
+        row = []
+        width = 0
+        while width < rng.randint(1, columns):
+            colspan = str(rng.randint(2, 3)) if rng.random() < 0.1 else None
+            row.append((random_text(rng, TEMPLATE_PIECES[:4] + ['text', ' ', '&'], 3), colspan))
+            width += 1
+        table.append(row)
+    return rng.choice([None, '80']), rng.random() < 0.5, table
+
+def build_legacy_table(spec, cells=True):
+    '''Build a table with the legacy model, the way the parser's handlers did. Without cells, the
+    wikitext is added to the table as it is, leaving out the conversion of the cells.'''
+    width, border, rows = spec
+    table = LegacyTable()
+    if width:
+        table.set_width(width)
+    if border:
+        table.format['border'] = True
+        table.t['hline'] = '\\hline\n'
+    for row in rows:
+        table.append_row()
+        for text, colspan in row:
+            if not cells:
+                table.format['multicol'] = table.format['multicol'] or bool(colspan)
+                table.append_cell([colspan, text] if colspan else text)
+                continue
+            cell = LegacyCell(table)
+            if colspan:
+                cell.c_format['colspan'] = colspan
+                table.format['multicol'] = True
+            cell.append(text)
+            table.append_cell(cell.end())
+    return table.end()
+
+def build_table(spec, stream=False, write=None, cells=True):
+    '''Build a table with wikitable.Table, streamed if asked to, passing what it returns to
+    write. Without cells, as with build_legacy_table.'''
+    width, border, rows = spec
+    multicol = any(colspan for row in rows for text, colspan in row)
+    columns = max(sum(int(colspan) if colspan else 1 for text, colspan in row) for row in rows)
+    table = Table(columns, multicol) if stream else Table()
+    write = write or (lambda text: None)
+    if width:
+        table.set_width(width)
+    if border:
+        table.border = True
+        table.hline = '\\hline\n'
+    for row in rows:
+        write(table.append_row())
+        for text, colspan in row:
+            if not cells:
+                table.multicol = table.multicol or bool(colspan)
+                table.append_cell(text, colspan)
+                continue
+            cell = Cell(table)
+            if colspan:
+                cell.colspan = colspan
+                table.multicol = True
+            cell.append(text)
+            table.append_cell(cell.end(), cell.colspan)
+    write(table.end())
+
+def measure(function, *args):
+    '''Run function, returning the seconds it took and the peak memory it allocated in MB.'''
+    tracemalloc.start()
+    start_time = time()
+    function(*args)
+    seconds = time() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak / 2**20
+
+def bench_table_model():
+    '''Time and memory of a table-heavy chapter (10 tables of 2,000 rows) with the legacy model and
+    the slotted one, built whole and streamed. The cells are added as they are, since converting
+    them would take most of the time. The time is measured without tracemalloc.'''
+    rng = random.Random(0)
+    chapter = [random_table(rng, 2000, 8) for i in range(10)]
+    chars = sum(len(text) for spec in chapter for row in spec[2] for text, colspan in row)
+    def legacy():
+        for spec in chapter:
+            build_legacy_table(spec, cells=False)
+    def slotted(stream=False):
+        for spec in chapter:
+            build_table(spec, stream, cells=False)
+    for name, function, args in (('tables: legacy model', legacy, ()),
+                                 ('tables: slotted, whole', slotted, ()),
+                                 ('tables: slotted, streamed', slotted, (True,))):
+        start_time = time()
+        function(*args)
+        report(name, chars, time() - start_time)
+        print("{0:<40} {1:>10.3f} MB peak".format('', measure(function, *args)[1]))
+
+# Pieces of cell wikitext: every delimiter Cell.parse looks for, the whitespace and apostrophes
+# around which the rules could interact, and plain text and characters to escape
+CELL_PIECES = ['[[', ']]', '|', '{{popup note|', '}}', '&nbsp;', '{{larger|', '{{x-smaller|',
+               '{{x-smaller block|', '<s>', '</s>', "'''", "''", "'", '{{u|', '<u>', '</u>',
+               '<br>', '<br />', ' ', '\n', 'text', '&', '#', '□', '–']
+
+def legacy_cell_parse(text):
+    cell = LegacyCell(LegacyTable())
+    cell.cell = text
+    cell.parse()
+    return cell.cell
+
+def cell_parse(text):
+    cell = Cell(Table())
+    cell.cell = text
+    cell.parse()
+    return cell.cell
+
+def cell_workload(count=20000, seed=0):
+    '''Cells as they are found in the appendix tables: mostly plain text and numbers, with the
+    odd link, bold heading or forced space.'''
+    rng = random.Random(seed)
+    pieces = ['Total', ' ', '1,200', 'Saigon', '–', '&nbsp;', "'''FY 1965'''", "''n.a.''",
+              '[[w:MACV|MACV]]', '<br />', '{{u|Dec}}', '%', '(est.)', 'Army']
+    return [random_text(rng, pieces, rng.randint(1, 6)) for i in range(count)]
+
+def bench_cell_parse():
+    '''Compare the legacy Cell.parse with the single-pass one.'''
+    workload = cell_workload()
+    chars = sum(len(text) for text in workload)
+    for name, function in (('cells: sequential re.sub', legacy_cell_parse),
+                           ('cells: single pass', cell_parse)):
+        start_time = time()
+        for text in workload:
+            function(text)
+        report(name, chars, time() - start_time)
+        start_time = time()
+        for text in workload:
+            function(text)
+        seconds = time() - start_time
+        print("{0:<40} {1:>10.0f} cells/s".format('', len(workload) / seconds))
+
+#===================================================================================================
+# SUITE
+#===================================================================================================
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-baseline.json')
+
+def only(block):
+    '''A mix of nothing but the given block.'''
+    return dict(dict.fromkeys(synthetic.MIX, 0), **{block: 1})
+
+def slices(tokens, start, end):
+    '''The runs of tokens from each start token to the end token that closes it.'''
+    runs = list()
+    for i, token in enumerate(tokens):
+        if token[0] == start:
+            begin = i
+        elif token[0] == end:
+            runs.append(tokens[begin:i + 1])
+    return runs
+
+def toc_pieces(tokens):
+    '''What the parser's handlers append to a TOC for the tokens inside one.'''
+    return [token[1] if token[0] == 'TOC_TEXT' else '---NEWPAGE---' for token in tokens
+            if token[0] in ('TOC_TEXT', 'NEWPAGE')]
+
+def suite_workloads(size=2**19, seed=0):
+    '''The workload of each stage as (name, chars, function), all from synthetic text: the whole
+    text for the tokenizer and the parser, the markup of synthetic sentences for the Reparser, and
+    text of nothing but tables of contents or wikitables for those.'''
+    rng = random.Random(seed)
+    text = synthetic.text(size, seed=seed)
+    tokens = Tokenizer(False).analyze(text)
+    fragments = list()
+    while sum(len(fragment) for fragment in fragments) < size // 4:
+        fragments.append(synthetic.sentence(rng, markup=0.5))
+    toc_text = synthetic.text(size // 4, only('toc'), seed)
+    contents = [toc_pieces(run) for run in
+                slices(Tokenizer(False).analyze(toc_text), 'TOC', 'E_TOC')]
+    table_text = synthetic.text(size // 4, only('wikitable'), seed)
+    tables = slices(Tokenizer(False).analyze(table_text), 'WIKITABLE', 'E_WIKITABLE')
+    return [('tokenize', len(text), lambda: Tokenizer(False).analyze(text)),
+            ('parse', len(text), lambda: convert_tokens(Parser(), tokens, ProgressChecker())),
+            ('reparser', sum(len(fragment) for fragment in fragments),
+             lambda: [Reparser().sub(fragment) for fragment in fragments]),
+            ('toc', sum(len(piece) for pieces in contents for piece in pieces),
+             lambda: [build_toc(TOC, pieces) for pieces in contents]),
+            ('wikitable', sum(len(token[1]) for table in tables for token in table
+                              if isinstance(token[1], str)),
+             lambda: [convert_tokens(Parser(), table) for table in tables])]
+
+def calibration(text):
+    '''Work that runs none of the converter's code: counting the words of text.'''
+    counts = dict()
+    for word in text.split():
+        counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items())
+
+def calls(function, seconds=1.0):
+    '''How many calls to function take about seconds.'''
+    number, taken = timeit.Timer(function).autorange()
+    return max(1, int(round(number * seconds / taken)))
+
+def bench_suite(size=2**19, repeat=5):
+    '''Time each stage of the converter on synthetic text, with the memos off so every call does
+    the same work. Each repetition times every stage over about a second's worth of calls, with
+    the garbage collector off (as timeit does), and a calibration that runs none of the
+    converter's code. How fast a stage is next to the calibration of the same repetition doesn't
+    change when the whole machine gets slower, so that is what is compared with the baseline.
+    Noise only ever adds time, so the fastest repetition is taken, and how far the median is
+    behind it is kept as the spread. Returns the rate in MB/s, the speed next to the calibration
+    and the spread of each stage, by name.'''
+    stages = OrderedDict()
+    memo = reparse.memo_size
+    reparse.set_memo_size(0)
+    try:
+        text = synthetic.text(size // 4)
+        workloads = [('calibration', len(text), lambda: calibration(text))]
+        workloads += suite_workloads(size)
+        workloads = [(name, chars, timeit.Timer(function), calls(function))
+                     for name, chars, function in workloads]
+        times = dict((name, list()) for name, chars, timer, number in workloads)
+        for i in range(repeat):
+            for name, chars, timer, number in workloads:
+                times[name].append(timer.timeit(number) / number)
+        for name, chars, timer, number in workloads[1:]:
+            rate = chars / min(times[name]) / 2**20
+            ratios = sorted(calibrated / seconds
+                            for seconds, calibrated in zip(times[name], times['calibration']))
+            relative = ratios[-1]
+            spread = (relative - ratios[(repeat - 1) // 2]) / relative
+            print("{0:<40} {1:>10.2f} MB/s {2:>7.1f}% spread".format("suite: " + name, rate,
+                                                                     spread * 100))
+            stages[name] = {'rate': rate, 'relative': relative, 'spread': spread}
+    finally:
+        reparse.set_memo_size(4096 if memo is None else memo)
+    return stages
+
+def save_baseline(path, stages, size):
+    with codecs.open(path, 'w', 'utf-8') as f:
+        json.dump({'size': size, 'stages': stages}, f, indent=4)
+        f.write('\n')
+    print("Baseline saved to " + path)
+
+def compare(path, stages, size, tolerance=0.15):
+    '''Compare the stages timed by bench_suite with the baseline saved in path, by their speed next
+    to the calibration. Returns the names of the stages that are slower by more than tolerance, and
+    by more than the spreads of the baseline and this run together, so that noise alone doesn't
+    count as a regression.'''
+    with codecs.open(path, 'r', 'utf-8') as f:
+        baseline = json.load(f)
+    if baseline['size'] != size:
+        print("The baseline was measured on " + str(baseline['size'] // 1024) + " KB of text, not "
+              + str(size // 1024) + " KB.")
+    regressions = list()
+    for name, stage in stages.items():
+        if name not in baseline['stages']:
+            continue
+        before = baseline['stages'][name]
+        change = stage['relative'] / before['relative'] - 1
+        allowed = max(tolerance, before['spread'] + stage['spread'])
+        flag = ''
+        if change < -allowed:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print("{0:<40} {1:>+9.1f}% of ±{2:.1f}%{3}".format("suite: " + name + " vs. baseline",
+                                                          change * 100, allowed * 100, flag))
+    return regressions
+
+BENCHMARKS = {'output': bench_output,
+              'careful_sub': bench_careful_sub,
+              'traverse': bench_traverse,
+              'escape': bench_escape,
+              'toc': bench_toc,
+              'tables': bench_tables,
+              'table_model': bench_table_model,
+              'cells': bench_cell_parse,
+              'suite': bench_suite}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for the converter.")
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help="Benchmarks to run: " + ", ".join(sorted(BENCHMARKS)))
+    parser.add_argument('--size', type=int, default=512, metavar='KB',
+                        help="Synthetic text the suite is timed on")
+    parser.add_argument('--baseline', default=BASELINE, metavar='FILE',
+                        help="Rates the suite is compared with")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Save the suite's rates as the baseline instead")
+    parser.add_argument('--tolerance', type=float, default=0.15, metavar='FRACTION',
+                        help="How much slower than the baseline counts as a regression, at "
+                        "least (the spread of the timings can widen it)")
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+    regressions = list()
+    for name in args.names or sorted(BENCHMARKS):
+        if name != 'suite':
+            BENCHMARKS[name]()
+            continue
+        stages = bench_suite(args.size * 1024)
+        if args.save_baseline:
+            save_baseline(args.baseline, stages, args.size * 1024)
+        elif os.path.exists(args.baseline):
+            regressions = compare(args.baseline, stages, args.size * 1024, args.tolerance)
+        else:
+            print("No baseline in " + args.baseline + "; save one with --save-baseline.")
+    if regressions:
+        # Only a run of the suite by name is a check that can fail
+        if 'suite' in args.names:
+            sys.exit("Slower than the baseline: " + ", ".join(regressions))
+        print("Slower than the baseline: " + ", ".join(regressions))
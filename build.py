@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['BuildGraph', 'Target']
+
+import hashlib, json, logging, os
+from cache import CODE, fingerprint
+
+class Target(object):
+    '''A file (or files) built from a list of inputs by one of the build stages. The code hash
+    stands for the program doing the build, so that changing it rebuilds the target too.'''
+    def __init__(self, name, inputs, outputs, code):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+        self.code = code
+
+class BuildGraph(object):
+    '''Tracks the content hashes of every artifact of the raw -> text -> latex pipeline, so that
+    only the targets downstream of a changed input are rebuilt. Each target records the hashes of
+    its inputs and outputs and of the code that built it, as of its last build.'''
+    def __init__(self, statefile=os.curdir + '/build.json', explain=False, options=()):
+        '''options are the command line options that change what the chapters convert to; they
+        count as part of the code that builds them.'''
+        self.logger = logging.getLogger("W2L")
+        self.statefile = statefile
+        self.explain = explain                  # Print why each target is (not) rebuilt
+        self.state = dict()
+        self.code = {'text': fingerprint(['api.py']),
+                     'latex': ' '.join([fingerprint(CODE)] + list(options))}
+        if os.path.exists(self.statefile):
+            try:
+                with open(self.statefile, 'r') as f:
+                    self.state = json.load(f)
+            except ValueError:
+                self.logger.exception("Could not read the build state; rebuilding everything.")
+                
+    def text(self, folder, file):
+        '''The text file made from one JSON batch in /raw.'''
+        name = 'text/' + folder + '/' + os.path.splitext(file)[0] + '.txt'
+        return Target(name, ['raw/' + folder + '/' + file], [name], self.code['text'])
+    
+    def latex(self, folder, files):
+        '''The chapter made from the text files of one folder.'''
+        name = 'latex/' + folder + '.tex'
+        inputs = ['text/' + folder + '/' + file for file in files]
+        return Target(name, inputs, [name], self.code['latex'])
+    
+    def hash(self, path):
+        '''SHA-1 of a file relative to the project folder, or None if it doesn't exist.'''
+        try:
+            with open(os.curdir + '/' + path, 'rb') as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except IOError:
+            return None
+        
+    def reasons(self, target):
+        '''Return the reasons target has to be rebuilt, or an empty list if it is up to date.'''
+        record = self.state.get(target.name)
+        if record is None:
+            return ["it has never been built"]
+        reasons = list()
+        for path in target.outputs:
+            digest = self.hash(path)
+            if digest is None:
+                reasons.append(path + " is missing")
+            elif digest != record['outputs'].get(path):
+                reasons.append(path + " was changed after it was built")
+        if target.code != record['code']:
+            reasons.append("the code that builds it changed")
+        for path in target.inputs:
+            if path not in record['inputs']:
+                reasons.append(path + " is new")
+            elif self.hash(path) != record['inputs'][path]:
+                reasons.append(path + " changed")
+        for path in record['inputs']:
+            if path not in target.inputs:
+                reasons.append(path + " was removed")
+        return reasons
+    
+    def outdated(self, target):
+        '''Whether target has to be rebuilt. With explain set, say why (or that it is up to date).'''
+        reasons = self.reasons(target)
+        if self.explain:
+            if reasons:
+                print(target.name + " is rebuilt because " + ", and ".join(reasons) + ".")
+            else:
+                print(target.name + " is up to date.")
+        return bool(reasons)
+    
+    def built(self, target):
+        '''Record the current hashes of target's inputs and outputs.'''
+        inputs = dict((path, self.hash(path)) for path in target.inputs)
+        outputs = dict((path, self.hash(path)) for path in target.outputs)
+        self.state[target.name] = {'inputs': inputs, 'outputs': outputs, 'code': target.code}
+    
+    def save(self):
+        with open(self.statefile + '.tmp', 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(self.statefile + '.tmp', self.statefile)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['PageCache', 'TokenCache']
+
+import hashlib, json, logging, marshal, os, sys, zlib
+import lex
+
+# The modules whose code decides what a page converts to: every module the parse path imports
+CODE = ['tokenizer.py', 'tokenparser.py', 'reparse.py', 'rewrite.py', 'toc.py', 'wikitable.py',
+        'output.py', 'convert.py', 'escape.py', 'util.py', 'exceptions.py', 'instrument.py',
+        'tracing.py', 'cache.py']
+# The modules whose code decides what a text tokenizes to, and how the tokens are stored
+RULES = ['tokenizer.py', 'cache.py']
+
+def fingerprint(modules=CODE):
+    '''Hash of the given modules and of PLY, so that changing the code invalidates everything
+    cached before.'''
+    digest = hashlib.sha1(sys.version.encode())
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for path in [os.path.join(directory, name) for name in modules] + [lex.__file__]:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class PageCache(object):
+    '''A persistent store of converted pages, one JSON file per entry. Entries are keyed by a hash
+    of the page's wikitext (plus whatever else the result depends on) and of the converter code.
+    Once the cache grows past max_size bytes, the entries used least recently are evicted.'''
+    def __init__(self, directory=os.curdir + '/cache', max_size=256*2**20):
+        self.logger = logging.getLogger("W2L")
+        self.directory = directory
+        self.max_size = max_size
+        self.fingerprint = fingerprint()
+        self.hits = 0                           # Pages taken from the cache
+        self.misses = 0                         # Pages that had to be converted
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+    
+    def key(self, *parts):
+        digest = hashlib.sha1(self.fingerprint.encode())
+        for part in parts:
+            digest.update(b'\0' + str(part).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def path(self, key):
+        return self.directory + '/' + key + '.json'
+    
+    def get(self, key):
+        '''Return the entry stored under key, or None.'''
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        os.utime(path) # Mark as recently used
+        return entry
+    
+    def put(self, key, entry):
+        path = self.path(key)
+        temp = path + '.' + str(os.getpid())
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(temp, path) # Shards may share the cache; never leave a partial entry
+        
+    def trim(self):
+        '''Evict the least recently used entries until the cache is no larger than max_size.'''
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                stat = os.stat(self.directory + '/' + name)
+                entries.append((stat.st_mtime, stat.st_size, name))
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, name in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(self.directory + '/' + name)
+            except OSError:
+                pass
+            size -= entry_size
+            self.evictions += 1
+    
+    def get_statistics(self):
+        lookups = self.hits + self.misses
+        rate = round(100*self.hits/lookups, 2) if lookups else 0.0
+        print("Page cache: " + str(self.hits) + " hits, " + str(self.misses) + " misses (" +
+              str(rate) + "% hit rate), " + str(self.evictions) + " evicted")
+
+class TokenCache(object):
+    '''A persistent store of token lists, so that the parser can be rerun without lexing again.
+    Entries are keyed by a hash of the input and of the tokenizer rules, and are stored as
+    marshalled, compressed (token list, stop position, lexer state) tuples.'''
+    def __init__(self, directory=os.curdir + '/tokens'):
+        self.logger = logging.getLogger("W2L")
+        self.directory = directory
+        self.rules = fingerprint(RULES)
+        self.hits = 0                           # Token lists replayed
+        self.misses = 0                         # Token lists that had to be lexed
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory, exist_ok=True)
+    
+    def digest(self, data):
+        '''Hash of a text file, computed once and combined with the offsets lexed from it.'''
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+    
+    def key(self, digest, start=0, end=None, state='INITIAL'):
+        parts = [self.rules, digest, str(start), str(end), state]
+        return hashlib.sha1('\0'.join(parts).encode()).hexdigest()
+    
+    def load(self, key):
+        '''Return the (token list, stop, state) tuple stored under key, or None.'''
+        try:
+            with open(self.directory + '/' + key + '.tok', 'rb') as f:
+                return marshal.loads(zlib.decompress(f.read()))
+        except (IOError, ValueError, EOFError, TypeError, zlib.error):
+            return None
+    
+    def take(self):
+        '''Return the (hits, misses) counted since the last call, and start counting again.'''
+        counts = self.hits, self.misses
+        self.hits = self.misses = 0
+        return counts
+    
+    def save(self, key, result):
+        path = self.directory + '/' + key + '.tok'
+        temp = path + '.' + str(os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(zlib.compress(marshal.dumps(result)))
+        os.replace(temp, path) # Workers may lex the same text at once
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Converter', 'split_pages']
+
+import codecs, instrument, io, logging, os, re, reparse, tracing, util
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from cache import TokenCache
+from output import AtomicFile, OutputBuffer
+from tokenizer import Tokenizer
+from tokenparser import Parser, ParseContext
+
+PAGE_START = re.compile(r'<pagequality\s')
+
+def split_pages(text):
+    '''Return the (start, end) offsets of the pages in text. Each page begins at its
+    <pagequality .../> tag; anything before the first tag is a page of its own.'''
+    starts = [0] + [m.start() for m in PAGE_START.finditer(text) if m.start() > 0]
+    return list(zip(starts, starts[1:] + [len(text)]))
+
+class Unit(object):
+    '''A page of one text file, tokenized and parsed separately from the pages around it.'''
+    def __init__(self, folder, file, start, end):
+        self.folder = folder
+        self.path = os.curdir + '/text/' + folder + '/' + file
+        self.start = start                      # Offset of the page in the text file
+        self.end = end
+        self.tokens = None
+        self.stop = None                        # Where the lexer stopped (past end if it ran over)
+        self.state = None                       # Lexer state at self.stop
+        self.continued = False                  # Lexing began inside a construct from the last page
+        self.key = None                         # Cache key of the page's wikitext, if it is cacheable
+        self.transfer = None                    # How the page changes the state carried across pages
+
+class UnitBuffer(OutputBuffer):
+    '''Output for a page that is parsed before the pages in front of it. Whether anything has been
+    written already, and the last character written, have to be assumed; the buffer notes whether
+    the parser looked at either before writing anything itself.'''
+    def __init__(self, offset, last='\n'):
+        self.assumed = False
+        OutputBuffer.__init__(self, io.StringIO(), offset=offset, last=last)
+    
+    @property
+    def last(self):
+        if self.position == self.offset:
+            self.assumed = True
+        return self._last
+    
+    @last.setter
+    def last(self, value):
+        self._last = value
+        
+    def tell(self):
+        if self.position == self.offset:
+            self.assumed = True
+        return self.position
+    
+    def getvalue(self):
+        self.flush()
+        return self.stream.getvalue()
+
+class Converter(object):
+    '''Converts the text files of each folder in /text into a single LaTeX file in /latex.'''
+    def __init__(self, dump_tokens=True, tokens=None, stream_tables=False):
+        '''If tokens is a TokenCache, token lists are replayed from it instead of lexing again
+        (and no longer dumped to tokenout.txt when they are). stream_tables is passed on to the
+        Parser.'''
+        self.logger = logging.getLogger("W2L")
+        self.tokenizer = Tokenizer(dump_tokens)
+        self.parser = Parser(stream_tables)
+        self.tokens = tokens
+        self.texts = dict()                     # Text files read so far, by path
+        self.digests = dict()                   # Hashes of those texts, for the token cache
+        self.timings = dict()                   # Seconds taken to convert each folder
+        self.changed = list()                   # Folders whose LaTeX differs from the last run
+        self.failed = list()                    # Folders where a handler failed, left incomplete
+        
+    def convert_folder(self, folder, files, progress):
+        '''Convert the given files of one folder (one main page) into latex/<folder>.tex. Returns
+        the number of seconds it took, which is also counted towards the chapter in progress.'''
+        start_time = time()
+        pages = sum(progress.status)
+        tokens = 0
+        path = os.curdir + '/latex/' + folder + '.tex'
+        span = tracing.span('convert_folder', folder=folder)
+        with span, AtomicFile(path) as outputfile:
+            with OutputBuffer(outputfile) as output:
+                for file in files:
+                    self.logger.debug("Parsing " + folder + "/" + file + " to " + folder + ".tex.")
+                    with codecs.open(os.curdir + '/text/' + folder + '/' + file, 'r', 'utf-8') as f:
+                        data = f.read()
+                    with tracing.span('tokenize', file=folder + '/' + file):
+                        if self.tokens:
+                            token_list = self.tokenize(data, self.tokens.digest(data))[0]
+                        else:
+                            token_list = self.tokenizer.analyze(data)
+                    with tracing.span('parse', file=folder + '/' + file):
+                        if not self.parser.dispatch(token_list, ParseContext(output, progress)):
+                            self.fail(folder)
+                    tokens += len(token_list)
+                    del token_list # Not held while the next file is lexed, or past the span
+        if outputfile.changed:
+            self.changed.append(folder)
+        seconds = time() - start_time
+        progress.chapter(folder, sum(progress.status) - pages, tokens, os.path.getsize(path),
+                         seconds)
+        return seconds
+    
+    def fail(self, folder):
+        '''Note that the rest of a file in folder was skipped after a handler failed.'''
+        if folder not in self.failed:
+            self.failed.append(folder)
+    
+    def lexer_statistics(self, jobs):
+        '''Lex the text files of the given (folder, files) jobs in this process, without parsing
+        them, and return the instrument.LexerStatistics of the rules.'''
+        stats = instrument.LexerStatistics(self.tokenizer)
+        for folder, files in jobs:
+            for file in files:
+                with codecs.open(os.curdir + '/text/' + folder + '/' + file, 'r', 'utf-8') as f:
+                    self.tokenizer.tokenize(f.read(), stats=stats)
+        return stats
+    
+    def convert(self, jobs, progress, workers=1, split_pages=False, cache=None):
+        '''Convert every (folder, files) pair in jobs. With more than one worker the folders are
+        spread over a process pool; each worker builds its own Tokenizer and Parser and the page
+        counts it collects are merged into progress. With split_pages, the individual pages of
+        every file are spread over the workers instead. Given a PageCache, files are converted page
+        by page as well, and pages that haven't changed are taken from the cache. The time taken by
+        each folder is kept in self.timings (except page by page, where folders are mixed). Chapters
+        are only rewritten if they changed; the folders that did are listed in self.changed, and
+        those where a handler failed and part of a file was skipped in self.failed. The
+        hits and misses of the Reparser memos and the token cache, and the handler timings if
+        profiling, in this process and the workers, are added to progress.'''
+        split_pages = split_pages or cache is not None
+        memos = reparse.memo_counts()
+        if workers <= 1:
+            if split_pages:
+                self.convert_pages(jobs, progress, cache=cache)
+            else:
+                for folder, files in jobs:
+                    self.timings[folder] = self.convert_folder(folder, files, progress)
+        else:
+            directory = self.tokens.directory if self.tokens else None
+            trace = tracing.path if tracing.events is not None else None
+            with ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                                     initargs=(directory, reparse.memo_size,
+                                               self.parser.stream_tables,
+                                               instrument.profile is not None, trace)) as executor:
+                if split_pages:
+                    self.convert_pages(jobs, progress, executor, workers, cache)
+                else:
+                    for job, result in zip(jobs, executor.map(convert_in_worker, jobs)):
+                        progress.merge(result[0])
+                        self.timings[job[0]] = result[1]
+                        if result[2]:
+                            self.changed.append(job[0])
+                        if result[3]:
+                            self.fail(job[0])
+        progress.count_memos(reparse.memo_counts(), memos)
+        progress.count_profile(instrument.take())
+        if self.tokens:
+            progress.count_cache('token', *self.tokens.take())
+    
+#===================================================================================================
+# PAGE-LEVEL CONVERSION
+#===================================================================================================
+    def convert_pages(self, jobs, progress, executor=None, workers=1, cache=None):
+        '''Convert the folders in jobs page by page, tokenizing and then parsing the pages in the
+        process pool if one is given. The result is the same as that of convert_folder: pages are
+        lexed as if the rest of the file came before them, a page that begins inside a construct
+        left open by the last page is parsed together with it, and the state that does cross page
+        boundaries is carried over explicitly.
+        
+        With a cache, a page that lexes on its own (it starts and ends in the INITIAL state and the
+        lexer didn't run past it) is looked up by its wikitext and the state carried into it. Pages
+        that don't stand on their own are always converted.'''
+        units = list()
+        for folder, files in jobs:
+            for file in files:
+                text = self.read(os.curdir + '/text/' + folder + '/' + file)
+                for start, end in split_pages(text):
+                    unit = Unit(folder, file, start, end)
+                    if cache:
+                        unit.key = cache.key('lex', text[start:end])
+                        entry = cache.get(unit.key)
+                        if entry:
+                            # How skimming the page changes the state, so the tokens aren't needed
+                            unit.stop, unit.state, unit.transfer = end, 'INITIAL', entry['transfer']
+                    units.append(unit)
+        chunksize = max(1, len(units) // (4 * workers))
+        
+        # Lex every page as if it began in the INITIAL state, then redo the ones that didn't
+        self.lex_units([unit for unit in units if unit.stop is None], executor, chunksize)
+        for previous, unit in zip(units, units[1:]):
+            if previous.path == unit.path:
+                if previous.stop != unit.start or previous.state != 'INITIAL':
+                    unit.tokens, unit.stop, unit.state = self.lex_unit((unit.path, previous.stop,
+                                                                        unit.end, previous.state))
+                    unit.continued = previous.state != 'INITIAL'
+                    unit.key = unit.transfer = None
+        for unit in units:
+            if unit.stop != unit.end or unit.state != 'INITIAL':
+                unit.key = None
+            elif unit.key and unit.transfer is None:
+                unit.transfer = self.transfer(unit.tokens)
+                cache.put(unit.key, {'transfer': unit.transfer})
+                
+        # Group pages that have to share a context and work out what carries into each group
+        groups = list()
+        tasks = list()
+        ctx = None
+        for unit in units:
+            if unit.continued:
+                groups[-1].append(unit)
+                tasks[-1][0].extend(unit.tokens)
+            else:
+                if not groups or groups[-1][0].folder != unit.folder:
+                    started = False
+                else:
+                    started = True
+                if not groups or groups[-1][0].path != unit.path:
+                    ctx = ParseContext(None, None)
+                groups.append([unit])
+                tasks.append((unit.tokens and list(unit.tokens), ctx.indented, ctx.row_center,
+                              int(started), '\n'))
+            if unit.transfer:
+                ctx.indented = unit.transfer[ctx.indented][0]
+                ctx.row_center = unit.transfer[ctx.row_center][1]
+            else:
+                self.parser.skim(unit.tokens, ctx)
+        
+        # Parse the groups that aren't in the cache
+        results = [None]*len(groups)
+        if cache:
+            for index, (group, task) in enumerate(zip(groups, tasks)):
+                if len(group) == 1 and group[0].key:
+                    results[index] = self.lookup(cache, group[0], task)
+        missing = [index for index, result in enumerate(results) if result is None]
+        self.lex_units([groups[index][0] for index in missing if tasks[index][0] is None],
+                       executor, chunksize)
+        tasks = [task if task[0] is not None else (group[0].tokens,) + task[1:]
+                 for group, task in zip(groups, tasks)]
+        if executor:
+            parsed = executor.map(parse_unit, [tasks[index] for index in missing],
+                                  chunksize=chunksize)
+        else:
+            parsed = map(self.parse_unit, [tasks[index] for index in missing])
+        for index, result in zip(missing, parsed):
+            results[index] = result
+            self.store(cache, groups[index], tasks[index], result)
+            
+        # Stitch the output back together in order
+        outputs = dict((folder, list()) for folder, files in jobs)
+        counts = dict((folder, [0, 0]) for folder, files in jobs)  # Pages and tokens
+        position = 0
+        last = '\n'
+        broken = None
+        folder = None
+        for group, task, result in zip(groups, tasks, results):
+            if group[0].folder != folder:
+                folder = group[0].folder
+                position = 0
+                last = '\n'
+            if group[0].path == broken:
+                continue
+            latex, page_progress, completed, assumed = result
+            if assumed and (task[3] != min(position, 1) or task[4] != last):
+                # The parser relied on what came before this page and guessed wrong
+                task = task[:3] + (min(position, 1), last)
+                result = self.lookup(cache, group[0], task) if cache and len(group) == 1 else None
+                if result is None:
+                    if task[0] is None:
+                        group[0].tokens = self.lex_unit((group[0].path, group[0].start,
+                                                         group[0].end, 'INITIAL'))[0]
+                        task = (group[0].tokens,) + task[1:]
+                    result = self.parse_unit(task)
+                    self.store(cache, group, task, result)
+                latex, page_progress, completed, assumed = result
+            outputs[folder].append(latex)
+            progress.merge(page_progress)
+            counts[folder][0] += sum(page_progress.status)
+            counts[folder][1] += len(task[0] or ())
+            if latex:
+                position += len(latex)
+                last = latex[-1]
+            if not completed:
+                broken = group[0].path
+                self.fail(folder)
+        for folder, files in jobs:
+            path = os.curdir + '/latex/' + folder + '.tex'
+            with AtomicFile(path) as outputfile:
+                outputfile.write(''.join(outputs[folder]))
+            if outputfile.changed:
+                self.changed.append(folder)
+            progress.chapter(folder, counts[folder][0], counts[folder][1], os.path.getsize(path))
+        if cache:
+            cache.trim()
+    
+    def lex_units(self, units, executor=None, chunksize=1):
+        '''Lex each of the units from its start in the INITIAL state.'''
+        tasks = [(unit.path, unit.start, unit.end, 'INITIAL') for unit in units]
+        if executor:
+            results = executor.map(lex_unit, tasks, chunksize=chunksize)
+        else:
+            results = ((self.lex_unit(task), None) for task in tasks)
+        for unit, (result, lookups) in zip(units, results):
+            unit.tokens, unit.stop, unit.state = result
+            if lookups:
+                # Token cache hits and misses in the worker
+                self.tokens.hits += lookups[0]
+                self.tokens.misses += lookups[1]
+    
+    def transfer(self, tokens):
+        '''Skim a page for each value of the state carried into it. Returns a pair of
+        (indented, row_center) after the page, indexed by the value before it.'''
+        pairs = list()
+        for before in (False, True):
+            ctx = ParseContext(None, None)
+            ctx.indented = ctx.row_center = before
+            self.parser.skim(tokens, ctx)
+            pairs.append((ctx.indented, ctx.row_center))
+        return pairs
+    
+    def lookup(self, cache, unit, task):
+        '''Return the cached result of parsing a page that stands on its own, or None.'''
+        if not unit.key:
+            return None
+        entry = cache.get(cache.key('parse', unit.key, self.parser.stream_tables, *task[1:]))
+        if entry is None:
+            cache.misses += 1
+            return None
+        cache.hits += 1
+        progress = util.ProgressChecker()
+        progress.status = entry['status']
+        return entry['latex'], progress, entry['completed'], entry['assumed']
+    
+    def store(self, cache, group, task, result):
+        if cache and len(group) == 1 and group[0].key:
+            latex, progress, completed, assumed = result
+            cache.put(cache.key('parse', group[0].key, self.parser.stream_tables, *task[1:]),
+                      {'latex': latex, 'status': progress.status, 'completed': completed,
+                       'assumed': assumed})
+                
+    def read(self, path):
+        if path not in self.texts:
+            with codecs.open(path, 'r', 'utf-8') as f:
+                self.texts[path] = f.read()
+        return self.texts[path]
+    
+    def tokenize(self, data, digest=None, start=0, end=None, state='INITIAL'):
+        '''Tokenize data[start:end] from the given lexer state. Given the digest of data, the
+        result is taken from the token cache if it is there, and stored in it (and dumped to
+        tokenout.txt, as analyze does) if not.'''
+        if digest is None:
+            return self.tokenizer.tokenize(data, start, end, state)
+        key = self.tokens.key(digest, start, end, state)
+        result = self.tokens.load(key)
+        if result is None:
+            self.tokens.misses += 1
+            dump = list() if self.tokenizer.dump_tokens else None
+            result = self.tokenizer.tokenize(data, start, end, state, dump)
+            self.tokenizer.write_dump(dump)
+            self.tokens.save(key, result)
+        else:
+            self.tokens.hits += 1
+        return result
+    
+    def lex_unit(self, task):
+        path, start, end, state = task
+        with tracing.span('tokenize_page', file=path, start=start, end=end, state=state):
+            data = self.read(path)
+            if self.tokens and path not in self.digests:
+                self.digests[path] = self.tokens.digest(data)
+            return self.tokenize(data, self.digests.get(path), start, end, state)
+    
+    def parse_unit(self, task):
+        tokens, indented, row_center, position, last = task
+        progress = util.ProgressChecker()
+        output = UnitBuffer(position, last)
+        ctx = ParseContext(output, progress)
+        ctx.indented = indented
+        ctx.row_center = row_center
+        with tracing.span('parse_page', position=position, tokens=len(tokens)):
+            completed = self.parser.dispatch(tokens, ctx)
+        return output.getvalue(), progress, completed, output.assumed
+
+#===================================================================================================
+# PROCESS POOL WORKERS
+#===================================================================================================
+worker = None # The Converter belonging to this worker process
+
+def start_worker(tokens=None, memo_size=None, stream_tables=False, profile=False, trace=None):
+    global worker
+    # Workers share the working directory, so they can't all write tokenout.txt
+    worker = Converter(dump_tokens=False, tokens=tokens and TokenCache(tokens),
+                       stream_tables=stream_tables)
+    if memo_size is not None:
+        reparse.set_memo_size(memo_size)
+    if profile:
+        instrument.enable()
+    if trace:
+        tracing.enable(trace, 'worker')
+    
+def convert_in_worker(job):
+    folder, files = job
+    progress = util.ProgressChecker()
+    memos = reparse.memo_counts()
+    seconds = worker.convert_folder(folder, files, progress)
+    progress.count_memos(reparse.memo_counts(), memos)
+    progress.count_profile(instrument.take())
+    if worker.tokens:
+        progress.count_cache('token', *worker.tokens.take())
+    tracing.flush()
+    return progress, seconds, folder in worker.changed, folder in worker.failed
+
+def lex_unit(task):
+    # Only keep the file currently being lexed; the pages of a file arrive together
+    if task[0] not in worker.texts:
+        worker.texts.clear()
+        worker.digests.clear()
+    result = worker.lex_unit(task)
+    tracing.flush()
+    return result, worker.tokens and worker.tokens.take()
+
+def parse_unit(task):
+    memos = reparse.memo_counts()
+    result = worker.parse_unit(task)
+    result[1].count_memos(reparse.memo_counts(), memos)
+    result[1].count_profile(instrument.take())
+    tracing.flush()
+    return result
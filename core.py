@@ -19,10 +19,13 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import codecs, logging, os, util
-from tokenizer import Tokenizer
-from tokenparser import Parser
+import argparse, instrument, logging, memprofile, os, reparse, shard, tracing, util
 from api import Document
+from build import BuildGraph
+from cache import PageCache, TokenCache
+from convert import Converter
+from master import write_master
+from scheduler import Scheduler
 
 def setup_logging():
     logger=logging.getLogger("W2L")
@@ -34,44 +37,191 @@ def setup_logging():
     logger.addHandler(consolehandler)
     return logger
 
-if __name__ == "__main__":
-    logger = setup_logging()
+def shard_number(text):
+    '''Parse the i/N argument of --shard.'''
+    try:
+        index, count = [int(n) for n in text.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected i/N, e.g. 2/4")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("shard number must be between 1 and " + str(count))
+    return index, count
+
+def shard_count(text):
+    '''Parse the N argument of --merge.'''
+    try:
+        count = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number of shards, e.g. 4")
+    if count < 1:
+        raise argparse.ArgumentTypeError("there must be at least 1 shard")
+    return count
+
+def chapter_list(text):
+    '''Parse the comma-separated folder numbers of --include-only.'''
+    folders = [folder.strip() for folder in text.split(',')]
+    if not all(folder.isdigit() for folder in folders):
+        raise argparse.ArgumentTypeError("chapters must be given as folder numbers, e.g. 2,5")
+    return folders
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Convert the Pentagon Papers from Wikisource "
+                                     "to LaTeX.")
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help="Number of processes to convert folders with (default: 1)")
+    parser.add_argument('--split-pages', action='store_true',
+                        help="Spread the individual pages of each file over the processes, "
+                        "rather than whole folders")
+    parser.add_argument('--cache', metavar='DIR',
+                        help="Keep converted pages in DIR and reuse those that haven't changed "
+                        "(implies --split-pages)")
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB',
+                        help="Size the page cache is trimmed to after each run (default: 256)")
+    parser.add_argument('--token-cache', metavar='DIR',
+                        help="Keep the token list of every text file in DIR and replay it while "
+                        "the text and tokenizer.py are unchanged")
+    parser.add_argument('--stream-tables', action='store_true',
+                        help="Write the rows of each table as they are parsed, to an xltabular "
+                        "that can break across pages, instead of holding the whole table")
+    parser.add_argument('--memo-size', type=int, default=4096, metavar='N',
+                        help="Number of results of each Reparser method to remember, 0 to turn "
+                        "memoization off (default: 4096)")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="Time every parser handler and the Reparser, TOC and table calls "
+                        "under it, print a report and write the timings to FILE as JSON")
+    parser.add_argument('--lexer-stats', metavar='FILE',
+                        help="Lex the text files to be converted once more, counting and timing "
+                        "each lexer rule by state, print a report with a suggested rule order and "
+                        "write it to FILE as JSON")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="Record how long each stage, download, text file and page takes, in "
+                        "every process, and write it to FILE as a Chrome trace (for "
+                        "chrome://tracing or Perfetto)")
+    parser.add_argument('--memprofile', metavar='FILE',
+                        help="Trace memory allocations, print the peak of each stage, text file "
+                        "and page with the lines that had allocated the most at its fullest and "
+                        "those that retained memory after it, and what is held on to from one to "
+                        "the next, and write it to FILE as JSON (converts in this process only)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="Write the page counts, throughput overall and by chapter, stage "
+                        "times and cache hit rates to FILE as JSON")
+    parser.add_argument('--prometheus', metavar='FILE',
+                        help="Write the same metrics to FILE as a Prometheus textfile")
+    parser.add_argument('--explain', action='store_true',
+                        help="Print why each text file and chapter is or isn't rebuilt")
+    parser.add_argument('--include-only', type=chapter_list, metavar='N,N,...',
+                        help="Typeset only the given chapters when compiling latex/pp.tex")
+    sharding = parser.add_mutually_exclusive_group()
+    sharding.add_argument('--shard', type=shard_number, metavar='i/N',
+                          help="Convert only the i-th of N shards of the chapters (the text "
+                          "files must already exist)")
+    sharding.add_argument('--merge', type=shard_count, metavar='N',
+                          help="Combine the results of N shards into the final document")
+    return parser.parse_args()
+
+def download(logger, graph):
     doc = Document()
-    doc.organize()
+    with tracing.span('organize'):
+        doc.organize()
     if not os.path.exists(os.curdir + '/raw'):
         logger.debug("Getting raw text files.")
-        doc.call()
-    if not os.path.exists(os.curdir + '/text'):
-        logger.debug("Parsing JSON to TXT.")
-        doc.json_to_text()
-    
-    # Open and read files
-    tokenizer = Tokenizer()
+        with tracing.span('call'):
+            doc.call()
+    logger.debug("Parsing JSON to TXT.")
+    for folder, file in doc.batches():
+        target = graph.text(folder, file)
+        if graph.outdated(target):
+            with tracing.span('json_to_text', folder=folder, file=file):
+                doc.batch_to_text(folder, file)
+            graph.built(target)
+    return doc
+
+if __name__ == "__main__":
+    args = parse_arguments()
+    logger = setup_logging()
+    reparse.set_memo_size(args.memo_size)
+    if args.profile:
+        instrument.enable()
+    if args.trace:
+        tracing.enable(args.trace)
+    if args.memprofile:
+        if args.jobs > 1:
+            logger.warning("--memprofile only follows this process, so --jobs is ignored.")
+            args.jobs = 1
+        memprofile.enable()
     progress = util.ProgressChecker()
-    parser = Parser(progress)
-    if not os.path.exists(os.curdir + '/latex'):
-        os.mkdir(os.curdir + '/latex')
-    if not os.path.exists(os.curdir + '/latex'):
-        os.mkdir(os.curdir + '/latex')
-    #folders = sorted(os.listdir(path=(os.curdir + '/text')), key=int)
-    folders = ['0', '1', '2', '3']
-    for folder in folders:
-        files = sorted(os.listdir(path=(os.curdir + '/text/' + folder)), key=lambda x: int(x[0]))
-        if folder == '3':
-            files = ['0.txt', '1.txt']
-        with codecs.open(os.curdir + '/latex/' + folder + '.tex', 'w+', 'utf-8') as outputfile:
-            last_open = os.curdir + '/latex/' + folder + '.tex'
-            for file in files:
-                logger.debug("Parsing " + folder + "/" + file + " to " + folder + ".tex.")
-                with codecs.open(os.curdir + '/text/' + folder + '/' + file, 'r', 'utf-8') as f:
-                    data = f.read()
-                    token_list = tokenizer.analyze(data)
-                    parser.begin(outputfile)
-                    parser.dispatch(token_list)
-    print("Total number of pages included in main pages: " + str(doc.num_pages))
-    progress.get_statistics()
-#    with codecs.open(last_open, 'a', 'utf-8') as outputfile:
-#        contributors = doc.attribute()
-#        parser.end_matter(contributors, outputfile)
+    scheduler = Scheduler()
+    
+    if args.merge:
+        with progress.stage('merge', shards=args.merge):
+            write_master(shard.merge(args.merge, scheduler, progress), args.include_only)
+        progress.get_statistics()
+    else:
+        # Shards run side by side on a shared filesystem, so they can't download the text
+        graph = BuildGraph(explain=args.explain,
+                           options=['--stream-tables'] if args.stream_tables else [])
+        if not args.shard:
+            with progress.stage('download'):
+                doc = download(logger, graph)
+        
+        # Open and read files
+        converter = Converter(tokens=TokenCache(args.token_cache) if args.token_cache else None,
+                              stream_tables=args.stream_tables)
+        # Shards starting together would race between checking for the folder and creating it
+        os.makedirs(os.curdir + '/latex', exist_ok=True)
+        if args.shard:
+            jobs = scheduler.shard(*args.shard)
+        else:
+            jobs = [job for job in scheduler.schedule() if graph.outdated(graph.latex(*job))]
+        cache = PageCache(args.cache, args.cache_size*2**20) if args.cache else None
+        if args.lexer_stats:
+            with progress.stage('lexer_stats'):
+                stats = converter.lexer_statistics(jobs)
+            stats.report()
+            stats.save(args.lexer_stats)
+        with progress.stage('convert', chapters=len(jobs), workers=args.jobs):
+            converter.convert(jobs, progress, args.jobs, args.split_pages, cache)
+        print("Chapters changed: " + str(len(converter.changed)) + " of " + str(len(jobs))
+              + " converted.")
+        if cache:
+            progress.count_cache('page', cache.hits, cache.misses)
+        
+        if args.shard:
+            shard.write_manifest(args.shard[0], args.shard[1], jobs, progress, converter.timings)
+            logger.debug("Shard " + str(args.shard[0]) + " of " + str(args.shard[1]) + " complete.")
+        else:
+            for job in jobs:
+                # Chapters left incomplete by a failed handler are tried again next time
+                if job[0] not in converter.failed:
+                    graph.built(graph.latex(*job))
+            if converter.failed:
+                logger.warning("Chapters " + ", ".join(converter.failed) + " are incomplete and "
+                               "will be converted again on the next run.")
+            graph.save()
+            scheduler.record(converter.timings)
+            with progress.stage('write_master'):
+                write_master(scheduler.sizes, args.include_only)
+            print("Total number of pages included in main pages: " + str(doc.num_pages))
+            if jobs:
+                progress.get_statistics()
+            else:
+                print("All chapters are up to date.")
+        if cache:
+            cache.get_statistics()
+        if args.profile:
+            instrument.report(progress.profile)
+            instrument.save(progress.profile, args.profile)
+    if args.trace:
+        tracing.save()
+    if args.metrics:
+        progress.save_json(args.metrics)
+    if args.prometheus:
+        progress.save_prometheus(args.prometheus)
+    if args.memprofile:
+        memprofile.profiler.report()
+        memprofile.profiler.save(args.memprofile)
+#            with codecs.open(os.curdir + '/latex/' + max(scheduler.sizes, key=int) + '.tex', 'a', 'utf-8') as outputfile:
+#                contributors = doc.attribute()
+#                converter.parser.end_matter(contributors, outputfile)
         
     logger.debug("Parsing complete.")
\ No newline at end of file
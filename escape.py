@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Tables for escaping text for LaTeX, one for each context the converter writes text in. Each
+maps single characters to what they are written as, all at once: what one character is replaced
+with is never escaped again by another.'''
+
+__all__ = ['CELL', 'FINAL', 'PUNCT', 'TEMPLATE', 'TEXT', 'TOC', 'Table']
+
+# Characters with a special meaning to LaTeX
+SPECIAL = {'#': '\\#', '$': '\\$', '%': '\\%', '_': '\\_', '^': '\\^', '~': '\\~', '&': '\\&'}
+# Characters that are written as LaTeX commands (or plainer characters)
+SYMBOLS = {'✓': '{\\checked}', '–': '--', '—': '---', '□': '\\Square~', '|': '{\\textbar}'}
+
+class Table(object):
+    '''Replaces the characters in a mapping with their strings. This runs str.replace once for
+    each character in the text, which is faster than str.translate once anything outside of ASCII
+    is in the mapping. The replacements are ordered so that no character is replaced in what
+    another was replaced with.'''
+    def __init__(self, mapping):
+        self.table = dict(mapping)
+        if not all(len(char) == 1 for char in self.table):
+            raise ValueError("Only single characters can be escaped")
+        self.pairs = list()
+        pending = list(self.table)
+        while pending:
+            # Next, a character none of the others left is replaced with
+            ready = [char for char in pending
+                     if not any(char in self.table[other] for other in pending if other != char)]
+            if not ready:
+                raise ValueError("The replacements of " + ''.join(pending) + " contain each other")
+            for char in ready:
+                pending.remove(char)
+            self.pairs.extend((char, self.table[char]) for char in ready)
+        self.pairs.reverse()
+        
+    def __add__(self, other):
+        '''A table that replaces as self does and then replaces what self left alone or produced
+        as other does.'''
+        table = dict((char, other.sub(value)) for char, value in self.table.items())
+        for char, value in other.table.items():
+            table.setdefault(char, value)
+        return Table(table)
+    
+    def sub(self, text):
+        if len(text) == 1:
+            return self.table.get(text, text)
+        for char, value in self.pairs:
+            if char in text:
+                text = text.replace(char, value)
+        return text
+
+# Reparser.final_sub: only the special characters
+FINAL = Table(SPECIAL)
+# Reparser.careful_sub, for text that is escaped with FINAL later
+TEMPLATE = Table(SYMBOLS)
+# Reparser.sub: careful_sub followed by final_sub
+TEXT = TEMPLATE + FINAL
+# Lines of a table of contents, where the column separators become spaces
+TOC = Table(dict(SYMBOLS, **{'|': ' '})) + FINAL
+# Table cells, where the check boxes are drawn too
+CELL = Table(dict(SPECIAL, **{'□': '\\Square~', '▣': '\\CheckedBox~', '|': '{\\textbar}',
+                              '–': '--', '—': '---', '✓': '{\\checked}'}))
+# Punctuation tokens. ^ and ~ are left as they are, and stray braces are dropped.
+PUNCT = Table({'#': '\\#', '$': '\\$', '%': '\\%', '&': '\\&', '_': '\\_', '\\': '\\\\',
+               '°': '{\\degree}', '–': '--', '—': '---', '|': '{\\textbar}', '}': '', '{': '',
+               '✓': '{\\checked}'})
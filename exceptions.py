@@ -37,4 +37,8 @@ class ParseError(W2LError):
     '''There was an error while parsing the document.'''
 
 class TOCError(ParseError):
-    '''The parser has encountered an incorrectly-formatted outline or table of contents.'''
\ No newline at end of file
+    '''The parser has encountered an incorrectly-formatted outline or table of contents.'''
+
+class ShardError(W2LError):
+    '''The shards of a sharded conversion could not be merged. A shard may not have finished, or
+    the shards may have been run against different text folders.'''
\ No newline at end of file
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Opt-in profiling of the parser. Once enabled, Parser.dispatch times every handler it runs, by
+token type, and the Reparser, TOC and wikitable methods called underneath are wrapped to time
+themselves as well. Nothing is wrapped, and dispatch doesn't look at the clock, unless profiling
+is enabled, so it costs nothing otherwise.
+
+The counts are kept as [calls, seconds, longest call in seconds, characters written] by name, the
+same form util.ProgressChecker collects them in from the worker processes.
+
+LexerStatistics does the same for the rules of the Tokenizer, for the text it is handed.'''
+
+__all__ = ['enable', 'record', 'take', 'timed', 'report', 'save', 'LexerStatistics']
+
+import json, re
+from time import perf_counter
+
+#===================================================================================================
+# PARSER HANDLERS
+#===================================================================================================
+profile = None                          # Counts by name while profiling is enabled
+
+
+# The methods called underneath the handlers that are timed, by module and class
+METHODS = [('reparse', 'Reparser', ['careful_sub', 'final_sub', 'left', 'running_header', 'sub',
+                                     'traverse']),
+           ('toc', 'TOC', ['begin']),
+           ('wikitable', 'Table', ['append_row', 'end']),
+           ('wikitable', 'Cell', ['end'])]
+
+def enable():
+    '''Start profiling in this process.'''
+    global profile
+    if profile is not None:
+        return
+    profile = dict()
+    for module, name, methods in METHODS:
+        cls = getattr(__import__(module), name)
+        for method in methods:
+            setattr(cls, method, timed(name + '.' + method, getattr(cls, method)))
+
+def record(name, seconds, written=0):
+    counts = profile.get(name)
+    if counts is None:
+        profile[name] = [1, seconds, seconds, written]
+    else:
+        counts[0] += 1
+        counts[1] += seconds
+        if seconds > counts[2]:
+            counts[2] = seconds
+        counts[3] += written
+
+def timed(name, function):
+    '''Wrap function so that every call is recorded under name, with the length of the string it
+    returns as what it wrote.'''
+    def wrapper(*args):
+        start_time = perf_counter()
+        result = function(*args)
+        record(name, perf_counter() - start_time, len(result) if result.__class__ is str else 0)
+        return result
+    wrapper.__name__ = function.__name__
+    wrapper.__doc__ = function.__doc__
+    return wrapper
+
+def take():
+    '''Return the counts collected since the last call (none if profiling is off) and start
+    afresh.'''
+    global profile
+    if profile is None:
+        return dict()
+    counts = profile
+    profile = dict()
+    return counts
+
+def ranked(counts):
+    '''The (name, counts) pairs, the slowest in total first.'''
+    return sorted(counts.items(), key=lambda item: -item[1][1])
+
+def report(counts, limit=40):
+    '''Print the counts, the slowest in total first.'''
+    print("{0:<28} {1:>9} {2:>10} {3:>10} {4:>10} {5:>12}".format(
+        "Handler", "Calls", "Total (s)", "Mean (ms)", "Max (ms)", "Written"))
+    for name, (calls, seconds, longest, written) in ranked(counts)[:limit]:
+        print("{0:<28} {1:>9} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>12}".format(
+            name, calls, seconds, 1000*seconds/calls, 1000*longest, written))
+
+def save(counts, path):
+    '''Write the counts to path as JSON, the slowest in total first.'''
+    handlers = [{'name': name, 'calls': calls, 'seconds': seconds, 'max_seconds': longest,
+                 'written': written}
+                for name, (calls, seconds, longest, written) in ranked(counts)]
+    with open(path, 'w') as f:
+        json.dump({'handlers': handlers}, f, indent=2)
+
+#===================================================================================================
+# LEXER RULES
+#===================================================================================================
+class LexerStatistics(object):
+    '''Counts and times the rules of a Tokenizer as they fire, by lexer state, and suggests an order
+    to define them in. PLY tries the rules of a state one after another, in the order they are
+    defined (those of the state itself, then those of INITIAL if the state is inclusive), so a rule
+    that fires often but is defined late pays for every rule before it.
+    
+    A rule can only be moved ahead of another if that doesn't change what is lexed, so wherever a
+    rule fires, the rules after it in the same state are tried at the same position as well. Any
+    that would also match there have to stay after it. This only covers the text that was lexed,
+    so a suggested order still has to be checked against the rest.'''
+    def __init__(self, tokenizer):
+        lexer = tokenizer.lexer
+        self.counts = dict()            # [matches, characters, seconds] by (state, rule)
+        self.after = set()              # (rule, later rule) pairs that can't change places
+        self.orders = dict()            # The rules of each state, in the order they are tried
+        self.groups = dict()            # Where the rules of INITIAL start in each state
+        self.patterns = dict()
+        self.lines = dict()
+        self.tables = dict()            # The lexer tables, with each rule wrapped to record itself
+        self.clock = 0.0                # When the lexer last started looking for a match
+        for state, regexes in lexer.lexstatere.items():
+            order = list()
+            table = list()
+            for regex, functions in regexes:
+                wrapped = list()
+                for entry in functions:
+                    if entry and entry[0]:
+                        function = entry[0]
+                        order.append(function.__name__)
+                        self.patterns[function.__name__] = re.compile(
+                            getattr(function, 'regex', function.__doc__), lexer.lexreflags)
+                        self.lines[function.__name__] = function.__code__.co_firstlineno
+                        entry = (self.wrap(state, function), entry[1])
+                    wrapped.append(entry)
+                table.append((regex, wrapped))
+            self.orders[state] = order
+            self.tables[state] = table
+        for state, order in self.orders.items():
+            if state != 'INITIAL' and lexer.lexstateinfo[state] == 'inclusive':
+                self.groups[state] = len(order) - len(self.orders['INITIAL'])
+            else:
+                self.groups[state] = len(order)
+        self.indices = {state: {rule: index for index, rule in enumerate(order)}
+                        for state, order in self.orders.items()}
+    
+    def wrap(self, state, function):
+        '''Wrap the function of a rule of the given state to record it. The time since the lexer
+        started looking for a match is counted as well, since that is mostly spent trying the rules
+        before it. Rules that return no token (and so may start looking again) are included.'''
+        name = function.__name__
+        def rule(token):
+            result = function(token)
+            seconds = perf_counter() - self.clock
+            lexer = token.lexer
+            self.record(state, name, lexer.lexmatch.end() - token.lexpos, seconds, lexer.lexdata,
+                        token.lexpos)
+            self.clock = perf_counter()
+            return result
+        rule.__name__ = name
+        return rule
+    
+    def timer(self, lexer):
+        '''Switch the lexer (a clone of the Tokenizer's) over to the recording rules and return a
+        function to call instead of lexer.token.'''
+        lexer.lexstatere = self.tables
+        lexer.begin(lexer.current_state())
+        def token():
+            self.clock = perf_counter()
+            return lexer.token()
+        return token
+    
+    def record(self, state, rule, length, seconds, data, position):
+        counts = self.counts.get((state, rule))
+        if counts is None:
+            self.counts[(state, rule)] = [1, length, seconds]
+        else:
+            counts[0] += 1
+            counts[1] += length
+            counts[2] += seconds
+        # Only the rules of the same group can change places: those of an inclusive state always
+        # come before those of INITIAL
+        order = self.orders[state]
+        index = self.indices[state][rule]
+        end = self.groups[state] if index < self.groups[state] else len(order)
+        for later in order[index + 1:end]:
+            if (rule, later) not in self.after and self.patterns[later].match(data, position):
+                self.after.add((rule, later))
+    
+    def merge(self, other):
+        for key, counts in other.counts.items():
+            total = self.counts.setdefault(key, [0, 0, 0.0])
+            for index, count in enumerate(counts):
+                total[index] += count
+        self.after |= other.after
+    
+    def matches(self):
+        '''The number of matches of each rule, in all states.'''
+        totals = dict.fromkeys(self.lines, 0)
+        for (state, rule), counts in self.counts.items():
+            totals[rule] += counts[0]
+        return totals
+    
+    def suggest(self):
+        '''Return the rules in the order to define them in: the most frequent first, as long as no
+        rule is put ahead of one it has to stay after. A rule that others have to stay after goes
+        as early as the most frequent of them would.'''
+        matches = self.matches()
+        before = {rule: set() for rule in self.lines}
+        later = {rule: set() for rule in self.lines}
+        for rule, other in self.after:
+            before[other].add(rule)
+            later[rule].add(other)
+        priority = dict()
+        def rank(rule):
+            if rule not in priority:
+                priority[rule] = matches[rule]      # Before recursing, in case of a cycle
+                priority[rule] = max([matches[rule]] + [rank(other) for other in later[rule]])
+            return priority[rule]
+        order = list()
+        remaining = sorted(self.lines, key=self.lines.get)
+        while remaining:
+            # The first defined of equals, and if the rules are somehow circular, the first left
+            ready = [rule for rule in remaining if not before[rule]] or remaining[:1]
+            rule = max(ready, key=lambda rule: (rank(rule), matches[rule]))
+            remaining.remove(rule)
+            order.append(rule)
+            for rules in before.values():
+                rules.discard(rule)
+        return order
+    
+    def report(self, limit=10):
+        '''Print the busiest rules of each state, and the order each state would try its own rules
+        in if they were defined in the suggested order, where that differs from the order now.'''
+        for state in sorted(self.orders, key=lambda state: -self.total(state)[2]):
+            matches, length, seconds = self.total(state)
+            if not matches:
+                continue
+            print("State {0}: {1} matches, {2} characters, {3:.3f} s".format(state, matches,
+                                                                             length, seconds))
+            rules = sorted(((counts, rule) for (name, rule), counts in self.counts.items()
+                            if name == state), key=lambda item: -item[0][2])
+            for (matches, length, seconds), rule in rules[:limit]:
+                print("    {0:<32} {1:>9} {2:>10} {3:>10.3f} {4:>10.3f}".format(
+                    rule, matches, length, seconds, 1000000*seconds/matches))
+        matches = self.matches()
+        order = self.suggest()
+        for state, rules in sorted(self.orders.items()):
+            own = rules[:self.groups[state]]
+            suggested = [rule for rule in order if rule in own]
+            if suggested != own:
+                print("Suggested order of the rules of state " + state
+                      + " (rule, matches, position now):")
+                for rule in suggested:
+                    print("    {0:<32} {1:>9} {2:>5}".format(rule, matches[rule],
+                                                           own.index(rule) + 1))
+    
+    def total(self, state):
+        totals = [0, 0, 0.0]
+        for (name, rule), counts in self.counts.items():
+            if name == state:
+                for index, count in enumerate(counts):
+                    totals[index] += count
+        return totals
+    
+    def save(self, path):
+        '''Write the counts by state and the suggested order to path as JSON.'''
+        states = dict()
+        for state in self.orders:
+            matches, length, seconds = self.total(state)
+            rules = [{'rule': rule, 'position': index + 1, 'matches': counts[0],
+                      'characters': counts[1], 'seconds': counts[2]}
+                     for index, rule in enumerate(self.orders[state])
+                     for counts in [self.counts.get((state, rule))] if counts]
+            states[state] = {'matches': matches, 'characters': length, 'seconds': seconds,
+                             'rules': rules}
+        with open(path, 'w') as f:
+            json.dump({'states': states, 'order': self.suggest(),
+                       'after': sorted([rule, later] for rule, later in self.after)}, f, indent=2)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['write_master']
+
+import json, os, re
+from output import AtomicFile, digest
+
+def write_master(folders, include_only=None, template=os.curdir + '/pp.tex',
+                 directory=os.curdir + '/latex'):
+    '''Write latex/pp.tex, the master document: the preamble of the template followed by an
+    \\include for each converted chapter, in order. If include_only is a list of folders, only
+    those chapters are typeset (the page numbers and references of the others are kept from
+    their .aux files). Also writes latex/chapters.json, listing the size and hash of each chapter
+    file, so that a TeX build can tell which chapters have to be recompiled.'''
+    folders = sorted(folders, key=int)
+    if include_only is not None:
+        include_only = sorted(include_only, key=int)
+    with open(template, 'r', encoding='utf-8') as f:
+        preamble = re.split(r'\\begin\{document\}', f.read())[0].rstrip('\n')
+    with AtomicFile(directory + '/pp.tex') as f:
+        f.write(preamble + '\n')
+        if include_only is not None:
+            f.write('\\includeonly{' + ','.join(include_only) + '}\n')
+        f.write('\n\\begin{document}\n\n')
+        f.write(''.join('\\include{' + folder + '}\n' for folder in folders))
+        f.write('\n\\end{document}\n')
+    chapters = list()
+    for folder in folders:
+        path = directory + '/' + folder + '.tex'
+        chapters.append({'chapter': folder,
+                         'file': folder + '.tex',
+                         'bytes': os.path.getsize(path) if os.path.exists(path) else None,
+                         'sha1': digest(path)})
+    with AtomicFile(directory + '/chapters.json') as f:
+        f.write(json.dumps({'master': 'pp.tex', 'include_only': include_only,
+                            'chapters': chapters}, indent=2) + '\n')
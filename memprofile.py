@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Memory profiling with tracemalloc. Once enabled, the profiler follows the tracing spans: as each
+stage, text file and page starts and ends, it notes how much memory is traced, what the peak was
+in between and how much each line of code holds. For each kind of span it reports the highest
+peak and two views of the lines:
+
+- allocated: what each line held at the fullest point seen inside one call, over what it held
+  when the call started. The profiler can only look between spans, so this is the fullest of
+  the starts and ends of the spans nested inside, not the peak itself; memory taken and freed
+  again within a single nested span (or within a stage with nothing nested) isn't seen.
+- retained: how much more each line held when the calls ended than when they started.
+
+The ends of consecutive spans of the same kind (one text file and the next, say) are compared as
+well. Memory that is still held after one file is done and grows again after the next points to
+state that carries over from one conversion into the next. Converting page by page, the pages of
+all files are lexed before any is parsed, so there are no spans for whole text files to compare.
+
+Only the lines' totals are kept, not the snapshots. There are too many pages for a snapshot each,
+so the spans of single pages only keep their peak, and look at the lines for the spans around
+them only when the last look took less than a tenth of the time since.'''
+
+__all__ = ['enable', 'MemoryProfile']
+
+import json, tracemalloc, tracing
+from time import perf_counter
+
+profiler = None                         # The MemoryProfile while memory profiling is enabled
+
+# The files whose allocations aren't counted: tracemalloc, the profiler itself and the imports
+IGNORED = set([tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>',
+               '<frozen importlib._bootstrap_external>', '<unknown>'])
+
+# The spans there are too many of to take a snapshot for; only their peaks are kept
+PAGES = set(['tokenize_page', 'parse_page'])
+# How much longer than a snapshot took to wait before taking another at a page
+SPACING = 10
+
+def enable(frames=1):
+    '''Start tracing allocations, keeping frames frames of each, and follow the tracing spans.'''
+    global profiler
+    if profiler is not None:
+        return
+    tracemalloc.start(frames)
+    profiler = MemoryProfile()
+    tracing.listeners.append(profiler)
+
+def sizes():
+    '''The memory held by each line of code that allocated any, by 'file:line'.'''
+    return {str(stat.traceback[0]): stat.size
+            for stat in tracemalloc.take_snapshot().statistics('lineno')
+            if stat.traceback[0].filename not in IGNORED}
+
+def growth(before, after):
+    '''How much more each line holds in after than in before, for the lines that hold more.'''
+    grown = dict()
+    for site, size in after.items():
+        if size > before.get(site, 0):
+            grown[site] = size - before.get(site, 0)
+    return grown
+
+def megabytes(size):
+    return "{0:.2f} MiB".format(size/2**20)
+
+class Stage(object):
+    '''A span that has started and not yet ended.'''
+    __slots__ = ['name', 'sizes', 'current', 'peak', 'fullest', 'allocated']
+    
+    def __init__(self, name, sizes, current, peak):
+        self.name = name
+        self.sizes = sizes
+        self.current = current
+        self.peak = peak
+        self.fullest = 0                # How far above current the sizes looked at went
+        self.allocated = None           # The sizes looked at when they were
+
+class MemoryProfile(object):
+    '''Listens to the tracing spans and keeps the memory counts of each kind. The profiler's own
+    memory (mostly the sizes it is holding on to) is taken off the traced memory, and so off the
+    peaks.'''
+    def __init__(self):
+        self.stack = list()             # The spans that are open, innermost last
+        self.stages = dict()            # [calls, peak, retained, retained by line, fullest,
+                                        #  allocated by line] by span name
+        self.last = dict()              # The sizes at the end of the last span of each name
+        self.leaks = dict()             # [intervals, growth by line, times grown by line] by name
+        self.overhead = 0               # The memory the profiler held when it last looked
+        self.peak = 0
+        self.looked = perf_counter()    # When the last snapshot was done
+        self.cost = 0.0                 # How long it took
+    
+    def sizes(self):
+        '''Take a snapshot and work out the overhead again.'''
+        start = perf_counter()
+        result = sizes()
+        self.overhead = max(0, tracemalloc.get_traced_memory()[0] - sum(result.values()))
+        self.looked = perf_counter()
+        self.cost = self.looked - start
+        return result
+    
+    def due(self):
+        '''Whether it has been long enough since the last snapshot to take one at a page.'''
+        return perf_counter() - self.looked > SPACING*self.cost
+    
+    def look(self, sizes):
+        '''Keep sizes for each open span it is the fullest point seen inside so far.'''
+        total = sum(sizes.values())
+        for stage in self.stack:
+            if stage.sizes is not None and total - stage.current > stage.fullest:
+                stage.fullest = total - stage.current
+                stage.allocated = sizes
+    
+    def fold(self):
+        '''Count the peak since it was last reset towards the innermost open span, and reset it.'''
+        peak = tracemalloc.get_traced_memory()[1] - self.overhead
+        self.peak = max(self.peak, peak)
+        if self.stack:
+            self.stack[-1].peak = max(self.stack[-1].peak, peak)
+        tracemalloc.reset_peak()
+    
+    def enter(self, name, args):
+        self.fold()
+        if name in PAGES:
+            if self.due():
+                self.look(self.sizes())
+            current = tracemalloc.get_traced_memory()[0]
+            self.stack.append(Stage(name, None, current, current - self.overhead))
+        else:
+            before = self.sizes()
+            self.look(before)
+            self.stack.append(Stage(name, before, sum(before.values()), sum(before.values())))
+        tracemalloc.reset_peak()
+    
+    def exit(self, name, args):
+        self.fold()
+        counts = self.stages.setdefault(name, [0, 0, 0, dict(), 0, dict()])
+        counts[0] += 1
+        if name in PAGES:
+            stage = self.stack.pop()
+            counts[2] += tracemalloc.get_traced_memory()[0] - stage.current
+            if self.due():
+                self.look(self.sizes())
+        else:
+            after = self.sizes()
+            self.look(after)
+            stage = self.stack.pop()
+            counts[2] += sum(after.values()) - stage.current
+            for site, size in growth(stage.sizes, after).items():
+                counts[3][site] = counts[3].get(site, 0) + size
+            if stage.fullest > counts[4]:
+                counts[4] = stage.fullest
+                counts[5] = growth(stage.sizes, stage.allocated)
+            if name in self.last:
+                leaks = self.leaks.setdefault(name, [0, dict(), dict()])
+                leaks[0] += 1
+                for site, size in growth(self.last[name], after).items():
+                    leaks[1][site] = leaks[1].get(site, 0) + size
+                    leaks[2][site] = leaks[2].get(site, 0) + 1
+            self.last[name] = after
+        counts[1] = max(counts[1], stage.peak)
+        if self.stack:
+            self.stack[-1].peak = max(self.stack[-1].peak, stage.peak)
+        tracemalloc.reset_peak()
+    
+    def top(self, grown, limit):
+        return sorted(grown.items(), key=lambda item: -item[1])[:limit]
+    
+    def report(self, limit=5):
+        '''Print the peak for each kind of span, with the lines that had allocated the most at the
+        fullest point seen in it and those that retained the most after it, then the lines that
+        held more at the end of most spans of a kind than at the end of the last.'''
+        self.fold()
+        print("Peak traced memory: " + megabytes(self.peak))
+        for name, (calls, peak, retained, kept, fullest, allocated) in sorted(
+                self.stages.items(), key=lambda item: -item[1][1]):
+            print("Stage {0}: {1} calls, peak {2}, {3} retained afterwards".format(
+                name, calls, megabytes(peak), megabytes(retained)))
+            if allocated:
+                print("  Allocated at the fullest point seen ({0} above the start):".format(
+                    megabytes(fullest)))
+                for site, size in self.top(allocated, limit):
+                    print("    {0:>12}  {1}".format(megabytes(size), site))
+            if kept:
+                print("  Retained:")
+                for site, size in self.top(kept, limit):
+                    print("    {0:>12}  {1}".format(megabytes(size), site))
+        for name, (intervals, grown, times) in sorted(self.leaks.items()):
+            suspects = [(site, size) for site, size in self.top(grown, len(grown))
+                        if times[site] > intervals/2][:limit]
+            if suspects:
+                print("Held on to after most of {0} consecutive {1} stages:".format(intervals,
+                                                                                    name))
+                for site, size in suspects:
+                    print("    {0:>12}  {1} ({2} times)".format(megabytes(size), site,
+                                                             times[site]))
+    
+    def save(self, path, limit=20):
+        '''Write everything report() prints, with up to limit lines each, to path as JSON.'''
+        self.fold()
+        stages = [{'name': name, 'calls': calls, 'peak': peak, 'fullest': fullest,
+                   'allocated': [{'site': site, 'bytes': size}
+                                 for site, size in self.top(allocated, limit)],
+                   'retained': retained,
+                   'retained_sites': [{'site': site, 'bytes': size}
+                                      for site, size in self.top(kept, limit)]}
+                  for name, (calls, peak, retained, kept, fullest, allocated)
+                  in self.stages.items()]
+        leaks = {name: {'intervals': intervals,
+                        'sites': [{'site': site, 'bytes': size, 'times': times[site]}
+                                  for site, size in self.top(grown, limit)]}
+                 for name, (intervals, grown, times) in self.leaks.items()}
+        with open(path, 'w') as f:
+            json.dump({'peak': self.peak, 'stages': stages, 'leaks': leaks}, f, indent=2)
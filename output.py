@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['AtomicFile', 'OutputBuffer']
+
+import codecs, hashlib, os
+
+class OutputBuffer(object):
+    '''Collects LaTeX output in memory and writes it to the underlying stream in large chunks.
+    The last character written is tracked so that the parser can decide on whitespace without
+    seeking back through the output file.'''
+    
+    def __init__(self, stream, chunk_size=65536, offset=0, last='\n'):
+        '''If the buffer continues output that was written elsewhere, offset is the number of
+        characters already written and last is the final one.'''
+        self.stream = stream                    # File (or any object with write()) to flush to
+        self.chunk_size = chunk_size            # Flush once this many characters are buffered
+        self.chunks = []                        # Strings written since the last flush
+        self.buffered = 0                       # Number of characters in self.chunks
+        self.offset = offset                    # Number of characters written before this buffer
+        self.position = offset                  # Number of characters written in total
+        self.last = last                        # Nothing written yet counts as the start of a line
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.flush()
+        
+    def write(self, text):
+        if text:
+            self.chunks.append(text)
+            self.buffered += len(text)
+            self.position += len(text)
+            self.last = text[-1]
+            if self.buffered >= self.chunk_size:
+                self.flush()
+                
+    def tell(self):
+        '''Number of characters written so far, whether or not they have been flushed.'''
+        return self.position
+    
+    def flush(self):
+        '''Write everything buffered so far to the stream.'''
+        if self.chunks:
+            self.stream.write(''.join(self.chunks))
+            self.chunks = []
+            self.buffered = 0
+
+class AtomicFile(object):
+    '''A text file that is written next to path and only moved into place when it is closed, and
+    only if its content differs from what is at path already. An unchanged file keeps its
+    timestamp, so make and latexmk don't rebuild anything that depends on it. After closing,
+    changed says whether path was replaced.'''
+    
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.temp = path + '.' + str(os.getpid()) + '.tmp'
+        self.file = codecs.open(self.temp, 'w', encoding)
+        self.changed = None
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave whatever was there before rather than half a file
+            self.file.close()
+            os.remove(self.temp)
+            
+    def write(self, text):
+        self.file.write(text)
+        
+    def close(self):
+        self.file.close()
+        if digest(self.temp) == digest(self.path):
+            os.remove(self.temp)
+            self.changed = False
+        else:
+            os.replace(self.temp, self.path)
+            self.changed = True
+        
+def digest(path):
+    '''SHA-1 of the file at path, or None if there is none.'''
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
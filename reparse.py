@@ -20,45 +20,67 @@
 # SOFTWARE.
 
 from exceptions import ParseError
-import logging, re, util
+from rewrite import CharMap, Rewriter, Rule
+import escape, logging, re, util
+from collections import OrderedDict
+
+# The template substitutions of careful_sub, in the order they used to be applied one by one
+TEMPLATES = Rewriter([Rule(r'\{{2}hi\|\dem\|(?P<text>.*?)\}{2}', r'\g<text>', bare=True),
+                      Rule(r'\{{2}u\|(?P<text>.*?)\}{2}', r'\\uline{\g<text>}'),
+                      Rule(r'\{{2}larger\|(?P<text>.*?)\}{2}',
+                           r'\\begin{large}\g<text>\\end{large}'),
+                      Rule(r'\{{2}x\-smaller\|(?P<text>.*?)\}{2}',
+                           r'\\begin{footnotesize}\g<text>\\end{footnotesize}'),
+                      Rule(r'\{{2}x\-larger\|(?P<text>.*?)\}{2}',
+                           r'\\begin{Large}\g<text>\\end{Large}'),
+                      Rule(r"'{3}(?P<text>.*?)'{3}", r'\\textbf{\g<text>}'),
+                      Rule(r'[[]{2}(?:(?P<page>.*?)\|)?(?P<link>.*?)[]]{2}', r'\g<link>',
+                           bare=True),
+                      Rule(r'<br\s?/?>', r'\\\\\n'),
+                      Rule(r'[{]{2}popup\snote\|(.*?)\|(?P<text>.*?)[}]{2}', r'\g<text>',
+                           bare=True),
+                      Rule(r'\{{2}(?:block\s)?right\|(?P<text>.*?)\}{2}',
+                           r'\\begin{flushright}\g<text>\\end{flushright}')],
+                     forbidden=r"[{}[\]]|''|<br", boundary="'<",
+                     markers=r"\{\{|\}\}|\[\[|\]\]|''|<br")
+# The HTML tags that are replaced after them (the single characters are in escape)
+MARKUP = CharMap([('<u>', '\\uline{'), ('</u>', '}')])
+BRACES = re.compile(r'\{\{|\}\}')
+PLACEHOLDERS = 0xE000                   # Start of the Unicode private use area
+ACTIVE = re.compile(r"[{}[\]'<|\n]")      # Characters the substitutions could act on
+# Remembered results of the methods that see the same text over and over (running headers,
+# headings), shared by every Reparser in the process
+MEMOS = OrderedDict((name, util.LRUMemo())
+                    for name in ('running_header', 'sub', 'left', 'traverse'))
+
+memo_size = None                        # Set by set_memo_size, for the worker processes
+
+def set_memo_size(size):
+    '''Remember up to size results of each memoized method.'''
+    global memo_size
+    memo_size = size
+    for memo in MEMOS.values():
+        memo.resize(size)
+
+def memo_counts():
+    '''The [hits, misses, evictions] of each memoized method so far, by name.'''
+    return dict((name, memo.counts()) for name, memo in MEMOS.items())
 
 class Reparser(object):
     def __init__(self):
         self.logger = logging.getLogger("W2L")
         
-    def careful_sub(self, text, traverse=False):
+    def careful_sub(self, text, table=escape.TEMPLATE):
         # Currently ignoring {{popup note}} and {{hi}}
-        '''Only substitute templates -- passing substituted text through this will not change it.'''
-        text = re.sub(r'\{{2}hi\|\dem\|(?P<text>.*?)\}{2}', r'\g<text>', text)
-        text = re.sub(r'\{{2}u\|(?P<text>.*?)\}{2}', r'\\uline{\g<text>}', text)
-        text = re.sub(r'\{{2}larger\|(?P<text>.*?)\}{2}',
-                      r'\\begin{large}\g<text>\\end{large}', text)
-        text = re.sub(r'\{{2}x\-smaller\|(?P<text>.*?)\}{2}',
-                      r'\\begin{footnotesize}\g<text>\\end{footnotesize}', text)
-        text = re.sub(r'\{{2}x\-larger\|(?P<text>.*?)\}{2}',
-                      r'\\begin{Large}\g<text>\\end{Large}', text)
-        text = re.sub(r"'{3}(?P<text>.*?)'{3}", r'\\textbf{\g<text>}', text)
-        text = re.sub(r'[[]{2}(?:(?:.*?)\|)?(?P<link>.*?)[]]{2}', r'\g<link>',
-                      text)
-        text = re.sub(r'<br\s?/?>', r'\\\\\n', text)
-        text = re.sub(r'[{]{2}popup\snote\|(.*?)\|(?P<text>.*?)[}]{2}', r'\g<text>', text)
-        text = re.sub(r'\{{2}(?:block\s)?right\|(?P<text>.*?)\}{2}',
-                      r'\\begin{flushright}\g<text>\\end{flushright}', text)
-        text = text.replace('<u>', '\\uline{').replace('</u>', '}').replace('✓', '{\\checked}')
-        text = text.replace("–", "--").replace("—", "---")
-        text = text.replace("□", "\\Square~").replace("|", "{\\textbar}")
-        if traverse:
-            text = text.replace("{", "`").replace("}", "@@")
-            text = text.replace("\n", "~")
-        return text
+        '''Only substitute templates -- passing substituted text through this will not change it.
+        The characters are then escaped with table.'''
+        return table.sub(MARKUP.sub(TEMPLATES.sub(text)))
         
     def final_sub(self, text):
         '''This can only be run once on text, or it will substitute substitute chars.'''
-        text = text.replace("#", "\#").replace("$", "\$").replace("%", "\%")
-        text = text.replace("_", "\_").replace("^", "\^").replace("~", "\~")
-        text = text.replace("&", "\&")
-        return text
+        return escape.FINAL.sub(text)
     
+    @util.memoized(MEMOS['left'])
     def left(self, text):
         offset = None
         o = re.search('\|offset=(?P<o>\d)em', text)
@@ -70,23 +92,58 @@ class Reparser(object):
             text = "\\hspace*{" + offset + "em}" + text + " \\\\\n"
         return text
     
+    @util.memoized(MEMOS['traverse'])
     def traverse(self, text):
-        while True:
-            l = util.findall(text, "{{")
-            r = util.findall(text, "}}")
-            if len(l) < len(r):
-                text = text[:-2]
-                r.pop()
-            elif len(l) == 0:
-                break
+        '''Substitute the templates in text, nested ones first, in a single walk over the nesting.
+        Unless it is plain text, the output of each nested template takes part in the
+        substitutions of the one around it as a placeholder, so it isn't substituted again.'''
+        # Closing braces with no opening ones are cut off the end
+        while len(util.findall(text, "}}")) > len(util.findall(text, "{{")):
+            text = text[:-2]
+        stack = [[]]                            # Pieces of each open template, outermost first
+        position = 0
+        for match in BRACES.finditer(text):
+            stack[-1].append(text[position:match.start()])
+            position = match.end()
+            if match.group() == '{{':
+                stack.append(['{{'])
+            elif len(stack) > 1:
+                pieces = stack.pop()
+                pieces.append('}}')
+                output = self.expand(pieces)
+                # Plain text can simply run on into the template around it
+                stack[-1].append((output,) if ACTIVE.search(output) else output)
             else:
-                temp = self.careful_sub(text[l[-1]:r[0]+2], True)
-                text = text.replace(text[l[-1]:r[0]+2], temp)
-        text = text.replace("~", "\n")
-        text = self.final_sub(text)
-        text = text.replace("`", "{").replace("@@", "}")
-        return text
+                stack[-1].append('}}')
+        stack[-1].append(text[position:])
+        # Anything left open is kept as it is
+        pieces = [piece for level in stack for piece in level]
+        return self.final_sub(''.join(piece if piece.__class__ is str else piece[0]
+                                      for piece in pieces))
+    
+    def expand(self, pieces):
+        '''Substitute one template, given as a list of strings and (output,) tuples for the
+        templates nested in it.'''
+        children = [piece[0] for piece in pieces if piece.__class__ is tuple]
+        if not children:
+            return self.careful_sub(''.join(pieces))
+        # Stand in for each child with a private use character that isn't in the template itself
+        text = ''.join(piece for piece in pieces if piece.__class__ is str)
+        base = PLACEHOLDERS
+        while any(chr(base + i) in text for i in range(len(children))):
+            base += len(children)
+        segment = list()
+        child = base
+        for piece in pieces:
+            if piece.__class__ is str:
+                segment.append(piece)
+            else:
+                segment.append(chr(child))
+                child += 1
+        return self.careful_sub(''.join(segment)).translate(
+            dict((base + i, child) for i, child in enumerate(children)))
             
+    @util.memoized(MEMOS['running_header'])
     def running_header(self, text):
         '''Parse out the insides of a {{rh}} template into a LaTeX table.'''
         # Remove {{rh and closing }}
@@ -128,8 +185,8 @@ class Reparser(object):
             runningheader = '\n\\vfill\n\\begin{spacing}{0}' + runningheader + '\\end{spacing}\n'
         return runningheader
     
-    def sub(self, text):
-        '''Perform common substitutions'''
-        text = self.careful_sub(text)
-        text = self.final_sub(text)
-        return text
\ No newline at end of file
+    @util.memoized(MEMOS['sub'])
+    def sub(self, text, table=escape.TEXT):
+        '''Perform common substitutions. The default table does the escaping of final_sub in the
+        same pass.'''
+        return self.careful_sub(text, table)
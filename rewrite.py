@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Compiled text rewriting. A Rewriter applies a list of regular expression substitutions that
+used to run one after the other with a single combined pattern, in one pass over the text. A
+CharMap does the same for a chain of plain str.replace calls.'''
+
+__all__ = ['CharMap', 'Rewriter', 'Rule']
+
+import re
+
+class Rule(object):
+    '''One substitution: a pattern and its replacement template (as for re.sub). A bare rule is one
+    whose replacement doesn't begin and end with text of its own, so that what it leaves behind
+    runs straight into the text around the match. A boundary rule is one whose delimiters could
+    run on into the text around the match, so that another rule, run first, could have used them.
+    Every part of the pattern that isn't one of the delimiters the rule looks for has to be in a
+    group (see Rewriter).'''
+    def __init__(self, pattern, replacement, bare=False, boundary=False):
+        self.pattern = pattern
+        self.replacement = replacement
+        self.bare = bare
+        self.boundary = boundary
+        self.regex = re.compile(pattern)
+        
+    def renamed(self, prefix):
+        '''The pattern and replacement with every named group prefixed, so that the patterns of
+        several rules can be combined without their group names clashing.'''
+        pattern = re.sub(r'\(\?P<(\w+)>', '(?P<' + prefix + r'\1>', self.pattern)
+        replacement = re.sub(r'\\g<([^\W\d]\w*)>', r'\\g<' + prefix + r'\1>', self.replacement)
+        return pattern, replacement
+
+def compile_template(template, regex, offset=0):
+    '''Split a replacement template into a list of literal strings and the numbers of the groups
+    of regex to put between them, so that it needn't be parsed again for every match (as
+    Match.expand does). Numbered groups are counted from offset.'''
+    parts = list()
+    for piece in re.split(r'(\\g<\w+>|\\.)', template):
+        if piece.startswith('\\g<'):
+            name = piece[3:-1]
+            parts.append(offset + int(name) if name.isdigit() else regex.groupindex[name])
+            continue
+        if piece.startswith('\\'):
+            if piece[1] not in ESCAPES:
+                raise ValueError("unsupported escape " + piece + " in " + repr(template))
+            piece = ESCAPES[piece[1]]
+        if parts and parts[-1].__class__ is str:
+            parts[-1] += piece
+        elif piece:
+            parts.append(piece)
+    return parts
+
+# The escapes allowed in replacement templates
+ESCAPES = {'\\': '\\', 'n': '\n', 't': '\t'}
+
+class Rewriter(object):
+    '''Applies a list of Rules with the same result as running re.sub for each in turn, but in a
+    single pass: the rule patterns are joined into one alternation, and each match is replaced by
+    the rule it came from.
+    
+    The two are only the same as long as the rules don't interact, i.e. no rule matches (or stops
+    matching) text that another rule has rewritten. The single pass checks for this: the text
+    outside the matches and inside their groups may not contain the forbidden pattern (the
+    delimiters the rules look for, which could start or end a match of some other rule in the
+    sequential version); the characters around a bare rule's output, and around a boundary
+    rule's match, may not be in boundary (where joining two pieces of text could form a
+    delimiter); and the result may not contain the markers
+    pattern (delimiters formed anyway). Text that fails any of these is rewritten sequentially.'''
+    def __init__(self, rules, forbidden, boundary='', markers=None):
+        self.rules = rules
+        self.forbidden = re.compile(forbidden)
+        self.boundary = boundary
+        self.markers = re.compile(markers) if markers else None
+        renamed = [rule.renamed('r' + str(number) + '_') for number, rule in enumerate(rules)]
+        self.combined = re.compile('|'.join('(' + pattern + ')' for pattern, replacement in renamed))
+        self.dispatch = dict()                  # Index of a rule's outer group -> its details
+        index = 1
+        for rule, (pattern, replacement) in zip(rules, renamed):
+            groups = rule.regex.groups
+            template = compile_template(replacement, self.combined, index)
+            self.dispatch[index] = (rule, template, range(index + 1, index + 1 + groups))
+            index += groups + 1
+        self.fast = 0                           # Texts rewritten in a single pass
+        self.slow = 0                           # Texts that had to be rewritten rule by rule
+        
+    def sub(self, text):
+        result = self.single_pass(text)
+        if result is None:
+            self.slow += 1
+            return self.sequential(text)
+        self.fast += 1
+        return result
+    
+    def sequential(self, text):
+        '''Run each rule over the whole text in turn.'''
+        for rule in self.rules:
+            text = rule.regex.sub(rule.replacement, text)
+        return text
+    
+    def single_pass(self, text):
+        '''Rewrite text in one pass, or return None if the rules might interact.'''
+        forbidden = self.forbidden.search
+        boundary = self.boundary
+        pieces = list()
+        position = 0
+        for match in self.combined.finditer(text):
+            start, end = match.span()
+            if forbidden(text, position, start):
+                return None
+            rule, replacement, groups = self.dispatch[match.lastindex]
+            for group in groups:
+                inner = match.group(group)
+                if inner and forbidden(inner):
+                    return None
+            output = ''.join([part if part.__class__ is str else match.group(part) or ''
+                              for part in replacement])
+            if rule.bare and boundary:
+                edges = output[:1] + output[-1:] + text[start-1:start] + text[end:end+1]
+                if any(char in boundary for char in edges):
+                    return None
+            elif rule.boundary:
+                edges = text[start-1:start] + text[end:end+1]
+                if any(char in boundary for char in edges):
+                    return None
+            pieces.append(text[position:start])
+            pieces.append(output)
+            position = end
+        if forbidden(text, position):
+            return None
+        pieces.append(text[position:])
+        result = ''.join(pieces)
+        if self.markers and self.markers.search(result):
+            return None
+        return result
+
+class CharMap(object):
+    '''Applies a chain of plain replacements (old, new), as if by str.replace in that order, in one
+    pass. Each replacement already has the replacements after it applied, so the result is the
+    same as long as no old string can be formed from a new string and the text next to it.'''
+    def __init__(self, pairs):
+        self.pairs = list(pairs)
+        self.table = dict()
+        for index, (old, new) in enumerate(self.pairs):
+            for later_old, later_new in self.pairs[index + 1:]:
+                new = new.replace(later_old, later_new)
+            self.table.setdefault(old, new)
+        if all(len(old) == 1 for old in self.table):
+            self.translation = str.maketrans(self.table)
+            self.regex = None
+        else:
+            self.translation = None
+            self.regex = re.compile('|'.join(re.escape(old) for old, new in self.pairs))
+            
+    def sub(self, text):
+        if self.translation is not None:
+            return text.translate(self.translation)
+        table = self.table
+        return self.regex.sub(lambda match: table[match.group()], text)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Scheduler']
+
+import json, logging, os
+
+class Scheduler(object):
+    '''Finds every folder and text file to convert and orders the folders so that the most
+    expensive ones are started first, which keeps the total time of a parallel run down. The cost
+    of a folder is estimated from its size and from the timings recorded by earlier runs.'''
+    
+    def __init__(self, directory=os.curdir + '/text', logfile=os.curdir + '/timings.json'):
+        self.logger = logging.getLogger("W2L")
+        self.directory = directory
+        self.logfile = logfile
+        self.sizes = dict()                     # Bytes of text in each folder
+        self.history = dict()                   # Folder -> {'bytes': ..., 'seconds': ...}
+        if os.path.exists(self.logfile):
+            try:
+                with open(self.logfile, 'r') as f:
+                    self.history = json.load(f)
+            except ValueError:
+                self.logger.exception("Could not read the timing log; estimating from size only.")
+    
+    def discover(self):
+        '''Return a list of (folder, files) pairs for every folder in the text directory, with the
+        files in numeric order.'''
+        jobs = list()
+        folders = [f for f in os.listdir(self.directory) if f.isdigit()]
+        for folder in sorted(folders, key=int):
+            path = self.directory + '/' + folder
+            files = [f for f in os.listdir(path) if os.path.splitext(f)[0].isdigit()]
+            files = sorted(files, key=lambda x: int(os.path.splitext(x)[0]))
+            self.sizes[folder] = sum(os.path.getsize(path + '/' + file) for file in files)
+            jobs.append((folder, files))
+        return jobs
+    
+    def rate(self):
+        '''Seconds per byte over all previously timed folders, or None if there are none.'''
+        total_bytes = sum(entry['bytes'] for entry in self.history.values())
+        total_seconds = sum(entry['seconds'] for entry in self.history.values())
+        if total_bytes and total_seconds:
+            return total_seconds / total_bytes
+        return None
+    
+    def cost(self, folder):
+        '''Estimated seconds to convert a folder. A folder that hasn't changed size since it was
+        last timed is expected to take as long as it did then; anything else is estimated from
+        its size. Without any history the size itself is used, which orders folders the same way.'''
+        size = self.sizes[folder]
+        entry = self.history.get(folder)
+        if entry and entry['bytes'] == size:
+            return entry['seconds']
+        rate = self.rate()
+        return size * rate if rate else size
+    
+    def schedule(self):
+        '''Return the (folder, files) pairs to convert, most expensive first.'''
+        jobs = self.discover()
+        return sorted(jobs, key=lambda job: (-self.cost(job[0]), int(job[0])))
+    
+    def shard(self, index, count):
+        '''Return the (folder, files) pairs that shard index (1 to count) should convert, most
+        expensive first. Folders are dealt out largest first to whichever shard has the least work
+        so far. Only folder sizes are used here, not the timing log, so that every shard comes to
+        the same split even if another shard has already updated the log.'''
+        jobs = sorted(self.discover(), key=lambda job: (-self.sizes[job[0]], int(job[0])))
+        loads = [0] * count
+        shards = [list() for i in range(count)]
+        for job in jobs:
+            lightest = loads.index(min(loads))
+            loads[lightest] += self.sizes[job[0]]
+            shards[lightest].append(job)
+        return shards[index - 1]
+    
+    def record(self, timings):
+        '''Save the time each folder took in this run to the timing log, for later estimates.'''
+        for folder, seconds in timings.items():
+            self.history[folder] = {'bytes': self.sizes[folder], 'seconds': round(seconds, 4)}
+        with open(self.logfile, 'w') as f:
+            json.dump(self.history, f, indent=2, sort_keys=True)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['manifest_path', 'write_manifest', 'merge']
+
+import json, logging, os, util
+from exceptions import ShardError
+
+def manifest_path(index, count, directory=os.curdir + '/latex'):
+    return directory + '/shard-' + str(index) + '-of-' + str(count) + '.json'
+
+def write_manifest(index, count, jobs, progress, timings):
+    '''Record which chapters shard index of count converted, with its page counts, timings and the
+    stage times and cache and memo counts of its run.'''
+    manifest = {'shard': index,
+                'shards': count,
+                'chapters': sorted((folder for folder, files in jobs), key=int),
+                'status': progress.status,
+                'chapter_counts': progress.chapters,
+                'stages': progress.stages,
+                'caches': progress.caches,
+                'memos': progress.memos,
+                'timings': timings}
+    with open(manifest_path(index, count), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+def merge(count, scheduler, progress):
+    '''Combine the manifests written by shards 1 to count. Checks that every folder was converted
+    exactly once, adds the page counts (overall and by chapter), stage times and cache and memo
+    counts to progress and the timings to the scheduler's log, and returns the list of converted
+    folders.'''
+    logger = logging.getLogger("W2L")
+    expected = set(folder for folder, files in scheduler.discover())
+    converted = list()
+    timings = dict()
+    for index in range(1, count + 1):
+        path = manifest_path(index, count)
+        if not os.path.exists(path):
+            raise ShardError("Shard " + str(index) + " of " + str(count) + " has not finished: "
+                             + path + " is missing.")
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+        logger.debug("Merging shard " + str(index) + " of " + str(count) + ": chapters "
+                     + ", ".join(manifest['chapters']) + ".")
+        converted.extend(manifest['chapters'])
+        timings.update(manifest['timings'])
+        shard_progress = util.ProgressChecker()
+        shard_progress.status = manifest['status']
+        shard_progress.chapters = manifest.get('chapter_counts', dict())
+        shard_progress.stages = manifest.get('stages', dict())
+        shard_progress.caches = manifest.get('caches', dict())
+        shard_progress.memos = manifest.get('memos', dict())
+        progress.merge(shard_progress)
+    if len(converted) != len(set(converted)) or set(converted) != expected:
+        raise ShardError("The shards converted chapters " + ", ".join(sorted(converted, key=int))
+                         + " but the text folder has " + ", ".join(sorted(expected, key=int)) + ".")
+    scheduler.record(timings)
+    return converted
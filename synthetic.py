@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Synthetic Wikisource page text for benchmarks. The pages have a page quality header and a
+running head, and then a mix of the constructs the tokenizer handles: paragraphs with inline
+templates and links, indents, centered and right-aligned blocks, size templates, hanging indents,
+rules, ordered lists, tables of contents and wikitables with spanning cells. How often each turns
+up is set by a mix of weights, and how much text there is by size.
+
+Run "python synthetic.py DIRECTORY" to write a whole corpus in the layout core.py reads
+(DIRECTORY/text/<chapter>/<file>.txt).'''
+
+__all__ = ['MIX', 'parse_mix', 'choose', 'page', 'text', 'write_corpus']
+
+import argparse, codecs, os, random
+
+# How often each kind of block turns up on a page, relative to the others
+MIX = {'paragraph': 12,
+       'indent': 3,
+       'center': 2,
+       'right': 1,
+       'size': 1,
+       'hi': 1,
+       'rule': 0.5,
+       'list': 1,
+       'toc': 0.5,
+       'wikitable': 1}
+
+WORDS = ['the', 'of', 'and', 'to', 'in', 'a', 'policy', 'French', 'Viet', 'Minh', 'Saigon',
+         'Hanoi', 'Indochina', 'government', 'forces', 'military', 'aid', 'program', 'Geneva',
+         'settlement', 'Department', 'State', 'Defense', 'memorandum', 'report', 'President',
+         'support', 'war', 'communist', 'pressure', 'Diem', 'regime', 'NSC', 'MAAG', 'assistance',
+         'would', 'should', 'was', 'were', 'not', 'that', 'this', 'with', 'by', 'from', 'on']
+NUMBERS = ['1950', '1954', '50%', '#3', '12', '1,200', '$385', '17th', 'A-12']
+# Inline markup, with {0} standing for a few words
+INLINE = ["''{0}''", "'''{0}'''", '{{{{u|{0}}}}}', '[[w:Saigon|{0}]]', '{{{{popup note|DOD|{0}}}}}',
+          '{0}<br />{0}', '{0} – {0}', '{0}...', '{0} & {0}']
+TOC_NUMBERS = ['I', 'A', '1', 'a']
+
+def words(rng, low=1, high=6):
+    return ' '.join(rng.choice(WORDS) for i in range(rng.randint(low, high)))
+
+def sentence(rng, markup=0.2):
+    '''A sentence of words, some numbers and, with probability markup per phrase, inline markup.'''
+    phrases = list()
+    for i in range(rng.randint(2, 5)):
+        if rng.random() < markup:
+            phrases.append(rng.choice(INLINE).format(words(rng, 1, 3)))
+        elif rng.random() < 0.1:
+            phrases.append(rng.choice(NUMBERS))
+        else:
+            phrases.append(words(rng))
+    text = ' '.join(phrases)
+    return text[0].upper() + text[1:] + rng.choice(['.', '.', '.', ';', ':', ','])
+
+def paragraph(rng):
+    return ' '.join(sentence(rng) for i in range(rng.randint(1, 6))) + '\n'
+
+def indent(rng):
+    return ':' * rng.randint(1, 3) + sentence(rng) + '\n'
+
+def center(rng):
+    if rng.random() < 0.5:
+        return '{{center|' + words(rng, 2, 8) + '}}\n'
+    return '{{block center|' + words(rng, 2, 8) + '<br />' + words(rng, 2, 8) + '}}\n'
+
+def right(rng):
+    return '{{right|' + words(rng, 1, 4) + '}}\n'
+
+def size(rng):
+    template = rng.choice(['larger', 'smaller', 'x-larger', 'x-smaller', 'xx-smaller'])
+    return '{{' + template + '|' + words(rng, 1, 6) + '}}\n'
+
+def hanging(rng):
+    return '{{hi|' + str(rng.randint(1, 3)) + 'em|' + sentence(rng) + '}}\n'
+
+def rule(rng):
+    return rng.choice(['{{rule}}\n', '{{rule|height=2px}}\n'])
+
+def ordered_list(rng):
+    items = ['<li>' + sentence(rng, 0) + '</li>\n' for i in range(rng.randint(1, 6))]
+    return '<ol>\n' + ''.join(items) + '</ol>\n'
+
+def contents(rng, entries=None):
+    '''A table of contents: numbered entries, each at most one level deeper than the last, most
+    with a page number.'''
+    lines = ['{|\n']
+    level = 0
+    for i in range(entries or rng.randint(2, 20)):
+        level = rng.randint(1, min(level + 1, 4))
+        page = ''
+        if rng.random() < 0.8:
+            page = ' ' + rng.choice('ABCD') + '-' + str(rng.randint(1, 99))
+        lines.append('|-\n' + '|' * level + TOC_NUMBERS[level - 1] + '. ' + words(rng, 1, 6).title()
+                     + page + '\n')
+    return ''.join(lines) + '|}\n'
+
+def cell(rng):
+    '''The text of a wikitable cell. It never starts like a TOC entry ("A." or "1.").'''
+    return rng.choice([words(rng, 1, 3).title(), rng.choice(NUMBERS[:-1]), "'''" + words(rng, 1, 2)
+                       + "'''", words(rng, 1, 2) + '<br />' + words(rng, 1, 2)])
+
+def wikitable(rng, rows=None, columns=None):
+    '''A wikitable of rows rows and columns columns, with some cells spanning two or three.'''
+    columns = columns or rng.randint(2, 6)
+    lines = [rng.choice(['{|\n', '{| style="width: 80%; text-align: center;" border="1"\n'])]
+    for i in range(rows or rng.randint(1, 12)):
+        cells = list()
+        width = 0
+        while width < columns:
+            span = rng.randint(2, 3) if rng.random() < 0.1 else 1
+            span = min(span, columns - width)
+            cells.append(('colspan="' + str(span) + '"|' if span > 1 else '') + cell(rng))
+            width += span
+        lines.append('|-\n|' + '||'.join(cells) + '\n')
+    return ''.join(lines) + '|}\n'
+
+BLOCKS = {'paragraph': paragraph,
+          'indent': indent,
+          'center': center,
+          'right': right,
+          'size': size,
+          'hi': hanging,
+          'rule': rule,
+          'list': ordered_list,
+          'toc': contents,
+          'wikitable': wikitable}
+
+def parse_mix(text):
+    '''Read a mix from "name=weight,name=weight,...". Blocks that aren't named keep their weight
+    in MIX; give them 0 to leave them out.'''
+    mix = dict(MIX)
+    for item in filter(None, text.split(',')):
+        name, weight = item.split('=')
+        if name not in BLOCKS:
+            raise ValueError("Unknown block " + name + "; the blocks are "
+                             + ", ".join(sorted(BLOCKS)) + ".")
+        mix[name] = float(weight)
+    return mix
+
+def choose(rng, mix=MIX, blocks=12):
+    '''The names of about blocks blocks, picked by the weights in mix. Tables of contents go
+    first.'''
+    names = sorted(name for name in mix if mix[name] > 0)
+    weights = [mix[name] for name in names]
+    chosen = rng.choices(names, weights, k=rng.randint(blocks // 2, blocks * 3 // 2))
+    chosen.sort(key=lambda name: name != 'toc')
+    return chosen
+
+def page(rng, chosen):
+    '''One page: the page quality header, a running head and the chosen blocks.'''
+    parts = ['<noinclude><pagequality level="' + str(rng.choice([1, 3, 3, 3, 4])) +
+             '" user="Someone" /></noinclude>{{rh|left=' + rng.choice('ABCD') + '-' +
+             str(rng.randint(1, 99)) + '|right=TOP SECRET – Sensitive}}\n']
+    parts.extend(BLOCKS[name](rng) for name in chosen)
+    return ''.join(parts)
+
+def text(size, mix=MIX, seed=0, blocks=12):
+    '''Pages of text, at least size characters of them, the same ones every time for a seed. The
+    lexer takes a wikitable for a table of contents if an entry comes anywhere after it in the
+    file, so there are no tables of contents after the first wikitable.'''
+    rng = random.Random(seed)
+    pages = list()
+    length = 0
+    while length < size:
+        chosen = choose(rng, mix, blocks)
+        pages.append(page(rng, chosen))
+        length += len(pages[-1])
+        if 'wikitable' in chosen:
+            mix = dict(mix, toc=0)
+    return ''.join(pages)
+
+def write_corpus(directory, chapters=4, files=3, size=2**16, mix=MIX, seed=0):
+    '''Write chapters folders of files text files of about size characters each under
+    directory/text, numbered the way api.Document numbers them.'''
+    for chapter in range(chapters):
+        folder = os.path.join(directory, 'text', str(chapter))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        for file in range(files):
+            with codecs.open(os.path.join(folder, str(file) + '.txt'), 'w', 'utf-8') as f:
+                f.write(text(size, mix, seed * 1000003 + chapter * 1009 + file))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic corpus of Wikisource pages.")
+    parser.add_argument('directory', help="Where to write the text folder")
+    parser.add_argument('--chapters', type=int, default=4, metavar='N')
+    parser.add_argument('--files', type=int, default=3, metavar='N', help="Files per chapter")
+    parser.add_argument('--size', type=int, default=64, metavar='KB', help="Size of each file")
+    parser.add_argument('--mix', type=parse_mix, default=MIX, metavar='NAME=WEIGHT,...',
+                        help="How often each block turns up: " + ", ".join(sorted(BLOCKS)))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_corpus(args.directory, args.chapters, args.files, args.size*1024, args.mix, args.seed)
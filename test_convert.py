@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Checks that converting in parallel writes the same LaTeX as converting serially. Run with
+"python -m unittest test_convert" (or pytest) from the project folder.'''
+
+import logging, os, shutil, synthetic, tempfile, unittest, util
+from convert import Converter
+from scheduler import Scheduler
+from tokenparser import Parser
+
+class ParallelOutputTest(unittest.TestCase):
+    '''Converts a small synthetic corpus serially, by folder over several processes and page by
+    page over several processes, and compares the chapters byte for byte, or the folders a failed
+    handler left incomplete.'''
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        synthetic.write_corpus(self.directory, chapters=4, files=2, size=2**13,
+                               mix=dict(synthetic.MIX, toc=2, rule=0))
+        os.chdir(self.directory)
+    
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+    
+    def convert(self, workers=1, split_pages=False, stream_tables=False):
+        '''Convert the corpus into a fresh latex folder and return the chapters' bytes by name.
+        The folders where a handler failed are kept in self.failed.'''
+        shutil.rmtree('latex', ignore_errors=True)
+        os.mkdir('latex')
+        jobs = Scheduler(directory='text', logfile='timings.json').schedule()
+        converter = Converter(dump_tokens=False, stream_tables=stream_tables)
+        converter.convert(jobs, util.ProgressChecker(), workers, split_pages)
+        self.failed = sorted(converter.failed)
+        chapters = dict()
+        for name in os.listdir('latex'):
+            with open(os.path.join('latex', name), 'rb') as f:
+                chapters[name] = f.read()
+        return chapters
+    
+    def test_parallel_output(self):
+        serial = self.convert()
+        self.assertEqual(sorted(serial), ['0.tex', '1.tex', '2.tex', '3.tex'])
+        self.assertEqual(self.convert(workers=3), serial)
+        self.assertEqual(self.convert(workers=3, split_pages=True), serial)
+    
+    def test_streamed_tables(self):
+        # A table left open, one starting inside another and page breaks in the middle of both
+        header = '<noinclude><pagequality level="3" user="Someone" /></noinclude>'
+        rows = '|-\n|Saigon||1954\n|-\n|Hanoi||1950\n'
+        tables = ['{|\n' + rows + header + rows + '{| border="1"\n' + rows + '|}\n' + rows + '|}\n',
+                  '{|\n' + rows + header + 'The war.\n{|\n' + rows + header + rows + '|}\n',
+                  '{|\n' + rows + header + rows]
+        for chapter, table in enumerate(tables):
+            with open(os.path.join('text', str(chapter), '1.txt'), 'a') as f:
+                f.write(table)
+        serial = self.convert(stream_tables=True)
+        self.assertIn(b'xltabular', serial['0.tex'])
+        self.assertEqual(self.convert(workers=3, stream_tables=True), serial)
+        self.assertEqual(self.convert(split_pages=True, stream_tables=True), serial)
+        self.assertEqual(self.convert(workers=3, split_pages=True, stream_tables=True), serial)
+    
+    def test_failed_folders(self):
+        with open(os.path.join('text', '2', '1.txt'), 'a') as f:
+            f.write('{{rule}}\n')
+        rule = Parser.rule
+        def fail(parser, ctx):
+            raise ValueError("failed on purpose")
+        Parser.rule = fail            # Forked workers see it as well
+        logger = logging.getLogger("W2L")
+        logger.disabled = True
+        try:
+            for workers, split_pages in ((1, False), (3, False), (1, True), (3, True)):
+                self.convert(workers, split_pages)
+                self.assertEqual(self.failed, ['2'])
+        finally:
+            Parser.rule = rule
+            logger.disabled = False
+
+if __name__ == "__main__":
+    unittest.main()
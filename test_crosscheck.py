@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Cross-checks of the optimized implementations against the legacy ones kept in benchmark.py, on
+random input. Run with "python -m unittest test_crosscheck" (or pytest) from the project folder.'''
+
+import escape, random, unittest, wikitable
+from benchmark import (CELL_PIECES, ESCAPE_CHARS, TEMPLATE_PIECES, LegacyTOC, build_legacy_table,
+                       build_table, build_toc, cell_parse, convert_tokens, legacy_careful_sub,
+                       legacy_cell_escape, legacy_cell_parse, legacy_final_sub, legacy_punct,
+                       legacy_sub, legacy_toc_sub, legacy_traverse, nested_text, outline,
+                       random_table, random_text, table_tokens)
+from reparse import Reparser
+from toc import TOC
+from tokenparser import Parser
+
+class LegacyCrossCheckTest(unittest.TestCase):
+    '''Each test runs the new and the legacy implementation on the same random input, the same
+    every time.'''
+    def setUp(self):
+        self.rng = random.Random(0)
+    
+    def test_careful_sub(self):
+        reparser = Reparser()
+        for i in range(20000):
+            text = random_text(self.rng, TEMPLATE_PIECES)
+            self.assertEqual(reparser.careful_sub(text), legacy_careful_sub(text), repr(text))
+    
+    def test_traverse(self):
+        reparser = Reparser()
+        for i in range(20000):
+            text = nested_text(self.rng)
+            self.assertEqual(reparser.traverse(text), legacy_traverse(reparser, text), repr(text))
+    
+    def test_escape(self):
+        reparser = Reparser()
+        pairs = [('final_sub', legacy_final_sub, reparser.final_sub),
+                 ('cell', legacy_cell_escape, escape.CELL.sub),
+                 ('sub', legacy_sub, reparser.sub),
+                 ('toc', legacy_toc_sub, lambda text: reparser.sub(text, escape.TOC))]
+        for i in range(20000):
+            text = ''.join(self.rng.choice(ESCAPE_CHARS) for j in range(self.rng.randint(0, 20)))
+            for name, legacy, function in pairs:
+                self.assertEqual(function(text), legacy(text), name + " on " + repr(text))
+        for char in ESCAPE_CHARS:
+            self.assertEqual(escape.PUNCT.sub(char), legacy_punct(char), "punct on " + repr(char))
+    
+    def test_toc(self):
+        for i in range(200):
+            pieces = outline(self.rng, self.rng.randint(1, 40), page_list=i % 2 == 1)
+            self.assertEqual(build_toc(TOC, pieces), build_toc(LegacyTOC, pieces),
+                             repr(''.join(pieces)))
+    
+    def test_streamed_tables(self):
+        whole, streamed = Parser(), Parser(stream_tables=True)
+        for i in range(2000):
+            tokens = table_tokens(self.rng, self.rng.randint(0, 10))
+            self.assertEqual(convert_tokens(streamed, tokens).replace('{xltabular}', '{tabularx}'),
+                             convert_tokens(whole, tokens), repr(tokens))
+    
+    def test_table_model(self):
+        for i in range(2000):
+            spec = random_table(self.rng, self.rng.randint(1, 10))
+            expected = build_legacy_table(spec)
+            for stream in (False, True):
+                pieces = []
+                build_table(spec, stream, pieces.append)
+                self.assertEqual(''.join(pieces).replace('{xltabular}', '{tabularx}'), expected,
+                                 repr(spec))
+    
+    def test_cell_parse(self):
+        fast = wikitable.MARKUP.fast
+        for i in range(50000):
+            text = random_text(self.rng, CELL_PIECES, self.rng.randint(1, 10))
+            self.assertEqual(cell_parse(text), legacy_cell_parse(text), repr(text))
+        self.assertGreater(wikitable.MARKUP.fast, fast) # Some cells take the single pass
+
+if __name__ == "__main__":
+    unittest.main()
@@ -19,20 +19,29 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import logging, re
+
+import escape, logging, re
 from reparse import Reparser
 from exceptions import TOCError
 
+LINE = re.compile(r'([A-Za-z0-9]{1,4}\.\s?\|)?(?:colspan="\d"\|)?(?P<text>.*)')
+PAGE_NUMBER = re.compile(r'(?P<num>[A-Z]-\d{1,3})')
+NEWPAGE = '---NEWPAGE---'
+# easylist numbering of a level, by the first character of its first entry
+NUMBERS = {'I': 'R', 'A': 'L', 'a': 'l'}
+
 class TOC(object):
+    '''Builds a table of contents (or a page list) as an easylist. The wikitext is collected in
+    pieces as it is parsed and converted in one pass over its lines at the end.'''
     def __init__(self):
         self.reparser = Reparser()
         self.logger = logging.getLogger("W2L")
         
-        self.text = ''          # Raw wikitext
+        self.text = []          # Raw wikitext, in the pieces it was appended in
         self.lines = []
         self.levels = dict()
         self.props = ''
-        self.latex = ''
+        self.latex = []         # Lines of LaTeX
         self.is_newpage = False
         self.is_page_list = False
         self.declassified = ("\\begin{spacing}{0.7}\n\\begin{center}\n\\begin{scriptsize}\\textbf" 
@@ -40,12 +49,13 @@ class TOC(object):
         "By: NWD Date: 2011\n\\vspace{2em}\n\\end{scriptsize}\n\\end{center}\n\\end{spacing}\n")
         
     def append(self, text):
-        self.text += text
+        self.text.append(text)
         
     def begin(self):
-        ind = self.text.find("|")
-        self.text = self.text[ind:]
-        self.lines = self.text.replace('\n','').split("|-")
+        text = ''.join(self.text)
+        ind = text.find("|")
+        text = text[ind:]
+        self.lines = text.replace('\n','').split("|-")
         if len(self.lines[0]) == 0:
             self.lines.pop(0)
         self.parse()
@@ -53,7 +63,7 @@ class TOC(object):
         return self.end()
     
     def end(self):
-        latex = ('\\begin{small}\n\\begin{easylist}\n' + self.props + self.latex + 
+        latex = ('\\begin{small}\n\\begin{easylist}\n' + self.props + ''.join(self.latex) + 
                  '\\end{easylist}\n\\end{small}')
         return latex
         
@@ -61,7 +71,7 @@ class TOC(object):
         if self.is_page_list:
             page_key = sorted(list(self.levels.keys()))[-1]
             del self.levels[str(page_key)]
-        self.props += '\ListProperties(Space=-2.3mm,Space*=-2.3mm,Hang=true,Progressive*=2em,'
+        props = ['\\ListProperties(Space=-2.3mm,Space*=-2.3mm,Hang=true,Progressive*=2em,']
         num_levels = len(self.levels)
         for level in range(1,num_levels+1):
             try:
@@ -69,71 +79,45 @@ class TOC(object):
             except:
                 pass
                 self.logger.exception("Improperly-formatted table.")
-#                print(self.levels)
-#                print(val, level)
-#                print(self.lines)
             else:
-                if re.match(r'[I]', val):
-                    self.props += 'Numbers' + str(level) + '=R,'
-                    if level > 1:
-                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
-                elif re.match(r'[A]', val):
-                    self.props += 'Numbers' + str(level) + '=L,'
-                    if level > 1:
-                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
-                elif re.match(r'[1]+', val):
-                    if level > 1:
-                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
-                elif re.match(r'[a]', val):
-                    self.props += 'Numbers' + str(level) + '=l,'
-                    if level > 1:
-                        self.props += 'Hide' + str(level) + '=' + str(level-1) + ','
-                else:
-                    if level > 1:
-                        self.props += 'Hide' + str(level) + '=' + str(level) + ','
-        self.props = self.props[:-1] + ')\n'
+                if val in NUMBERS:
+                    props.append('Numbers' + str(level) + '=' + NUMBERS[val] + ',')
+                if level > 1:
+                    hidden = level if val not in NUMBERS and val != '1' else level-1
+                    props.append('Hide' + str(level) + '=' + str(hidden) + ',')
+        self.props = ''.join(props)[:-1] + ')\n'
         
     def newpage(self, line):
         self.is_newpage = True
-        ind = line.find("---NEWPAGE---")
+        ind = line.find(NEWPAGE)
         list_text = line[:ind]
         return list_text
         
     def parse(self):
         if "Page" in self.lines[0]:
             self.is_page_list = True
+        latex = self.latex
         for line in self.lines:
             if len(line) > 0:
-                if "---NEWPAGE---" in line:
+                if NEWPAGE in line:
                     line = self.newpage(line)
-                level = 0
-                ind = 0
-                while line[ind] == "|":
-                    level += 1
-                    ind += 1
+                text = line.lstrip("|")
+                level = len(line) - len(text)
                 if str(level) not in self.levels:
-                    self.levels[str(level)] = line[ind]
-                line = line[ind:]
-                r = re.match(r'([A-Za-z0-9]{1,4}\.\s?\|)?(?:colspan="\d"\|)?(?P<text>.*)', line, flags=re.MULTILINE)
+                    self.levels[str(level)] = line[level]
+                r = LINE.match(text)
                 if r != None:
                     line = r.group('text')
                 else:
                     raise TOCError
-                line = self.reparser.sub(line)
-                line = line.replace("{\\textbar}", " ")
+                line = self.reparser.sub(line, escape.TOC)
+                if self.is_page_list and r'\uline{Page}' in line:
+                    latex.append("\\hfill " + line + "\n")
+                    continue
                 if self.is_page_list:
-                    if r'\uline{Page}' in line:
-                        self.latex += "\\hfill " + line + "\n"
-                    else:
-                        line = re.sub('(?P<num>[A-Z]-\d{1,3})', '\\hfill \g<num>', line)
-                        self.latex += "@"*level + " " + line + "\n"
-                        if self.is_newpage:
-                            self.latex += "\\newpage\n"
-                            self.latex += self.declassified
-                            self.is_newpage = False
-                else:
-                    self.latex += "@"*level + " " + line + "\n"
-                    if self.is_newpage:
-                        self.latex += "\\newpage\n"
-                        self.latex += self.declassified
-                        self.is_newpage = False
\ No newline at end of file
+                    line = PAGE_NUMBER.sub(r'\\hfill \g<num>', line)
+                latex.append("@"*level + " " + line + "\n")
+                if self.is_newpage:
+                    latex.append("\\newpage\n")
+                    latex.append(self.declassified)
+                    self.is_newpage = False
@@ -520,21 +520,49 @@ class Tokenizer(object):
 #===================================================================================================
 # MISCELLANEOUS FUNCTIONS
 #===================================================================================================
-    def __init__(self):
-        '''Initiate logging, open a file to store tokens, build the lexer.'''
+    def __init__(self, dump_tokens=True):
+        '''Initiate logging, build the lexer. If dump_tokens is set, every token list is also
+        written to tokenout.txt for debugging.'''
         self.logger = logging.getLogger("W2L")
+        self.dump_tokens = dump_tokens
         self.lexer = lex.lex(module=self, reflags=re.DOTALL)
     
-    def analyze(self, data):
-        '''Read through the text file and tokenize.'''
-        self.lexer.input(data)
-        self.token_list = list()
-        with codecs.open(os.curdir + '/tokenout.txt', 'w+', 'utf-8') as tokenfile:
-            while True:
-                token = self.lexer.token()
-                if not token:
-                    break      # No more input
-                l_token = [token.type, token.value]
-                self.token_list.append(l_token)
-                tokenfile.write(str(token) + '\n')
-        return self.token_list
\ No newline at end of file
+    def analyze(self, data, stats=None):
+        '''Read through the text file and tokenize. If stats (an instrument.LexerStatistics) is
+        given, the rules that fire are counted and timed in it.'''
+        dump = list() if self.dump_tokens else None
+        token_list = self.tokenize(data, dump=dump, stats=stats)[0]
+        self.write_dump(dump)
+        return token_list
+    
+    def write_dump(self, dump):
+        '''Write the lines dumped by tokenize to tokenout.txt, if there are any.'''
+        if dump is not None:
+            with codecs.open(os.curdir + '/tokenout.txt', 'w+', 'utf-8') as tokenfile:
+                tokenfile.write(''.join(dump))
+    
+    def tokenize(self, data, start=0, end=None, state='INITIAL', dump=None, stats=None):
+        '''Tokenize data[start:end], beginning in the given lexer state. Each call lexes with a fresh
+        copy of the lexer, so no lexer state carries over between calls. The rules still see the
+        text after end, so the tokens are exactly those that lexing all of data would produce from
+        the same position and state. Returns the token list, the position lexing stopped at (past
+        end if the last token runs over it) and the lexer state there. If dump is a list, a line
+        for each token is appended to it, and if stats is given, the rules are recorded in it.'''
+        lexer = self.lexer.clone()
+        lexer.input(data)
+        lexer.lexpos = start
+        if end is not None:
+            lexer.lexlen = end
+        lexer.begin(state)
+        token_list = list()
+        next_token = lexer.token if stats is None else stats.timer(lexer)
+        while True:
+            token = next_token()
+            if not token:
+                break      # No more input
+            l_token = [token.type, token.value]
+            token_list.append(l_token)
+            if dump is not None:
+                dump.append(str(token) + '\n')
+        # The lexer steps one past the end when it runs out of input
+        return token_list, lexer.lexpos - 1, lexer.current_state()
@@ -19,37 +19,97 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import logging, re, wikitable, util
+import escape, instrument, itertools, logging, re, wikitable, util
+from time import perf_counter
 from reparse import Reparser
 from toc import TOC
 
+class ParseContext(object):
+    '''Conversion state for a single document. A new context is created for each file, so nothing
+    carries over from one file to the next and several documents can be converted at once with the
+    same Parser.'''
+    def __init__(self, output, progress):
+        self.output = output                    # OutputBuffer the LaTeX is written to
+        self.progress = progress                # util.ProgressChecker counting page quality
+        self.value = None                       # Value of the token currently being handled
+        self.indented = False                   # Inside a blockquote opened by an indent
+        self.bc = False                         # Centered text is a block (wrapped in a minipage)
+        self.row_center = False                 # Current wikitable row is centered
+        self.table = None                       # wikitable.Table being built
+        self.cell = None                        # wikitable.Cell being built
+        self.contents = None                    # TOC being built
+        self.tokens = None                      # Token list being dispatched
+        self.index = None                       # Position of the current token in it
+        self.held = None                        # Output held back until a streamed table ends
+
 class Parser(object):
-    def __init__(self, progress):
+    '''Converts token lists to LaTeX. The parser keeps no state of its own; everything about the
+    document being converted lives in the ParseContext passed to dispatch().'''
+    def __init__(self, stream_tables=False):
+        '''With stream_tables, the rows of a wikitable are written as they are parsed, to an
+        xltabular, instead of all at once at the end of the table.'''
         self.logger = logging.getLogger("W2L")
-        self.output = None
         self.reparser = Reparser()
-        self.indented = False
-        self.progress = progress
-    
-    def begin(self, outputfile):
-        self.output = outputfile
+        self.stream_tables = stream_tables
         
-    def dispatch(self, t_list):
-        for token in t_list:
-            self.value = token[1]
-            if self.value:
-                command = 'self.{0}()'.format(token[0].lower())
+    def dispatch(self, t_list, ctx):
+        '''Run the handler for each token and write the result. Returns False if a handler failed
+        and the rest of the token list was skipped.'''
+        if instrument.profile is not None:
+            return self.dispatch_profiled(t_list, ctx)
+        ctx.tokens = t_list
+        for index, token in enumerate(t_list):
+            ctx.value = token[1]
+            if ctx.value:
+                ctx.index = index
+                handler = token[0].lower()
+                try:
+                    getattr(self, handler)(ctx)
+                except:
+                    self.logger.exception("Unable to run handler " + handler);
+                    return False
+                else:
+                    self.write(ctx, ctx.value)
+        return True
+    
+    def dispatch_profiled(self, t_list, ctx):
+        '''dispatch, recording the time each handler takes and what it writes with instrument.'''
+        ctx.tokens = t_list
+        for index, token in enumerate(t_list):
+            ctx.value = token[1]
+            if ctx.value:
+                ctx.index = index
+                handler = token[0].lower()
+                position = ctx.output.position
+                start_time = perf_counter()
                 try:
-                    exec(command)
+                    getattr(self, handler)(ctx)
                 except:
-                    self.logger.exception("Unable to run command " + command);
-                    break;
+                    self.logger.exception("Unable to run handler " + handler);
+                    instrument.record(token[0], perf_counter() - start_time)
+                    return False
                 else:
-                    self.write(self.value)
+                    self.write(ctx, ctx.value)
+                instrument.record(token[0], perf_counter() - start_time,
+                                  ctx.output.position - position)
+        return True
+    
+    def skim(self, t_list, ctx):
+        '''Update the state in ctx that can carry over from one page into the next (an open indent
+        and the alignment of the current table row) the same way dispatch() would, without running
+        the handlers or writing anything.'''
+        for token in t_list:
+            if token[1]:
+                if token[0] == 'INDENT' or token[0] == 'CINDENT':
+                    ctx.indented = True
+                elif token[0] == 'WHITESPACE':
+                    if '\r' in token[1] or '\n' in token[1]:
+                        ctx.indented = False
+                elif token[0] == 'NEWROW':
+                    ctx.row_center = 'align="center"' in token[1]
                     
     def end_matter(self, contributors, outputfile):
         #TODO: Will need to add image attribution, when I get to including images.
-        self.output = outputfile
         self.logger.debug("Appending license information.")
         
         for contributor in contributors:
@@ -65,72 +125,103 @@ class Parser(object):
                    "Unported.\\\\\nhttp://creativecommons.org/licenses/by-sa/3.0/\n")
         contribs = ("\\section*{Contributors}\n" + ", ".join(contributors) + ".")
         
-        self.output.write(begin + license + contribs)
+        outputfile.write(begin + license + contribs)
                     
-    def write(self, text):
+    def write(self, ctx, text):
         if type(text) is str:
-            self.output.write(text)
+            if ctx.held is not None:
+                ctx.held.append(text)
+            else:
+                ctx.output.write(text)
+    
+    def count_columns(self, tokens, start):
+        '''Look ahead from the WIKITABLE token at start to the end of its table. Returns the number
+        of columns the table will have and whether any cell spans several, or None if the table
+        doesn't end in tokens, has no cells or another table starts before it ends.'''
+        columns = 0
+        cells = 0
+        span = None
+        multicol = False
+        for name, value in itertools.islice(tokens, start + 1, None):
+            if not value:
+                continue
+            if name == 'WIKITABLE':
+                return None
+            if name == 'TCELL':
+                span = None
+            elif name == 'WT_COLSPAN':
+                span = int(value)
+                multicol = True
+            elif name == 'E_TCELL':
+                cells += span or 1
+                span = None
+            elif name == 'NEWROW' or name == 'E_WIKITABLE':
+                columns = max(columns, cells)
+                cells = 0
+                if name == 'E_WIKITABLE':
+                    return (columns, multicol) if columns else None
+        return None
         
 #===================================================================================================
 # PARSING FUNCTIONS
 #===================================================================================================
     # TABLE FUNCTIONS        
-    def table(self):
+    def table(self, ctx):
         #TODO: TABLE
         pass
     
-    def e_table(self):
+    def e_table(self, ctx):
         #TODO: E_TABLE
         pass
     
-    def trow(self):
+    def trow(self, ctx):
         #TODO: TROW
         pass
     
-    def e_trow(self):
+    def e_trow(self, ctx):
         #TODO: E_TROW
         pass
     
-    def titem(self):
+    def titem(self, ctx):
         #TODO: TITEM
         pass
     
-    def e_titem(self):
+    def e_titem(self, ctx):
         #TODO: E_TITEM
         pass
     
-    def tnoinclude(self):
+    def tnoinclude(self, ctx):
         #TODO: TNOINCLUDE
         pass
     
-    def te_noinclude(self):
+    def te_noinclude(self, ctx):
         #TODO: TE_NOINCLUDE
         pass
     
-    def tolist(self):
+    def tolist(self, ctx):
         #TODO: TOLIST
         pass
     
-    def te_olist(self):
+    def te_olist(self, ctx):
         #TODO: TE_OLIST
         pass
     
-    def tlitem(self):
+    def tlitem(self, ctx):
         #TODO: TLITEM
         pass
     
-    def te_litem(self):
+    def te_litem(self, ctx):
         #TODO: TE_LITEM
         pass
     
-    def tforced_whitespace(self):
+    def tforced_whitespace(self, ctx):
         #TODO: TFORCED_WHITESPACE
         pass
     
     # PRE-WIKITABLE FUNCTIONS
-    def taskforce(self):
+    def taskforce(self, ctx):
         '''Shamelessly hardcoding this in. It's not worth trying to dynamically generate tikz.'''
-        self.value = ('\\vspace{10cm}\n\\begin{tabularx}{0.9\\textwidth}{ p{0.25\\textwidth}' +
+        ctx.value = ('\\vspace{10cm}\n\\begin{tabularx}{0.9\\textwidth}{ p{0.25\\textwidth}' +
                       ' >{\\centering\\arraybackslash}p{0.4\\textwidth} p{0.25\\textwidth} }\n' +
                       '\\begin{tikzpicture}\\draw (-.5,0) --(2.5,0);\\draw[ultra thick](-1,.2) ' +
                       '--(2.5,.2);\\draw (-.5,.4) --(2.5,.4);\\end{tikzpicture} & \\Large{' + 
@@ -139,351 +230,330 @@ class Parser(object):
                       '\n\end{tabularx}')
 
         
-    def ts(self):
+    def ts(self, ctx):
         '''For the {{ts}} template. This is infrequently used, so I have not generalized it much.'''
-        text = self.reparser.sub(self.value[1])
-        self.value = ('\\setlength{\\fboxrule}{' + self.value[0] + 'px}\n\\begin{center}\n\\fbox{' 
+        text = self.reparser.sub(ctx.value[1])
+        ctx.value = ('\\setlength{\\fboxrule}{' + ctx.value[0] + 'px}\n\\begin{center}\n\\fbox{' 
                       + text + '}\n\\end{center}\n\\setlength{\\fboxrule}{1pt}\n')
         
-    def toc(self):
-        self.contents = TOC()
-        self.value = ''
+    def toc(self, ctx):
+        ctx.contents = TOC()
+        ctx.value = ''
         
-    def newpage(self):
-        self.contents.append('---NEWPAGE---')
-        self.value = ''
+    def newpage(self, ctx):
+        ctx.contents.append('---NEWPAGE---')
+        ctx.value = ''
         
-    def e_toc(self):
-        self.value = self.contents.begin()
-        del self.contents
-        self.contents = TOC()
+    def e_toc(self, ctx):
+        ctx.value = ctx.contents.begin()
+        ctx.contents = TOC()
         
-    def toc_text(self):
-        self.contents.append(self.value)
-        self.value = ''
+    def toc_text(self, ctx):
+        ctx.contents.append(ctx.value)
+        ctx.value = ''
     
     # WIKITABLE FUNCTIONS
-    def wikitable(self):
-        self.table = wikitable.Table()
-        if self.value[1]:
-            self.table.format['alignment'] = 'center'
-        self.value = ''
-    
-    def e_wikitable(self):
-        self.value = self.table.end()
-        del self.table
+    def wikitable(self, ctx):
+        if ctx.held is not None:
+            # A streamed table is still open: finish it, with what was held back, first
+            ctx.output.write(ctx.table.end() + ''.join(ctx.held))
+            ctx.held = None
+        columns = self.stream_tables and self.count_columns(ctx.tokens, ctx.index)
+        if columns:
+            # Anything else written before the table ends is put after it
+            ctx.table = wikitable.Table(*columns)
+            ctx.held = list()
+        else:
+            ctx.table = wikitable.Table()
+        if ctx.value[1]:
+            ctx.table.alignment = 'center'
+        ctx.value = ''
+    
+    def e_wikitable(self, ctx):
+        ctx.value = ctx.table.end()
+        if ctx.held is not None:
+            ctx.value += ''.join(ctx.held)
+            ctx.held = None
+        ctx.table = None
         
-    def tcell(self):
-        self.cell = wikitable.Cell(self.table)
-        self.value = ''
+    def tcell(self, ctx):
+        ctx.cell = wikitable.Cell(ctx.table)
+        ctx.value = ''
         
-    def e_tcell(self):
-        self.value = self.cell.end() # Get the final text of the cell
-        self.table.append_cell(self.value) # Add the cell to the table
-        self.cell.reset() # Reset cell values for next time
-        self.value = ''
+    def e_tcell(self, ctx):
+        ctx.value = ctx.cell.end() # Get the final text of the cell
+        ctx.table.append_cell(ctx.value, ctx.cell.colspan) # Add the cell to the table
+        ctx.cell.reset() # Reset cell values for next time
+        ctx.value = ''
         
-    def format(self):
+    def format(self, ctx):
         # TODO: Add cellpadding/cellspacing?
-        if self.value[0]:                               # Table width
-            self.table.set_width(self.value[0])
-        if self.value[1]:                               # Text alignment
-            self.table.set_alignment(self.value[1])
-        if self.value[2]:                               # Border
-            self.table.format['border'] = True
-            self.table.t['hline'] = '\\hline\n'
-        self.value = ''
+        if ctx.value[0]:                               # Table width
+            ctx.table.set_width(ctx.value[0])
+        if ctx.value[1]:                               # Text alignment
+            ctx.table.set_alignment(ctx.value[1])
+        if ctx.value[2]:                               # Border
+            ctx.table.border = True
+            ctx.table.hline = '\\hline\n'
+        ctx.value = ''
 
-    def wt_colspan(self):
-        self.cell.c_format['colspan'] = self.value
-        self.table.format['multicol'] = True
-        self.value = ''
+    def wt_colspan(self, ctx):
+        ctx.cell.colspan = ctx.value
+        ctx.table.multicol = True
+        ctx.value = ''
         
-    def wt_style(self):
-        self.cell.cell_style(self.value, self.row_center)
-        self.value = ''
+    def wt_style(self, ctx):
+        ctx.cell.cell_style(ctx.value, ctx.row_center)
+        ctx.value = ''
                 
-    def newrow(self):
-        if 'align="center"' in self.value:
-            self.row_center = True
+    def newrow(self, ctx):
+        if 'align="center"' in ctx.value:
+            ctx.row_center = True
         else:
-            self.row_center = False
-        self.table.append_row()
-        self.value = ''
+            ctx.row_center = False
+        row = ctx.table.append_row()
+        if row:
+            ctx.output.write(row)
+        ctx.value = ''
     
-    def wt_file(self):
+    def wt_file(self, ctx):
         # TODO: FILES
-        self.cell.append(' FILE HERE ')
-        self.value = ''
+        ctx.cell.append(' FILE HERE ')
+        ctx.value = ''
         
-    def cell_contents(self):
-        self.cell.append(self.value)
-        self.value = ''
+    def cell_contents(self, ctx):
+        ctx.cell.append(ctx.value)
+        ctx.value = ''
         
     # PRE-HTML TOKENS
-    def internallink(self):
+    def internallink(self, ctx):
         #TODO: INTERNAL LINK
-        self.value = self.reparser.sub(self.value[2])
+        ctx.value = self.reparser.sub(ctx.value[2])
     
-    def pagequality(self):
-        self.progress.page(self.value)
-        if self.output.tell() != 0:
-            self.value = "\n\\newpage\n"
+    def pagequality(self, ctx):
+        ctx.progress.page(ctx.value)
+        ctx.output.flush()
+        if ctx.output.tell() != 0:
+            ctx.value = "\n\\newpage\n"
         else:
-            self.value = ""
+            ctx.value = ""
     
-    def declassified(self):
-        self.value = ("\\begin{spacing}{0.7}\n\\begin{center}\n\\begin{scriptsize}\\textbf" 
+    def declassified(self, ctx):
+        ctx.value = ("\\begin{spacing}{0.7}\n\\begin{center}\n\\begin{scriptsize}\\textbf" 
         "{Declassified} per Executive Order 13526, Section 3.3\\\\NND Project Number: NND 63316. " 
         "By: NWD Date: 2011\n\\end{scriptsize}\n\\end{center}\n\\end{spacing}\n")
     
-    def secret(self):
-        self.value = ('\\begin{center}\n\\small{\\uline{TOP SECRET – Sensitive}}\n\\end{center}'
+    def secret(self, ctx):
+        ctx.value = ('\\begin{center}\n\\small{\\uline{TOP SECRET – Sensitive}}\n\\end{center}'
                       '\n\\vspace{1em}\n')
         
-    def runhead(self):
+    def runhead(self, ctx):
         '''We have to call in the big guns for these ones.'''
-        self.value = self.reparser.running_header(self.value)
+        ctx.value = self.reparser.running_header(ctx.value)
     
     # HTML TOKENS
-    def olist(self):
+    def olist(self, ctx):
         '''Begin ordered list.'''
-        self.value = '\\begin{enumerate}\n'
+        ctx.value = '\\begin{enumerate}\n'
     
-    def e_olist(self):
+    def e_olist(self, ctx):
         '''End ordered list.'''
-        self.value = '\\end{enumerate}'
+        ctx.value = '\\end{enumerate}'
     
-    def litem(self):
+    def litem(self, ctx):
         '''Format list item.'''
-        self.value = "\item "
+        ctx.value = "\item "
         
-    def e_litem(self):
+    def e_litem(self, ctx):
         '''End line'''
-        self.value = "\n"
+        ctx.value = "\n"
         
-    def noinclude(self):
+    def noinclude(self, ctx):
         #TODO: NOINCLUDE
-        self.value = ""
+        ctx.value = ""
         pass
     
-    def e_noinclude(self):
+    def e_noinclude(self, ctx):
         #TODO: E_NOINCLUDE
-        self.value = ""
+        ctx.value = ""
         pass
     
-    def reflist(self):
+    def reflist(self, ctx):
         #TODO: REFLIST
         pass
     
-    def ref(self):
+    def ref(self, ctx):
         #TODO: REF
         pass
     
-    def e_ref(self):
+    def e_ref(self, ctx):
         #TODO: E_REF
         pass
     
-    def forced_whitespace(self):
+    def forced_whitespace(self, ctx):
         '''Add whitespace.'''
-        try: 
-            self.output.seek(-1, 1)
-            preceding = self.output.read(1)
-            if preceding != "\n":
-                self.value = '\\\\\n'
-            else:
-                self.value = ''
-        except:
-            pass
+        if ctx.output.last != "\n":
+            ctx.value = '\\\\\n'
+        else:
+            ctx.value = ''
     
     # CENTERED TOKENS
-    def centered(self):
+    def centered(self, ctx):
         '''Begin centered text.'''
         # TODO: Check that there is a '\\' before and after centered text
-        self.bc = True if self.value[1] else False
-        self.value = "\\begin{center}\n"
-        if self.bc:
-            self.value += "\\begin{minipage}{.5\\textwidth}\n"
+        ctx.bc = True if ctx.value[1] else False
+        ctx.value = "\\begin{center}\n"
+        if ctx.bc:
+            ctx.value += "\\begin{minipage}{.5\\textwidth}\n"
     
-    def e_centered(self):
+    def e_centered(self, ctx):
         '''End centered text.'''
-        self.output.seek(-1, 1)
-        preceding = self.output.read(1)
-        if preceding != "\n":
-            self.value = "\n"
+        if ctx.output.last != "\n":
+            ctx.value = "\n"
         else:
-            self.value = ""
-        if self.bc:
-            self.value += "\\end{minipage}\n"
-        self.value += "\\end{center}\n\n"
+            ctx.value = ""
+        if ctx.bc:
+            ctx.value += "\\end{minipage}\n"
+        ctx.value += "\\end{center}\n\n"
             
-    def c_right(self):
-        self.value = self.reparser.traverse(self.value)
+    def c_right(self, ctx):
+        ctx.value = self.reparser.traverse(ctx.value)
             
-    def a_underlined(self):
-        self.underlined()
+    def a_underlined(self, ctx):
+        self.underlined(ctx)
             
-    def left(self):
-        self.value = self.reparser.left(self.value)
+    def left(self, ctx):
+        ctx.value = self.reparser.left(ctx.value)
           
-    def right(self):
+    def right(self, ctx):
         '''Begin right-aligned text.'''
         # TODO: Check that there is a '\\' before and after centered text
-        self.value = "\\begin{flushright}\n"
+        ctx.value = "\\begin{flushright}\n"
     
-    def e_right(self):
+    def e_right(self, ctx):
         '''End centered text.'''
-        self.output.seek(-1, 1)
-        preceding = self.output.read(1)
-        if preceding == "\n":
-            self.value = "\\end{flushright}\n"
+        if ctx.output.last == "\n":
+            ctx.value = "\\end{flushright}\n"
         else:
-            self.value = "\n\\end{flushright}\n"  
+            ctx.value = "\n\\end{flushright}\n"  
     
     
     # POST-HTML TOKENS
-    def pspace(self):
+    def pspace(self, ctx):
         '''Replace {{nop}} with \\.'''
-        try: 
-            self.output.seek(-1, 1)
-            preceding = self.output.read(1)
-            if preceding != "\n" and preceding != "}":
-                self.value = '\\\\\n'
-            else:
-                self.value = ''
-        except:
-            pass
+        if ctx.output.last != "\n" and ctx.output.last != "}":
+            ctx.value = '\\\\\n'
+        else:
+            ctx.value = ''
         
-    def cindent(self):
-        self.indent()
+    def cindent(self, ctx):
+        self.indent(ctx)
     
-    def indent(self):
-        self.indented = True
-        coeff = self.value.count(":")
+    def indent(self, ctx):
+        ctx.indented = True
+        coeff = ctx.value.count(":")
         indent_width = 2 * coeff
-        self.value = "\\begin{blockquote}{" + str(indent_width) + "em}\n"
+        ctx.value = "\\begin{blockquote}{" + str(indent_width) + "em}\n"
     
-    def pagenum(self):
+    def pagenum(self, ctx):
         # TODO: PAGE NUMBER
         pass
     
-    def pent(self):
+    def pent(self, ctx):
         # TODO: NOTE
         pass
     
-    def popup(self):
-        self.value = self.reparser.sub(self.value)
+    def popup(self, ctx):
+        ctx.value = self.reparser.sub(ctx.value)
         
-    def size(self):
+    def size(self, ctx):
         '''Adjust the size of the text.'''
-        self.value = ("\\begin{" + self.value[0] + "}\n" + self.reparser.sub(self.value[1]) +
-                      " \\\\\n\\end{" + self.value[0] + "}\n")
+        ctx.value = ("\\begin{" + ctx.value[0] + "}\n" + self.reparser.sub(ctx.value[1]) +
+                      " \\\\\n\\end{" + ctx.value[0] + "}\n")
         pass
         
-    def underlined(self):
+    def underlined(self, ctx):
         '''Replace underlined text with italicized text.'''
-        self.value = "\\uline{" + self.reparser.sub(self.value) + "}"
+        ctx.value = "\\uline{" + self.reparser.sub(ctx.value) + "}"
         
-    def bolded(self):
+    def bolded(self, ctx):
         '''Bold text.'''
-        self.value = "\\textbf{" + self.reparser.sub(self.value) + "}"
+        ctx.value = "\\textbf{" + self.reparser.sub(ctx.value) + "}"
     
-    def italicized(self):
+    def italicized(self, ctx):
         '''Italicize text.'''
-        self.value = "\\textit{" + self.reparser.sub(self.value) + "}"
+        ctx.value = "\\textit{" + self.reparser.sub(ctx.value) + "}"
         
-    def wlink(self):
+    def wlink(self, ctx):
         '''Print only the display text of the wikilink.'''
         pass
     
-    def rule(self):
+    def rule(self, ctx):
         '''Horizontal rule.'''
-        if self.value[1]:
-            self.value = ("\n\\rule{\\textwidth}{" + self.value[1] + "px} \\\\\n\n")
+        if ctx.value[1]:
+            ctx.value = ("\n\\rule{\\textwidth}{" + ctx.value[1] + "px} \\\\\n\n")
         else:
-            self.value = "\\rule{\\textwidth}{1px} \\\\\n\n"
+            ctx.value = "\\rule{\\textwidth}{1px} \\\\\n\n"
         
-    def file(self):
+    def file(self, ctx):
         # TODO: FILES
-        self.value = " FILE HERE "
+        ctx.value = " FILE HERE "
         
-    def gap(self):
-        self.value = "\\hspace*{" + self.value + "}"
+    def gap(self, ctx):
+        ctx.value = "\\hspace*{" + ctx.value + "}"
         
-    def image_removed(self):
-        self.value = ("\\vfill\n\\framebox[\\textwidth][c]{%\n\\parbox{0.9\\textwidth}{%\n\\vspace{15em}\n\\center{\\large{" 
+    def image_removed(self, ctx):
+        ctx.value = ("\\vfill\n\\framebox[\\textwidth][c]{%\n\\parbox{0.9\\textwidth}{%\n\\vspace{15em}\n\\center{\\large{" 
                       + "A non-free image has been removed from this page.}}\n\\par\n\\bigskip\n" +
-                      self.value[0] + "\n\\par\n\\bigskip\nThe removed content can be viewed in " +
-                      "the original document \\href{" + self.value[1] + "}{here} (PDF).\n\\vspace{15em}}}\n\\vfill\n")
+                      ctx.value[0] + "\n\\par\n\\bigskip\nThe removed content can be viewed in " +
+                      "the original document \\href{" + ctx.value[1] + "}{here} (PDF).\n\\vspace{15em}}}\n\\vfill\n")
         
-    def hi(self):
+    def hi(self, ctx):
         # TODO: Implement hi instead of just passing along the text
-        self.value = self.reparser.sub(self.value)
+        ctx.value = self.reparser.sub(ctx.value)
     
     # BASIC TOKENS
-    def ellipses(self):
+    def ellipses(self, ctx):
         '''Convert to proper ellipsis formatting.'''
-        if self.value == "...":
-            self.value = "{\\ldots}"
+        if ctx.value == "...":
+            ctx.value = "{\\ldots}"
         else:
-            self.value = "{\\ldots}."
+            ctx.value = "{\\ldots}."
             
-    def checkbox_empty(self):
-        self.value = "\\Square~"
+    def checkbox_empty(self, ctx):
+        ctx.value = "\\Square~"
     
-    def checkbox_checked(self):
-        self.value = "\\CheckedBox~"
+    def checkbox_checked(self, ctx):
+        ctx.value = "\\CheckedBox~"
         pass
     
-    def punct(self):
+    def punct(self, ctx):
         # TODO: Figure out `` and " for quotes
         '''Write punctuation to file, escaping any characters with special functions in LaTeX.'''
-        escape = ["#", "$", "%", "&", "_", "\\"]
-        if self.value in escape: # Precede the punctuation with a backslash
-            self.value = "\\" + self.value
-        elif self.value == "°": # Replace degree symbol
-            self.value = "{\\degree}"
-        elif self.value == "–": # Replace en dash
-            self.value = "--"
-        elif self.value == "—": # Replace em dash
-            self.value = "---"
-        elif self.value == "|": # Replace pipe
-            self.value = "{\\textbar}"
-        elif self.value == "}":
-            self.value = ""
-        elif self.value == "{":
-            self.value = ""
-        elif self.value == "✓":
-            self.value = "{\\checked}"
-    
-    def word(self):
+        ctx.value = escape.PUNCT.sub(ctx.value)
+    
+    def word(self, ctx):
         # TODO: Fix large spaces after abbreviations (i.e., e.g., etc.)
         '''Write word to file, using compose codes for any accented characters.'''
-        if "é" in self.value:
-            self.value = self.value.replace("é", "\\'{e}")
+        if "é" in ctx.value:
+            ctx.value = ctx.value.replace("é", "\\'{e}")
         
-    def number(self):
+    def number(self, ctx):
         '''Write number(s) to file without changing anything.'''
         pass
         
-    def whitespace(self):
+    def whitespace(self, ctx):
         '''Replace newlines with '\\', replace tabs with spaces, leave spaces the same.''' 
-        if '\r' in self.value or '\n' in self.value:
-            if self.indented:
-                self.value = "\n\\end{blockquote}\n"
-                self.indented = False
+        if '\r' in ctx.value or '\n' in ctx.value:
+            if ctx.indented:
+                ctx.value = "\n\\end{blockquote}\n"
+                ctx.indented = False
+            elif ctx.output.last != "\n":
+                if ctx.value == '\n\n' or ctx.value==' \n\n':
+                    ctx.value = '\n\n'
+                else:
+                    ctx.value = '\\\\\n'
             else:
-                try: 
-                    self.output.seek(-1, 1)
-                    preceding = self.output.read(1)
-                    if preceding != "\n":
-                        if self.value == '\n\n' or self.value==' \n\n':
-                            self.value = '\n\n'
-                        else:
-                            self.value = '\\\\\n'
-                    else:
-                        self.value = ''
-                except:
-                    pass
+                ctx.value = ''
         else:
-            self.value = ' '
\ No newline at end of file
+            ctx.value = ' '
\ No newline at end of file
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013 Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Timing spans around the stages of a run, written out in the Chrome trace event format, which
+chrome://tracing and Perfetto (ui.perfetto.dev) can open. Nothing is recorded until enable() is
+called, and span() returns a context manager that does nothing until then.
+
+Each process keeps its own events. Worker processes append theirs to a file of their own next to
+the trace after each task they run (see flush), and save() gathers those into the trace. Times are
+taken from the wall clock, so the spans of different processes line up.
+
+Other instruments can follow the same spans by adding themselves to listeners; memprofile does, to
+take its snapshots at the same boundaries. Spans are made for them whether tracing is enabled or
+not.'''
+
+__all__ = ['enable', 'span', 'flush', 'save']
+
+import glob, json, os
+from time import time
+
+events = None                           # The events of this process while tracing is enabled
+path = None                             # Where the trace is to be saved
+listeners = list()                      # Told the name and args of each span as it starts and ends
+
+class Span(object):
+    '''A complete ('X') event, recorded when the with block it was opened by ends.'''
+    __slots__ = ['name', 'args', 'start']
+    
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+    
+    def __enter__(self):
+        for listener in listeners:
+            listener.enter(self.name, self.args)
+        self.start = time()
+        return self
+    
+    def __exit__(self, *exception):
+        end = time()
+        if events is not None:
+            pid = os.getpid()
+            events.append({'name': self.name, 'cat': 'w2l', 'ph': 'X', 'pid': pid, 'tid': pid,
+                           'ts': round(self.start*1000000),
+                           'dur': round((end - self.start)*1000000), 'args': self.args})
+        for listener in reversed(listeners):
+            listener.exit(self.name, self.args)
+        return False
+        
+class NoSpan(object):
+    '''Stands in for a Span while tracing is off.'''
+    __slots__ = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exception):
+        return False
+
+NO_SPAN = NoSpan()
+
+def enable(trace_path, name='main'):
+    '''Start recording spans in this process, to be saved to trace_path. The process is labelled
+    with name in the trace. Workers are named 'worker', and the main process removes the files any
+    workers of an earlier run left behind.'''
+    global events, path
+    path = trace_path
+    if name != 'worker':
+        for part in parts():
+            os.remove(part)
+    pid = os.getpid()
+    events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': pid,
+               'args': {'name': name + ' (' + str(pid) + ')'}}]
+
+def span(name, **args):
+    '''Return a context manager that records the time spent in its with block as a span called
+    name, with args attached. Does nothing unless tracing is enabled or something is listening.'''
+    if events is None and not listeners:
+        return NO_SPAN
+    return Span(name, args)
+
+def flush():
+    '''Append the events recorded since the last flush to this process's own file next to the
+    trace. Only worker processes need to; does nothing unless tracing is enabled.'''
+    if events:
+        with open(path + '.' + str(os.getpid()), 'a') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        del events[:]
+
+def save():
+    '''Write the events of this process and those flushed by any other to the trace, and remove
+    the files of the other processes.'''
+    trace = list(events)
+    for part in parts():
+        with open(part) as f:
+            trace.extend(json.loads(line) for line in f)
+        os.remove(part)
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+def parts():
+    '''The files the other processes flushed their events to.'''
+    return [part for part in glob.glob(glob.escape(path) + '.*')
+            if part.rsplit('.', 1)[1].isdigit()]
@@ -19,6 +19,23 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import json, threading, tracing
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import time
+from output import AtomicFile
+
+STATUS_NAMES = ["Pages without text", "Pages that have not been proofread", "Problematic pages",
+                "Proofread pages", "Validated pages"]
+STATUS_KEYS = ['without_text', 'not_proofread', 'problematic', 'proofread', 'validated']
+
+def percent(count, total):
+    return round(100*count/total, 2) if total else 0.0
+
+def rate(count, seconds):
+    '''count per second, or None if no time was taken.'''
+    return count/seconds if seconds else None
+
 def findall(string, substring, start_ind=0, end_ind=None):
     indexes = []
     if not end_ind:
@@ -32,25 +49,229 @@ def findall(string, substring, start_ind=0, end_ind=None):
             break
     return indexes
 
+class LRUMemo(object):
+    '''Remembers what a function returned for the last size different arguments it was called
+    with, forgetting the least recently used first. A size of 0 remembers nothing. The results
+    are only touched under a lock, so several threads can share a memo; the function itself runs
+    outside it, so it can call the memo again.'''
+    def __init__(self, size=4096):
+        self.size = size
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def call(self, function, key, *args):
+        '''Return function(*args), or what it returned before for the same key.'''
+        with self.lock:
+            if key in self.results:
+                self.hits += 1
+                self.results.move_to_end(key)
+                return self.results[key]
+            self.misses += 1
+        result = function(*args)
+        with self.lock:
+            if self.size:
+                self.results[key] = result
+                while len(self.results) > self.size:
+                    self.results.popitem(last=False)
+                    self.evictions += 1
+        return result
+    
+    def resize(self, size):
+        with self.lock:
+            self.size = size
+            while len(self.results) > size:
+                self.results.popitem(last=False)
+                self.evictions += 1
+    
+    def counts(self):
+        return [self.hits, self.misses, self.evictions]
+
+def memoized(memo):
+    '''Decorator for a method whose result only depends on its arguments, not on the object, so
+    that the objects of the class can share memo.'''
+    def decorate(method):
+        def wrapper(self, *args):
+            return memo.call(method, args, self, *args)
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        wrapper.memo = memo
+        return wrapper
+    return decorate
+
 class ProgressChecker(object):
-    '''
+    '''Counts what a run converted and how fast. Pages are counted by their proofreading status:
     0: Without text
     1: Not proofread
     2: Problematic
     3: Proofread
     4: Validated
-    '''
+    
+    As well as the pages, it keeps the tokens parsed, the bytes written and the time taken for
+    each chapter, how long each stage of the run took, and the hits and misses of the caches and
+    memos. get_statistics() prints them; save_json() and save_prometheus() export them.'''
     def __init__(self):
         self.status = [0]*5
+        self.memos = dict()     # [hits, misses, evictions] of each memoized function, by name
+        self.profile = dict()   # [calls, seconds, longest, written] by handler (see instrument)
+        self.chapters = dict()  # [pages, tokens, bytes written, seconds] of each chapter, by folder
+        self.stages = dict()    # Seconds taken by each stage of the run, by name
+        self.caches = dict()    # [hits, misses] of each cache, by name
     
     def get_statistics(self):
         num_pages = sum(self.status)
         print("Number of pages parsed: " + str(num_pages))
-        print("Pages without text: " + str(self.status[0]) + " (" + str(round((100*self.status[0]/num_pages), 2)) + "%)")
-        print("Pages that have not been proofread: " + str(self.status[1]) + " (" + str(round((100*self.status[1]/num_pages), 2)) + "%)")
-        print("Problematic pages: " + str(self.status[2]) + " (" + str(round((100*self.status[2]/num_pages), 2)) + "%)")
-        print("Proofread pages: " + str(self.status[3]) + " (" + str(round((100*self.status[3]/num_pages), 2)) + "%)")
-        print("Validated pages: " + str(self.status[4]) + " (" + str(round((100*self.status[4]/num_pages), 2)) + "%)")
+        for name, count in zip(STATUS_NAMES, self.status):
+            print(name + ": " + str(count) + " (" + str(percent(count, num_pages)) + "%)")
+        pages, tokens, written = self.totals()
+        seconds = self.seconds()
+        if seconds:
+            print("Converted " + str(round(pages/seconds, 2)) + " pages, " +
+                  str(round(tokens/seconds)) + " tokens and " + str(round(written/seconds)) +
+                  " bytes per second.")
+        for name in sorted(self.stages):
+            print("Stage " + name + ": " + str(round(self.stages[name], 2)) + " seconds")
+        for name in sorted(self.caches):
+            hits, misses = self.caches[name]
+            print("Cache " + name + ": " + str(hits) + " hits, " + str(misses) + " misses (" +
+                  str(percent(hits, hits + misses)) + "% hit rate)")
+        for name in sorted(self.memos):
+            hits, misses, evictions = self.memos[name]
+            print("Memo " + name + ": " + str(hits) + " hits, " + str(misses) + " misses (" +
+                  str(percent(hits, hits + misses)) + "% hit rate), " + str(evictions) + " evicted")
+    
+    def merge(self, other):
+        '''Add the page counts collected by another ProgressChecker (e.g. from a worker process).'''
+        for index, count in enumerate(other.status):
+            self.status[index] += count
+        self.count_memos(other.memos)
+        self.count_profile(other.profile)
+        for folder, counts in other.chapters.items():
+            self.chapter(folder, *counts)
+        for name, seconds in other.stages.items():
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, (hits, misses) in other.caches.items():
+            self.count_cache(name, hits, misses)
+    
+    def count_memos(self, memos, before=None):
+        '''Add the counts of memos (by name), less those in before if given.'''
+        for name, counts in memos.items():
+            total = self.memos.setdefault(name, [0, 0, 0])
+            for index, count in enumerate(counts):
+                total[index] += count - (before[name][index] if before else 0)
+    
+    def count_profile(self, profile):
+        '''Add the handler timings in profile, as collected by instrument.'''
+        for name, counts in profile.items():
+            total = self.profile.setdefault(name, [0, 0.0, 0.0, 0])
+            total[0] += counts[0]
+            total[1] += counts[1]
+            total[2] = max(total[2], counts[2])
+            total[3] += counts[3]
+    
+    def count_cache(self, name, hits, misses):
+        total = self.caches.setdefault(name, [0, 0])
+        total[0] += hits
+        total[1] += misses
+    
+    def chapter(self, folder, pages, tokens, written, seconds=0.0):
+        '''Add pages, tokens and bytes written, and the seconds they took, to a chapter. Chapters
+        converted page by page have no time of their own.'''
+        total = self.chapters.setdefault(folder, [0, 0, 0, 0.0])
+        total[0] += pages
+        total[1] += tokens
+        total[2] += written
+        total[3] += seconds
+    
+    @contextmanager
+    def stage(self, name, **args):
+        '''Time the with block as the stage name, and trace it as a span with args.'''
+        start_time = time()
+        with tracing.span(name, **args):
+            yield
+        self.stages[name] = self.stages.get(name, 0.0) + time() - start_time
+    
+    def totals(self):
+        '''The pages, tokens and bytes written, in all chapters.'''
+        totals = [0, 0, 0]
+        for counts in self.chapters.values():
+            for index in range(3):
+                totals[index] += counts[index]
+        return totals
+    
+    def seconds(self):
+        '''How long converting took: the convert stage if it was timed, the chapters otherwise.'''
+        if 'convert' in self.stages:
+            return self.stages['convert']
+        return sum(counts[3] for counts in self.chapters.values())
+    
+    def metrics(self):
+        '''Everything collected, as a dict that can be written as JSON.'''
+        pages, tokens, written = self.totals()
+        seconds = self.seconds()
+        chapters = dict()
+        for folder, counts in self.chapters.items():
+            chapters[folder] = {'pages': counts[0], 'tokens': counts[1], 'bytes': counts[2],
+                                'seconds': counts[3],
+                                'pages_per_second': rate(counts[0], counts[3]),
+                                'tokens_per_second': rate(counts[1], counts[3]),
+                                'bytes_per_second': rate(counts[2], counts[3])}
+        return {'pages': dict(zip(STATUS_KEYS, self.status)),
+                'tokens': tokens,
+                'bytes': written,
+                'seconds': seconds,
+                'pages_per_second': rate(sum(self.status), seconds),
+                'tokens_per_second': rate(tokens, seconds),
+                'bytes_per_second': rate(written, seconds),
+                'chapters': chapters,
+                'stages': dict(self.stages),
+                'caches': {name: {'hits': hits, 'misses': misses,
+                                  'hit_rate': rate(hits, hits + misses)}
+                           for name, (hits, misses) in self.caches.items()},
+                'memos': {name: {'hits': hits, 'misses': misses, 'evictions': evictions,
+                                 'hit_rate': rate(hits, hits + misses)}
+                          for name, (hits, misses, evictions) in self.memos.items()}}
+    
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.metrics(), f, indent=2, sort_keys=True)
+    
+    def save_prometheus(self, path):
+        '''Write the metrics as a Prometheus textfile (for node_exporter's textfile collector). The
+        file is replaced in one go, so the collector never reads half of it.'''
+        metrics = self.metrics()
+        lines = list()
+        def gauge(name, help, samples):
+            lines.append('# HELP w2l_' + name + ' ' + help)
+            lines.append('# TYPE w2l_' + name + ' gauge')
+            for labels, value in samples:
+                label = ','.join(key + '="' + str(text) + '"' for key, text in labels)
+                lines.append('w2l_' + name + ('{' + label + '}' if label else '') + ' ' +
+                             ('NaN' if value is None else repr(float(value))))
+        gauge('pages', "Pages parsed in the last run, by proofreading status.",
+              [([('status', key)], count) for key, count in zip(STATUS_KEYS, self.status)])
+        gauge('tokens', "Tokens parsed in the last run.", [([], metrics['tokens'])])
+        gauge('output_bytes', "Bytes of LaTeX written in the last run.", [([], metrics['bytes'])])
+        gauge('convert_seconds', "Seconds the last run took to convert.",
+              [([], metrics['seconds'])])
+        for unit in ('pages', 'tokens', 'bytes'):
+            gauge(unit + '_per_second', "The " + unit + " converted per second in the last run.",
+                  [([], metrics[unit + '_per_second'])])
+            gauge('chapter_' + unit + '_per_second', "The " + unit + " converted per second in "
+                  "each chapter in the last run.",
+                  [([('chapter', folder)], chapter[unit + '_per_second'])
+                   for folder, chapter in sorted(metrics['chapters'].items())
+                   if chapter['seconds']])
+        gauge('stage_seconds', "Seconds each stage of the last run took.",
+              [([('stage', name)], seconds) for name, seconds in sorted(self.stages.items())])
+        gauge('cache_hit_ratio', "The share of lookups each cache and memo answered.",
+              [([('cache', name)], counts['hit_rate'])
+               for name, counts in sorted(list(metrics['caches'].items()) +
+                                          list(metrics['memos'].items()))])
+        with AtomicFile(path) as f:
+            f.write('\n'.join(lines) + '\n')
     
     def page(self, level):
         index = int(level)
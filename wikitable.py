@@ -19,150 +19,185 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-__all__ = ['Table', 'Cell']
+__all__ = ['Table', 'Row', 'Cell']
 
-import re
-from collections import OrderedDict
+import escape
+from rewrite import Rewriter, Rule
 
-class Table(object):
+# The markup substitutions of Cell.parse, in the order they used to be applied one by one. &nbsp;
+# is bare since the bold rule takes a space in front of it along, italics are a boundary rule
+# since the bold rule runs first and could take apostrophes from either end, and the rules with
+# their delimiters in groups have them in non-capturing ones, so the groups hold only text.
+MARKUP = Rewriter([Rule(r'\[{2}(?:(.*?)\|)?(?P<text>.*?)\]{2}', r'\g<text>', bare=True),
+                   Rule(r'\{{2}popup\snote\|(.*?)\|(?P<text>.*?)\}{2}', r'\g<text>', bare=True),
+                   Rule(r'&nbsp;', ' ', bare=True),
+                   Rule(r'\{{2}larger\|(?P<text>.*?)\}{2}', r'\\begin{large}\g<text>\\end{large}'),
+                   Rule(r'{{2}x-smaller(?:\sblock)?\|(?P<text>.*?)\}{2}',
+                        r'\\begin{footnotesize}\g<text>\\end{footnotesize}'),
+                   Rule(r'<s>(?P<text>.*?)</s>', r'\\sout{\g<text>}'),
+                   Rule(r"\s?'''(?P<text>.*?)'''", r'\\textbf{\g<text>}'),
+                   Rule(r"''(?P<text>.*?)''", r'\\textit{\g<text>}', boundary=True),
+                   Rule(r'(?:\{{2}u\||<u>)(?P<text>.*?)(?:\}{2}|</u>)', r'\\uline{\g<text>}'),
+                   Rule(r'<br\s?/?>', r' \\newline ')],
+                  forbidden=r"[{}[\]]|''|<br|</?[su]>|&nbsp;", boundary="'<",
+                  markers=r"\{\{|\}\}|\[\[|\]\]|''|<br|</?[su]>|&nbsp;")
+
+class Row(object):
+    '''The cells of one table row, and the number of columns each of them spans.'''
+    __slots__ = ('cells', 'spans', 'width')
+    
     def __init__(self):
-        # Text containing the full table that will be returned
-        self.table = ''
+        self.cells = []                         # LaTeX of each cell
+        self.spans = None                       # Colspan of each cell (as written, None for one
+                                                # column), once any cell has one
+        self.width = 0                          # Number of columns the row spans in all
         
-        # Storage for various parts of the table. These are all strings that will later be
-        # concatenated in order.
-        self.t = OrderedDict()
-        self.t['begin'] = '\\begin{small}\n\\begin{spacing}{0.8}\n\\begin{tabularx}' # Begin table environment
-        self.t['width'] = '{\\textwidth}'       # Width of the full table
-        self.t['table_spec'] = ''               # Table column specifications
-        self.t['hline'] = ''                    # A beginning /hline in case the table is bordered
-        self.t['table_text'] = ''               # self.rows in its final text form
-        self.t['end'] = '\\end{tabularx}\\\\\n\\end{spacing}\n\\end{small}\n' # End table environment
-        
-        # Storage that is useful in creating the tables, but don't contain the final strings.
-        self.rows = []                          # List containing each row of the table
-        self.row_entries = []                   # List containing each entry in the row
+    def append(self, cell, colspan=None):
+        if colspan:
+            if self.spans is None:
+                self.spans = [None]*len(self.cells)
+            self.spans.append(colspan)
+            self.width += int(colspan)
+        else:
+            if self.spans is not None:
+                self.spans.append(None)
+            self.width += 1
+        self.cells.append(cell)
+
+class Table(object):
+    '''A wikitable converted to a tabularx. The number of columns is kept up to date as rows are
+    added, so the table is written out in one go at the end. Given the number of columns up front,
+    the table is streamed instead: it becomes an xltabular (which can break across pages), and
+    append_row returns the LaTeX of each row as it is completed rather than keeping it.'''
+    __slots__ = ('stream', 'written', 'environment', 'width', 'hline', 'rows', 'row', 'twidth',
+                 'border', 'multicol', 'colnum', 'alignment', 'contents')
+    
+    def __init__(self, columns=None, multicol=False):
+        self.stream = columns is not None      # Rows are returned as they are completed
+        self.written = 0                        # Number of rows returned so far
+        self.environment = 'xltabular' if self.stream else 'tabularx'
+        self.width = '{\\textwidth}'            # Width of the full table
+        self.hline = ''                         # A beginning /hline in case the table is bordered
+        self.rows = []                          # Rows of the table, unless it is streamed
+        self.row = Row()                        # Row being built
         
         # Table format settings, initialized with the default values
-        self.format = dict()
-        self.format['twidth'] = 1               # Width of entire table as coefficient of /textwidth
-        self.format['border'] = False           # Entire table is bordered
-        self.format['multicol'] = False         # True if table contains ANY multicolumns
-        self.format['colnum'] = None            # Number of columns in the table
-        self.format['colwidth'] = None          # Width of each col in multicolumn table as coefficient of /textwidth
-        self.format['alignment'] = 'left'       # Text alignment of ALL the cells
-        self.format['contents'] = False         # Is the table a contents table?
+        self.twidth = 1                         # Width of entire table as coefficient of /textwidth
+        self.border = False                     # Entire table is bordered
+        self.multicol = multicol                # True if table contains ANY multicolumns
+        self.colnum = columns                   # Number of columns in the table
+        self.alignment = 'left'                 # Text alignment of ALL the cells
+        self.contents = False                   # Is the table a contents table?
 
-    def append_cell(self, cell):
+    def append_cell(self, cell, colspan=None):
         '''Add a fully-formatted cell to the table.'''
-        self.row_entries.append(cell)
+        self.row.append(cell, colspan)
         
     def append_row(self):
-        if len(self.row_entries) > 0:
-            self.rows.append(self.row_entries)
-        self.row_entries = []
+        '''End the current row. When streaming, returns its LaTeX (preceded by the beginning of
+        the table, for the first row); otherwise returns an empty string.'''
+        row = self.row
+        if not row.cells:
+            return ''
+        self.row = Row()
+        if not self.stream:
+            self.rows.append(row)
+            if self.colnum is None or row.width > self.colnum:
+                self.colnum = row.width
+            return ''
+        text = self.row_text(row)
+        if self.written == 0:
+            text = self.head() + text
+        self.written += 1
+        return text
+    
+    def empty(self):
+        '''True if no cell has been added to the table yet.'''
+        return not self.rows and not self.written and not self.row.cells
         
     def end(self):
-        '''Perform the final formatting and concatenation, return the LaTeX table to write to
-        the file.'''
-        # Append last row if necessary
-        if len(self.row_entries) > 0:
-            self.rows.append(self.row_entries)
-        # Determine column length
-        if not self.format['multicol']:
-            self.set_columns()
-            for row in self.rows:
-                while len(row) < self.format['colnum']:
-                    row.append(' ')
-        # Adjust table if it contains multicolumns
-        if self.format['multicol']:
-            self.multicolumn()
-        # Add table_spec
-        if not self.format['contents']:
-            if self.format['border']:
-                    self.t['table_spec'] = '{|*{' + str(self.format['colnum']) + '}{X|}}\n'
-            else:
-                    self.t['table_spec'] = '{*{' + str(self.format['colnum']) + '}{X}}\n'
+        '''Return the LaTeX table to write to the file. When streaming, only what hasn't been
+        returned by append_row yet.'''
+        text = self.append_row()
+        if self.stream and self.written:
+            return text + self.tail()
+        return self.head() + ''.join([self.row_text(row) for row in self.rows]) + self.tail()
+    
+    def head(self):
+        '''The beginning of the table, up to the first row.'''
+        return ('\\begin{small}\n\\begin{spacing}{0.8}\n\\begin{' + self.environment + '}'
+                + self.width + self.table_spec() + self.hline)
+    
+    def tail(self):
+        return '\\end{' + self.environment + '}\\\\\n\\end{spacing}\n\\end{small}\n'
+    
+    def table_spec(self):
+        if self.border and not self.contents:
+            return '{|*{' + str(self.colnum) + '}{X|}}\n'
+        return '{*{' + str(self.colnum) + '}{X}}\n'
+    
+    def row_text(self, row):
+        '''The LaTeX of one row, padded to the width of the table (or with its multicolumns
+        formatted).'''
+        if self.multicol:
+            cells = self.multicolumn(row)
+        elif row.width < self.colnum:
+            cells = row.cells + [' ']*(self.colnum - row.width)
         else:
-            self.t['table_spec'] = '{*{' + str(self.format['colnum']) + '}{X}}\n'
-        # Combine self.rows into string
-        for row in self.rows:
-            if self.format['border']:
-                self.t['table_text'] += ' & '.join(row) + ' \\\\ \\hline \n'
-            else:
-                self.t['table_text'] += ' & '.join(row) + ' \\\\\n'
-        for value in self.t:
-            self.table += self.t[value]
-        return self.table
+            cells = row.cells
+        if self.border:
+            return ' & '.join(cells) + ' \\\\ \\hline \n'
+        return ' & '.join(cells) + ' \\\\\n'
     
-    def multicolumn(self):
-        # Find number of columns in the table
-        for row in self.rows:
-            cols = int()
-            for member in row:
-                if type(member) is list:
-                    cols += int(member[0])
-                else:
-                    cols += 1
-            if not self.format['colnum'] or cols > self.format['colnum']:
-                self.format['colnum'] = cols
-        # Add multicolumn formatting
-        for i in range(len(self.rows)):
-            new_row = []
-            for ind, member in enumerate(self.rows[i]):
-                arw = '2' if ind==0 else ''
-                if type(member) is list:
-                    if self.format['border']:
-                        new_row.append('\\multicolumn{' + member[0] + '}{|p{\\dimexpr' +
-                                       str(int(member[0])/self.format['colnum']) +
-                                       '\\linewidth-2\\tabcolsep-' + arw + '\\arrayrulewidth}|}{'
-                                       + member[1] + '}')
-                    else:
-                        new_row.append('\\multicolumn{' + member[0] + '}{p{\\dimexpr' +
-                                       str(int(member[0])/self.format['colnum']) +
-                                       '\\linewidth-2\\tabcolsep-' + arw + '\\arrayrulewidth}}{'
-                                       + member[1] + '}')
+    def multicolumn(self, row):
+        '''Add multicolumn formatting to the cells of a row that span several columns.'''
+        if row.spans is None:
+            return row.cells
+        cells = []
+        for ind, (cell, span) in enumerate(zip(row.cells, row.spans)):
+            arw = '2' if ind==0 else ''
+            if span:
+                if self.border:
+                    cells.append('\\multicolumn{' + span + '}{|p{\\dimexpr' +
+                                 str(int(span)/self.colnum) +
+                                 '\\linewidth-2\\tabcolsep-' + arw + '\\arrayrulewidth}|}{'
+                                 + cell + '}')
                 else:
-                    new_row.append(member)
-            self.rows[i] = new_row
+                    cells.append('\\multicolumn{' + span + '}{p{\\dimexpr' +
+                                 str(int(span)/self.colnum) +
+                                 '\\linewidth-2\\tabcolsep-' + arw + '\\arrayrulewidth}}{'
+                                 + cell + '}')
+            else:
+                cells.append(cell)
+        return cells
         
     def set_alignment(self, a):
         if a == 'center':
-            self.format['alignment'] = 'center'
-    
-    def set_columns(self):
-        '''Set columns only for tables without multicolumns.'''
-        for row in self.rows:
-            if self.format['colnum'] == None or len(row) > self.format['colnum']:
-                self.format['colnum'] = len(row)
+            self.alignment = 'center'
     
     def set_width(self, w):
         w = round(float(w)/100, 2)
         if w == 1:
-            self.format['twidth'] = 1
+            self.twidth = 1
         elif w < .7:
-            self.format['twidth'] = 0.7
-            self.t['width'] = '{0.7\\textwidth}'
+            self.twidth = 0.7
+            self.width = '{0.7\\textwidth}'
         else:
-            self.format['twidth'] = w
-            self.t['width'] = '{' + str(w) + '\\textwidth}'
+            self.twidth = w
+            self.width = '{' + str(w) + '\\textwidth}'
         
 class Cell(object):
+    __slots__ = ('table', 'cell', 'colspan', 'border', 'center')
+    
     def __init__(self, table):
         # TODO: Though "center" is being stored, it is not being implemented in any way.
         self.table = table                      # The table this cell will be a part of
         self.cell = ''                          # The cell string
         
-        # Row format settings, initialized with the default values
-        self.r_format = dict()
-        self.r_format['center'] = False
-        
         # Cell format settings, initialized with the default values
-        self.c_format = dict()
-        self.c_format['colspan'] = None         # Number of columns to span
-        self.c_format['border'] = None          # Border around just this cell?
-        self.c_format['center'] = False         # Center just this cell?
-    
+        self.colspan = None                     # Number of columns to span
+        self.border = None                      # Border around just this cell?
+        self.center = False                     # Center just this cell?
     
     def append(self, text):
         self.cell += text
@@ -170,16 +205,16 @@ class Cell(object):
     def cell_style(self, style, row_center=False):
         # TODO: Allow border-left/right: 0px, if possible.
         if 'border: 1px solid' in style:
-            self.c_format['border'] = True
+            self.border = True
         if 'text-align: center' in style or row_center:
-            self.c_format['center'] = True
+            self.center = True
         
     def end(self):
         '''Format and concatenate the cell, return it so it can be appended to the table.'''
         self.parse()
-        if len(self.table.rows) == 0 and len(self.table.row_entries) == 0:
+        if self.table.empty():
             if self.cell == "I.":
-                self.table.format['contents'] = True
+                self.table.contents = True
         return self.cell
     
     def parse(self):
@@ -188,31 +223,11 @@ class Cell(object):
             self.cell = self.cell[2:]
         elif '  |' in self.cell [0:3]:
             self.cell = self.cell[3:]
-        self.cell = re.sub(r'\[{2}(?:(.*?)\|)?(?P<text>.*?)\]{2}', r'\g<text>', self.cell)
-        self.cell = re.sub(r'\{{2}popup\snote\|(.*?)\|(?P<text>.*?)\}{2}', r'\g<text>', self.cell)
-        self.cell = re.sub(r'&nbsp;', ' ', self.cell)
-        self.cell = re.sub(r'\{{2}larger\|(?P<text>.*?)\}{2}',
-                              r'\\begin{large}\g<text>\\end{large}', self.cell)
-        self.cell = re.sub(r'{{2}x-smaller(?:\sblock)?\|(?P<text>.*?)\}{2}',
-                              r'\\begin{footnotesize}\g<text>\\end{footnotesize}', self.cell)
-        self.cell = re.sub(r'<s>(?P<text>.*?)</s>', r'\\sout{\g<text>}', self.cell)
-        self.cell = re.sub(r"\s?'''(?P<text>.*?)'''", r'\\textbf{\g<text>}', self.cell)
-        self.cell = re.sub(r"('')(?P<text>.*?)('')", r'\\textit{\g<text>}',
-                           self.cell)
-        self.cell = re.sub(r'(\{{2}u\||<u>)(?P<text>.*?)(\}{2}|</u>)', r'\\uline{\g<text>}',
-                           self.cell)
-        self.cell = re.sub(r'<br\s?/?>', r' \\newline ', self.cell)
-        self.cell = self.cell.replace("#", "\#").replace("$", "\$").replace("%", "\%")
-        self.cell = self.cell.replace("_", "\_").replace("^", "\^").replace("~", "\~")
-        self.cell = self.cell.replace("&", "\&").replace("□", "\\Square~")
-        self.cell = self.cell.replace("▣", "\\CheckedBox~").replace("|", "{\\textbar}")
-        self.cell = self.cell.replace("–", "--").replace("—", "---").replace("✓", "{\\checked}")
-        if self.c_format['border']:
+        self.cell = escape.CELL.sub(MARKUP.sub(self.cell))
+        if self.border:
             self.cell = '\\fbox{' + self.cell + '}'
-        if self.c_format['colspan']:
-            self.cell = [self.c_format['colspan'], self.cell]
     
     def reset(self):
         '''Resets only the cell details; retains row information.'''
-        self.cell = ['', '', '']
-        self.c_format['colspan'] = None
\ No newline at end of file
+        self.cell = ''
+        self.colspan = None
\ No newline at end of file